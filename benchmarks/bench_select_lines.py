@@ -0,0 +1,44 @@
+"""Time metadata.select_lines over a large, selector-heavy recipe on several platforms.
+
+Run from the repository root:
+
+    python benchmarks/bench_select_lines.py [--lines N] [--repeat N]
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import timeit
+
+from conda_build.config import Config
+from conda_build.metadata import ns_cfg, select_lines
+
+SUBDIRS = ('linux-64', 'linux-32', 'linux-ppc64le', 'osx-64', 'win-64', 'win-32')
+SELECTORS = ('linux', 'osx', 'win', 'unix', 'win and py27', 'linux64 or osx',
+             'not win and py3k', 'py >= 35', 'np >= 111', 'ppc64le', 'x86_64 and not osx')
+
+
+def make_recipe(n_lines):
+    lines = []
+    for i in range(n_lines):
+        selector = SELECTORS[i % len(SELECTORS)]
+        lines.append('    - dependency{0} >={0}.0  # [{1}]'.format(i, selector))
+        lines.append('    - plain{0}'.format(i))
+    return '\n'.join(lines)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('--lines', type=int, default=2000, help='selector lines in the recipe')
+    p.add_argument('--repeat', type=int, default=20, help='parses per platform')
+    args = p.parse_args()
+
+    recipe = make_recipe(args.lines)
+    for subdir in SUBDIRS:
+        platform, arch = subdir.split('-', 1)
+        namespace = ns_cfg(Config(_platform=platform, _arch=arch))
+        elapsed = timeit.timeit(lambda: select_lines(recipe, namespace), number=args.repeat)
+        print('{:15s} {:8.2f} ms/parse'.format(subdir, elapsed * 1000 / args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,9 @@ def render(recipe_path, config=None, variants=None, permit_unsatisfiable_variant
     """Given path to a recipe, return the MetaData object(s) representing that recipe, with jinja2
        templates evaluated.
 
+    Set render_processes (on config, or as a keyword argument) to render variants on that many
+    worker processes.
+
     Returns a list of (metadata, needs_download, needs_reparse in env) tuples"""
     from conda_build.render import render_recipe, finalize_metadata
     from conda_build.exceptions import DependencyNeedsBuildingError
@@ -275,7 +278,7 @@ def convert(package_file, output_dir=".", show_imports=False, platforms=None, fo
     portable, such as pure python, or header-only C/C++ libraries."""
     from .convert import conda_convert
     platforms = _ensure_list(platforms)
-    if package_file.endswith('tar.bz2'):
+    if package_file.endswith(('tar.bz2', '.conda')):
         return conda_convert(package_file, output_dir=output_dir, show_imports=show_imports,
                              platforms=platforms, force=force, verbose=verbose, quiet=quiet,
                              dry_run=dry_run, dependencies=dependencies)
@@ -294,11 +297,12 @@ def test_installable(channel='defaults'):
 
 
 def inspect_linkages(packages, prefix=_sys.prefix, untracked=False, all_packages=False,
-                     show_files=False, groupby='package', sysroot=''):
+                     show_files=False, groupby='package', sysroot='', verify=False):
     from .inspect import inspect_linkages
     packages = _ensure_list(packages)
     return inspect_linkages(packages, prefix=prefix, untracked=untracked, all_packages=all_packages,
-                            show_files=show_files, groupby=groupby, sysroot=sysroot)
+                            show_files=show_files, groupby=groupby, sysroot=sysroot,
+                            verify=verify)
 
 
 def inspect_objects(packages, prefix=_sys.prefix, groupby='filename'):
@@ -344,7 +348,13 @@ def create_metapackage(name, version, entry_points=(), build_string=None, build_
                               license_name=license_name, summary=summary, config=config)
 
 
-def update_index(dir_paths, config=None, force=False, check_md5=False, remove=False):
+def update_index(dir_paths, config=None, force=False, check_md5=False, remove=False,
+                 threads=None, compact=False):
+    """Update repodata.json, current_repodata.json and their compressed variants in each of
+    dir_paths.
+
+    threads is the number of worker processes used to read changed packages.  By default,
+    packages are read serially.  compact=True writes json without indentation."""
     from locale import getpreferredencoding
     import os
     from .conda_interface import PY3
@@ -359,4 +369,5 @@ def update_index(dir_paths, config=None, force=False, check_md5=False, remove=Fa
 
     for path in dir_paths:
         update_index(path, force=force, check_md5=check_md5, remove=remove, verbose=config.verbose,
-                     locking=config.locking, timeout=config.timeout)
+                     locking=config.locking, timeout=config.timeout, threads=threads,
+                     compact=compact)
@@ -5,7 +5,9 @@ from __future__ import absolute_import, division, print_function
 
 import codecs
 from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import fnmatch
+from functools import partial
 from glob import glob
 import io
 import json
@@ -52,7 +54,9 @@ import conda_build.os_utils.external as external
 from conda_build.post import (post_process, post_build,
                               fix_permissions, get_build_metadata)
 
-from conda_build.index import update_index
+from conda_build.conda_format import create_conda_pkg, is_conda_pkg, package_extension
+from conda_build.index import (add_packages_to_index, deferred_index_updates,
+                               ensure_valid_channel, update_index)
 from conda_build.exceptions import indent, DependencyNeedsBuildingError
 from conda_build.variants import (set_language_env_vars, dict_of_lists_to_list_of_dicts,
                                   get_package_variants)
@@ -91,67 +95,127 @@ def create_post_scripts(m):
         os.chmod(dst, 0o775)
 
 
-def have_prefix_files(files, prefix):
+# files are scanned for prefixes in chunks of this size, so large binaries are never held
+#    in memory whole
+PREFIX_SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _needle_pattern(needles):
+    # longest first, so that a needle is preferred over any of its own prefixes
+    return re.compile(b'|'.join(re.escape(needle)
+                                for needle in sorted(needles, key=len, reverse=True)))
+
+
+def _scan_for_needles(path, needles):
+    """Read path once and return the subset of needles (bytes) found in it.
+
+    All needles are searched for with one compiled regex.  A needle is dropped from the search
+    as soon as it is found, and reading stops once every needle has turned up."""
+    remaining = set(needles)
+    found = set()
+    overlap = max(len(needle) for needle in needles) - 1
+    pattern = _needle_pattern(remaining)
+    tail = b''
+    with open(path, 'rb') as fi:
+        while remaining:
+            chunk = fi.read(PREFIX_SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            pos = 0
+            while remaining:
+                match = pattern.search(data, pos)
+                if not match:
+                    break
+                # the regex reports one needle per position; others (such as a shorter needle
+                # that the match starts with) may start here too
+                here = set(needle for needle in remaining
+                           if data.startswith(needle, match.start()))
+                found.update(here)
+                remaining.difference_update(here)
+                if remaining:
+                    pattern = _needle_pattern(remaining)
+                # needles may overlap, so resume just after the start of this match
+                pos = match.start() + 1
+            # keep enough of the end of this chunk to match needles that straddle chunks
+            tail = data[-overlap:] if overlap else b''
+    return found
+
+
+def _find_prefixes_in_file(f, prefix, prefixes):
+    """Return the (prefix, mode, f) tuples have_prefix_files yields for one file.  prefixes maps
+    each prefix spelling to look for to its bytes."""
+    if f.endswith(('.pyc', '.pyo', '.a')):
+        return []
+    path = join(prefix, f)
+    if not isfile(path):
+        return []
+    if sys.platform != 'darwin' and islink(path):
+        # OSX does not allow hard-linking symbolic links, so we cannot
+        # skip symbolic links (as we can on Linux)
+        return []
+    if os.stat(path).st_size == 0:
+        return []
+
+    needles = set(prefixes.values())
+    needles.add(b'\x00')
+    found = _scan_for_needles(path, needles)
+    mode = 'binary' if b'\x00' in found else 'text'
+    prefix_bytes = prefixes[prefix]
+    prefix_placeholder_bytes = prefixes[prefix_placeholder]
+    if mode == 'text' and not utils.on_win and prefix_bytes in found:
+        # Use the placeholder for maximal backwards compatibility, and
+        # to minimize the occurrences of usernames appearing in built
+        # packages.
+        with open(path, 'rb') as fi:
+            data = fi.read()
+        data = rewrite_file_with_new_prefix(path, data, prefix_bytes, prefix_placeholder_bytes)
+        found = set(needle for needle in needles if needle in data)
+
+    results = []
+    if prefix_bytes in found:
+        results.append((prefix, mode, f))
+    if utils.on_win:
+        forward_slash_prefix = prefix.replace('\\', '/')
+        double_backslash_prefix = prefix.replace('\\', '\\\\')
+        if prefixes[forward_slash_prefix] in found:
+            # some windows libraries use unix-style path separators
+            results.append((forward_slash_prefix, mode, f))
+        elif prefixes[double_backslash_prefix] in found:
+            # some windows libraries have double backslashes as escaping
+            results.append((double_backslash_prefix, mode, f))
+    if prefix_placeholder_bytes in found:
+        results.append((prefix_placeholder, mode, f))
+    return results
+
+
+def have_prefix_files(files, prefix, threads=None):
     '''
     Yields files that contain the current prefix in them, and modifies them
     to replace the prefix with a placeholder.
 
+    Each file is read once, looking for every prefix spelling and for NUL bytes (which make it
+    a binary file) at the same time.  With threads > 1, files are scanned on a thread pool of
+    that size; results are yielded in the order of files either way.
+
     :param files: Filenames to check for instances of prefix
     :type files: list of tuples containing strings (prefix, mode, filename)
     '''
-
-    prefix_bytes = prefix.encode(utils.codec)
-    prefix_placeholder_bytes = prefix_placeholder.encode(utils.codec)
+    prefixes = [prefix, prefix_placeholder]
     if utils.on_win:
-        forward_slash_prefix = prefix.replace('\\', '/')
-        forward_slash_prefix_bytes = forward_slash_prefix.encode(utils.codec)
-        double_backslash_prefix = prefix.replace('\\', '\\\\')
-        double_backslash_prefix_bytes = double_backslash_prefix.encode(utils.codec)
-
-    for f in files:
-        if f.endswith(('.pyc', '.pyo', '.a')):
-            continue
-        path = join(prefix, f)
-        if not isfile(path):
-            continue
-        if sys.platform != 'darwin' and islink(path):
-            # OSX does not allow hard-linking symbolic links, so we cannot
-            # skip symbolic links (as we can on Linux)
-            continue
-
-        # dont try to mmap an empty file
-        if os.stat(path).st_size == 0:
-            continue
-
-        fi = open(path, 'rb+')
-        try:
-            mm = utils.mmap_mmap(fi.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
-        except OSError:
-            mm = fi.read()
-
-        mode = 'binary' if mm.find(b'\x00') != -1 else 'text'
-        if mode == 'text':
-            if not utils.on_win and mm.find(prefix_bytes) != -1:
-                # Use the placeholder for maximal backwards compatibility, and
-                # to minimize the occurrences of usernames appearing in built
-                # packages.
-                rewrite_file_with_new_prefix(path, mm[:], prefix_bytes, prefix_placeholder_bytes)
-                mm.close()
-                fi.close()
-                fi = open(path, 'rb+')
-                mm = utils.mmap_mmap(fi.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
-        if mm.find(prefix_bytes) != -1:
-            yield (prefix, mode, f)
-        if utils.on_win and mm.find(forward_slash_prefix_bytes) != -1:
-            # some windows libraries use unix-style path separators
-            yield (forward_slash_prefix, mode, f)
-        elif utils.on_win and mm.find(double_backslash_prefix_bytes) != -1:
-            # some windows libraries have double backslashes as escaping
-            yield (double_backslash_prefix, mode, f)
-        if mm.find(prefix_placeholder_bytes) != -1:
-            yield (prefix_placeholder, mode, f)
-        mm.close()
-        fi.close()
+        prefixes.extend([prefix.replace('\\', '/'), prefix.replace('\\', '\\\\')])
+    prefixes = dict((p, p.encode(utils.codec)) for p in prefixes)
+
+    scan = partial(_find_prefixes_in_file, prefix=prefix, prefixes=prefixes)
+    if threads and threads > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for results in executor.map(scan, files):
+                for result in results:
+                    yield result
+    else:
+        for f in files:
+            for result in scan(f):
+                yield result
 
 
 def rewrite_file_with_new_prefix(path, data, old_prefix, new_prefix):
@@ -263,7 +327,8 @@ def write_hash_input(m):
 
 
 def get_files_with_prefix(m, files, prefix):
-    files_with_prefix = sorted(have_prefix_files(files, prefix))
+    files_with_prefix = sorted(have_prefix_files(files, prefix,
+                                                 threads=int(environ.get_cpu_count())))
 
     ignore_files = m.ignore_prefix_files()
     ignore_types = set()
@@ -532,51 +597,65 @@ def get_short_path(m, target_file):
         return target_file
 
 
-def sha256_checksum(filename, buffersize=65536):
-    if not isfile(filename):
-        return None
-    sha256 = hashlib.sha256()
-    with open(filename, 'rb') as f:
-        for block in iter(lambda: f.read(buffersize), b''):
-            sha256.update(block)
-    return sha256.hexdigest()
-
-
-def has_prefix(short_path, files_with_prefix):
-    for prefix, mode, filename in files_with_prefix:
-        if short_path == filename:
-            return prefix, mode
-    return None, None
-
-
 def is_no_link(no_link, short_path):
     if no_link is not None and short_path in no_link:
         return True
 
 
-def get_inode_paths(files, target_short_path, prefix):
-    utils.ensure_list(files)
-    target_short_path_inode = os.lstat(join(prefix, target_short_path)).st_ino
-    hardlinked_files = [sp for sp in files
-                        if os.lstat(join(prefix, sp)).st_ino == target_short_path_inode]
-    return sorted(hardlinked_files)
+def _hash_and_size(path, buffersize=65536):
+    """sha256 and size of path (following symlinks), from a single read of the file"""
+    if not isfile(path):
+        return None, os.path.getsize(path)
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        for block in iter(lambda: f.read(buffersize), b''):
+            sha256.update(block)
+    return sha256.hexdigest(), size
 
 
-def path_type(path):
-    return PathType.softlink if islink(path) else PathType.hardlink
+def _st_nlink(path, st):
+    # os.lstat does not always fill st_nlink in on Windows
+    if utils.on_win:
+        return CrossPlatformStLink.st_nlink(path)
+    return st.st_nlink
 
 
-def build_info_files_json_v1(m, prefix, files, files_with_prefix):
+def build_info_files_json_v1(m, prefix, files, files_with_prefix, threads=None):
+    """Build the paths.json entries for files.
+
+    Each file is lstat'ed once, giving its path type, its link count and its inode for the
+    inode -> paths map used for hard links (on Windows, link counts need another look).  Files
+    are hashed (and sized) on a thread pool of threads workers, defaulting to the CPU count."""
     no_link_files = m.get_value('build/no_link')
+    files = sorted(files)
+    # a file listed more than once keeps its first entry
+    prefix_lookup = {}
+    for placeholder, mode, filename in files_with_prefix:
+        prefix_lookup.setdefault(filename, (placeholder, mode))
+
+    paths = [os.path.join(prefix, fi) for fi in files]
+    stats = [os.lstat(path) for path in paths]
+    inode_paths = {}
+    for fi, st in zip(files, stats):
+        inode_paths.setdefault(st.st_ino, []).append(fi)
+
+    if threads is None:
+        threads = int(environ.get_cpu_count())
+    if threads > 1 and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            hashes_and_sizes = list(executor.map(_hash_and_size, paths))
+    else:
+        hashes_and_sizes = [_hash_and_size(path) for path in paths]
+
     files_json = []
-    for fi in sorted(files):
-        prefix_placeholder, file_mode = has_prefix(fi, files_with_prefix)
-        path = os.path.join(prefix, fi)
+    for fi, path, st, (sha256, size) in zip(files, paths, stats, hashes_and_sizes):
+        prefix_placeholder, file_mode = prefix_lookup.get(fi, (None, None))
         file_info = {
             "_path": get_short_path(m, fi),
-            "sha256": sha256_checksum(path),
-            "size_in_bytes": os.path.getsize(path),
-            "path_type": path_type(path),
+            "sha256": sha256,
+            "size_in_bytes": size,
+            "path_type": PathType.softlink if stat.S_ISLNK(st.st_mode) else PathType.hardlink,
         }
         no_link = is_no_link(no_link_files, fi)
         if no_link:
@@ -584,10 +663,8 @@ def build_info_files_json_v1(m, prefix, files, files_with_prefix):
         if prefix_placeholder and file_mode:
             file_info["prefix_placeholder"] = prefix_placeholder
             file_info["file_mode"] = file_mode
-        if file_info.get("path_type") == PathType.hardlink and CrossPlatformStLink.st_nlink(
-                join(prefix, fi)) > 1:
-            inode_paths = get_inode_paths(files, fi, prefix)
-            file_info["inode_paths"] = inode_paths
+        if file_info.get("path_type") == PathType.hardlink and _st_nlink(path, st) > 1:
+            file_info["inode_paths"] = sorted(inode_paths[st.st_ino])
         files_json.append(file_info)
     return files_json
 
@@ -616,16 +693,17 @@ def create_info_files_json_v1(m, info_dir, prefix, files, files_with_prefix):
     return checksums
 
 
-def post_process_files(m, initial_prefix_files):
+def post_process_files(m, initial_prefix_files, prefix_snapshot=None):
     get_build_metadata(m)
     create_post_scripts(m)
 
     # this is new-style noarch, with a value of 'python'
     if m.noarch != 'python':
         utils.create_entry_points(m.get_value('build/entry_points'), config=m.config)
-    current_prefix_files = utils.prefix_files(prefix=m.config.host_prefix)
+    if prefix_snapshot is None:
+        prefix_snapshot = utils.PrefixSnapshot(m.config.host_prefix)
 
-    post_process(sorted(current_prefix_files - initial_prefix_files),
+    post_process(sorted(prefix_snapshot.new_files(initial_prefix_files)),
                     prefix=m.config.host_prefix,
                     config=m.config,
                     preserve_egg_dir=bool(m.get_value('build/preserve_egg_dir')),
@@ -633,8 +711,7 @@ def post_process_files(m, initial_prefix_files):
                     skip_compile_pyc=m.get_value('build/skip_compile_pyc'))
 
     # The post processing may have deleted some files (like easy-install.pth)
-    current_prefix_files = utils.prefix_files(prefix=m.config.host_prefix)
-    new_files = sorted(current_prefix_files - initial_prefix_files)
+    new_files = sorted(prefix_snapshot.new_files(initial_prefix_files))
     new_files = utils.filter_files(new_files, prefix=m.config.host_prefix)
 
     if any(m.config.meta_dir in join(m.config.host_prefix, f) for f in new_files):
@@ -644,7 +721,7 @@ def post_process_files(m, initial_prefix_files):
 This error usually comes from using conda in the build script.  Avoid doing this, as it
 can lead to packages that include their dependencies.""" % meta_files))
     post_build(m, new_files, prefix=m.config.host_prefix, build_python=m.config.build_python,
-               croot=m.config.croot)
+               croot=m.config.croot, prefix_snapshot=prefix_snapshot)
 
     entry_point_script_names = get_entry_point_script_names(m.get_value('build/entry_points'))
     if m.noarch == 'python':
@@ -659,8 +736,7 @@ can lead to packages that include their dependencies.""" % meta_files))
     elif m.noarch == 'python':
         noarch_python.populate_files(m, pkg_files, m.config.host_prefix, entry_point_script_names)
 
-    current_prefix_files = utils.prefix_files(prefix=m.config.host_prefix)
-    new_files = current_prefix_files - initial_prefix_files
+    new_files = prefix_snapshot.new_files(initial_prefix_files)
     fix_permissions(new_files, m.config.host_prefix)
 
     return new_files
@@ -672,7 +748,15 @@ def remove_prefix_file(filepath, prefix):
     utils.rm_rf(filepath)
 
 
-def bundle_conda(output, metadata, env, **kw):
+def _refreshed_snapshot(prefix_snapshot, prefix):
+    if prefix_snapshot is None:
+        return utils.PrefixSnapshot(prefix)
+    return prefix_snapshot.refresh()
+
+
+def bundle_conda(output, metadata, env, prefix_snapshot=None, **kw):
+    """prefix_snapshot: a utils.PrefixSnapshot of the host prefix to keep using, if the caller
+    already has one"""
     log = utils.get_logger(__name__)
     log.info('Packaging %s', metadata.dist())
 
@@ -684,7 +768,8 @@ def bundle_conda(output, metadata, env, **kw):
         interpreter = output.get('script_interpreter')
         if not interpreter:
             interpreter = guess_interpreter(output['script'])
-        initial_files = utils.prefix_files(metadata.config.host_prefix)
+        prefix_snapshot = _refreshed_snapshot(prefix_snapshot, metadata.config.host_prefix)
+        initial_files = prefix_snapshot.files
         env_output = env.copy()
         env_output['TOP_PKG_NAME'] = env['PKG_NAME']
         env_output['TOP_PKG_VERSION'] = env['PKG_VERSION']
@@ -696,12 +781,13 @@ def bundle_conda(output, metadata, env, **kw):
     else:
         # we exclude the list of files that we want to keep, so post-process picks them up as "new"
         keep_files = set(utils.expand_globs(files, metadata.config.host_prefix))
-        pfx_files = set(utils.prefix_files(metadata.config.host_prefix))
+        prefix_snapshot = _refreshed_snapshot(prefix_snapshot, metadata.config.host_prefix)
+        pfx_files = prefix_snapshot.files
         initial_files = set(item for item in (pfx_files - keep_files)
                             if not any(keep_file.startswith(item + os.path.sep)
                                        for keep_file in keep_files))
 
-    files = post_process_files(metadata, initial_files)
+    files = post_process_files(metadata, initial_files, prefix_snapshot)
 
     if output.get('name') and output.get('name') != 'conda':
         assert 'bin/conda' not in files and 'Scripts/conda.exe' not in files, ("Bug in conda-build "
@@ -709,7 +795,7 @@ def bundle_conda(output, metadata, env, **kw):
             "tracker.")
 
     output_filename = ('-'.join([output['name'], metadata.version(),
-                                 metadata.build_id()]) + '.tar.bz2')
+                                 metadata.build_id()]) + package_extension(metadata.config))
     # first filter is so that info_files does not pick up ignored files
     files = utils.filter_files(files, prefix=metadata.config.host_prefix)
     output['checksums'] = create_info_files(metadata, files, prefix=metadata.config.host_prefix)
@@ -724,12 +810,12 @@ def bundle_conda(output, metadata, env, **kw):
             # the test belongs to the parent recipe.  Don't include it in subpackages.
             utils.rm_rf(test_dest_path)
     # here we add the info files into the prefix, so we want to re-collect the files list
-    files = set(utils.prefix_files(metadata.config.host_prefix)) - initial_files
+    files = prefix_snapshot.new_files(initial_files)
     files = utils.filter_files(files, prefix=metadata.config.host_prefix)
 
     with TemporaryDirectory() as tmp:
         tmp_path = os.path.join(tmp, os.path.basename(output_filename))
-        t = tarfile.open(tmp_path, 'w:bz2')
+        compression_threads = getattr(metadata.config, 'compression_threads', 1)
 
         def order(f):
             # we don't care about empty files so send them back via 100000
@@ -741,13 +827,36 @@ def bundle_conda(output, metadata, env, **kw):
         # add files in order of a) in info directory, b) increasing size so
         # we can access small manifest or json files without decompressing
         # possible large binary or data files
-        for f in sorted(files, key=order):
-            t.add(join(metadata.config.host_prefix, f), f)
-        t.close()
+        files_in_order = sorted(files, key=order)
+        manifest = None
+        if is_conda_pkg(output_filename):
+            create_conda_pkg(tmp_path, metadata.config.host_prefix, files_in_order,
+                             threads=compression_threads)
+        else:
+            def add_files(t):
+                for f in files_in_order:
+                    t.add(join(metadata.config.host_prefix, f), f)
+                # record what went into the tarball, so checking it needs no second read
+                return [(m.path, m.isdir()) for m in t.getmembers()]
+
+            if compression_threads > 1 and getattr(metadata.config, 'bz2_multi_stream', False):
+                with utils.ParallelBZ2Writer(tmp_path, compression_threads) as compressed:
+                    with tarfile.open(fileobj=compressed, mode='w') as t:
+                        members = add_files(t)
+            else:
+                with tarfile.open(tmp_path, 'w:bz2') as t:
+                    members = add_files(t)
+            info_contents = {}
+            for path, _ in members:
+                if path in tarcheck.CHECKED_INFO_FILES:
+                    with open(join(metadata.config.host_prefix, *path.split('/')), 'rb') as fi:
+                        info_contents[path] = fi.read()
+            manifest = members, info_contents
 
         # we're done building, perform some checks
-        tarcheck.check_all(tmp_path, metadata.config)
-        if not getattr(metadata.config, "noverify", False):
+        tarcheck.check_all(tmp_path, metadata.config, manifest=manifest)
+        # conda-verify only understands .tar.bz2 packages
+        if not getattr(metadata.config, "noverify", False) and not is_conda_pkg(tmp_path):
             verifier = Verify()
             ignore_scripts = metadata.config.ignore_package_verify_scripts if \
                              metadata.config.ignore_package_verify_scripts else None
@@ -773,18 +882,14 @@ def bundle_conda(output, metadata, env, **kw):
         #    a major bottleneck.
         utils.copy_into(tmp_path, final_output, metadata.config.timeout,
                         locking=False)
-    update_index(output_folder, verbose=metadata.config.verbose, locking=metadata.config.locking,
-                 timeout=metadata.config.timeout)
+    # only our new package's record changes - no need to re-list and re-read the whole channel
+    add_packages_to_index(output_folder, output_filename, verbose=metadata.config.verbose,
+                          locking=metadata.config.locking, timeout=metadata.config.timeout)
 
     # HACK: conda really wants a noarch folder to be around.  Create it as necessary.
-    if os.path.basename(output_folder) != 'noarch':
-        try:
-            os.makedirs(os.path.join(os.path.dirname(output_folder), 'noarch'))
-        except OSError:
-            pass
-        update_index(os.path.join(os.path.dirname(output_folder), 'noarch'),
-                     verbose=metadata.config.verbose, locking=metadata.config.locking,
-                    timeout=metadata.config.timeout)
+    ensure_valid_channel(os.path.dirname(output_folder), 'noarch',
+                         verbose=metadata.config.verbose, locking=metadata.config.locking,
+                         timeout=metadata.config.timeout)
 
     # remove info files from host prefix. We do not remove the actual package's files as subsequent
     # builds may well need them. In other words, the caller manages the files in output['checksums']
@@ -794,7 +899,7 @@ def bundle_conda(output, metadata, env, **kw):
     return final_output
 
 
-def bundle_wheel(output, metadata, env):
+def bundle_wheel(output, metadata, env, **kw):
     with TemporaryDirectory() as tmpdir, utils.tmp_chdir(metadata.config.work_dir):
         utils.check_call_env(['pip', 'wheel', '--wheel-dir', tmpdir, '--no-deps', '.'], env=env)
         wheel_files = glob(os.path.join(tmpdir, "*.whl"))
@@ -858,6 +963,9 @@ def build(m, post=None, need_source_download=True, need_reparse_in_env=False, bu
     if env_path_backup_var_exists:
         env["CONDA_PATH_BACKUP"] = os.environ["CONDA_PATH_BACKUP"]
 
+    # kept from before the build script runs when building and packaging in one go, so that
+    #    finding the files it added only has to look at the directories that changed.
+    prefix_snapshot = None
     if post in [False, None]:
         specs = [ms.spec for ms in m.ms_depends('build')]
         if any(out.get('type') == 'wheel' for out in m.meta.get('outputs', [])):
@@ -954,7 +1062,8 @@ def build(m, post=None, need_source_download=True, need_reparse_in_env=False, bu
             os.makedirs(src_dir)
 
         utils.rm_rf(m.config.info_dir)
-        files1 = utils.prefix_files(prefix=m.config.host_prefix)
+        prefix_snapshot = utils.PrefixSnapshot(m.config.host_prefix)
+        files1 = prefix_snapshot.files
         for pat in m.always_include_files():
             has_matches = False
             for f in set(files1):
@@ -1049,7 +1158,9 @@ def build(m, post=None, need_source_download=True, need_reparse_in_env=False, bu
     if os.path.isfile(prefix_file_list):
         with open(prefix_file_list) as f:
             initial_files = set(f.read().splitlines())
-    new_prefix_files = utils.prefix_files(prefix=m.config.host_prefix) - initial_files
+    if prefix_snapshot is None:
+        prefix_snapshot = utils.PrefixSnapshot(m.config.host_prefix)
+    new_prefix_files = prefix_snapshot.new_files(initial_files)
 
     new_pkgs = default_return
     if post in [True, None]:
@@ -1078,8 +1189,7 @@ def build(m, post=None, need_source_download=True, need_reparse_in_env=False, bu
             for (output_d, m) in outputs:
                 if (top_level_meta.name() == output_d.get('name') and not (output_d.get('files') or
                                                                            output_d.get('script'))):
-                    output_d['files'] = (utils.prefix_files(prefix=m.config.host_prefix) -
-                                         initial_files)
+                    output_d['files'] = prefix_snapshot.new_files(initial_files)
 
                 assert output_d.get('type') != 'conda' or m.final, (
                     "output metadata for {} is not finalized".format(m.dist()))
@@ -1140,33 +1250,13 @@ def build(m, post=None, need_source_download=True, need_reparse_in_env=False, bu
                     #    can be different from the env for the top level build.
                     with utils.path_prepended(m.config.build_prefix):
                         env = environ.get_dict(config=m.config, m=m)
-                    built_package = bundlers[output_d.get('type', 'conda')](output_d, m, env)
+                    built_package = bundlers[output_d.get('type', 'conda')](
+                        output_d, m, env, prefix_snapshot=prefix_snapshot)
                     new_pkgs[built_package] = (output_d, m)
 
-                    # must rebuild index because conda has no way to incrementally add our last
-                    #    package to the index.
-
-                    subdir = ('noarch' if (m.noarch or m.noarch_python)
-                              else m.config.host_subdir)
-                    if m.is_cross:
-                        host_index, host_ts = get_build_index(subdir=subdir,
-                                                              bldpkgs_dir=m.config.bldpkgs_dir,
-                                                              output_folder=m.config.output_folder,
-                                                              channel_urls=m.config.channel_urls,
-                                                              debug=m.config.debug,
-                                                              verbose=m.config.verbose,
-                                                              locking=m.config.locking,
-                                                              timeout=m.config.timeout,
-                                                              clear_cache=True)
-                    index, index_timestamp = get_build_index(subdir=subdir,
-                                                             bldpkgs_dir=m.config.bldpkgs_dir,
-                                                             output_folder=m.config.output_folder,
-                                                             channel_urls=m.config.channel_urls,
-                                                             debug=m.config.debug,
-                                                             verbose=m.config.verbose,
-                                                             locking=m.config.locking,
-                                                             timeout=m.config.timeout,
-                                                             clear_cache=True)
+                    # no need to rebuild the index here.  Our package's index update may be
+                    #    deferred, and get_build_index applies it whenever the local channel is
+                    #    next needed.
     else:
         print("STOPPING BUILD BEFORE POST:", m.dist())
 
@@ -1492,6 +1582,18 @@ Error:
 
 def build_tree(recipe_list, config, build_only=False, post=False, notest=False,
                need_source_download=True, need_reparse_in_env=False, variants=None):
+    # index built packages in one batch per subdir when the tree is done, rather than re-indexing
+    #    the local channel after every output.  Builds and tests that need one of those
+    #    packages in the meantime get pending updates applied by get_build_index.
+    with deferred_index_updates(verbose=config.verbose, locking=config.locking,
+                                timeout=config.timeout):
+        return _build_tree(recipe_list, config, build_only=build_only, post=post,
+                           notest=notest, need_source_download=need_source_download,
+                           need_reparse_in_env=need_reparse_in_env, variants=variants)
+
+
+def _build_tree(recipe_list, config, build_only=False, post=False, notest=False,
+                need_source_download=True, need_reparse_in_env=False, variants=None):
 
     to_build_recursive = []
     recipe_list = deque(recipe_list)
@@ -1576,7 +1678,12 @@ def build_tree(recipe_list, config, build_only=False, post=False, notest=False,
                                            )
                 if not notest:
                     for pkg, dict_and_meta in packages_from_this.items():
-                        if pkg.endswith('.tar.bz2'):
+                        if is_conda_pkg(pkg):
+                            log = utils.get_logger(__name__)
+                            log.warn("Not testing %s: conda cannot install .conda packages yet, so "
+                                     "its tests can only run on a --package-format tar.bz2 build.",
+                                     pkg)
+                        elif pkg.endswith('.tar.bz2'):
                             # we only know how to test conda packages
                             try:
                                 test(pkg, config=metadata.config)
@@ -1647,6 +1754,11 @@ for Python 3.5 and needs to be rebuilt."""
     if post in [True, None]:
         # TODO: could probably use a better check for pkg type than this...
         tarballs = [f for f in built_packages if f.endswith('.tar.bz2')]
+        conda_pkgs = [f for f in built_packages if is_conda_pkg(f)]
+        if conda_pkgs:
+            log = utils.get_logger(__name__)
+            log.warn("Not uploading .conda packages, which anaconda.org cannot serve to this "
+                     "version of conda yet:\n  %s", '\n  '.join(conda_pkgs))
         wheels = [f for f in built_packages if f.endswith('.whl')]
         handle_anaconda_upload(tarballs, config=config)
         handle_pypi_upload(wheels, config=config)
@@ -1774,7 +1886,8 @@ def is_package_built(metadata, env):
                                       verbose=metadata.config.verbose,
                                       locking=metadata.config.locking,
                                       timeout=metadata.config.timeout,
-                                      clear_cache=True)
+                                      clear_cache=True,
+                                      package_names=[metadata.name()])
     urls = [url_path(metadata.config.croot)] + get_rc_urls()
     if metadata.config.channel_urls:
         urls.extend(metadata.config.channel_urls)
@@ -245,6 +245,29 @@ different sets of packages."""
         help=("Do not use a long prefix for the test prefix, as well as the build prefix."
               "  Affects only Linux and Mac.  Prefix length matches the --prefix-length flag.  ")
     )
+    p.add_argument(
+        "--compression-threads", dest="compression_threads", type=int,
+        default=int(cc_conda_build.get('compression_threads', 1)),
+        help=("Compress output packages on this many threads.  .tar.bz2 packages are only "
+              "compressed on several threads with --bz2-multi-stream.  Defaults to 1.")
+    )
+    p.add_argument(
+        "--bz2-multi-stream", action="store_true",
+        default=cc_conda_build.get('bz2_multi_stream', 'false').lower() == 'true',
+        help=("With --compression-threads above 1, write .tar.bz2 packages as several bz2 "
+              "streams compressed in parallel.  Python 2's tarfile/bz2 modules (and so conda "
+              "running on Python 2) read only the first stream, and would extract a truncated "
+              "package; only use this when all consumers of the packages run on Python 3.")
+    )
+    p.add_argument(
+        "--package-format", dest="package_format", choices=('tar.bz2', 'conda'),
+        default=cc_conda_build.get('package_format', 'tar.bz2'),
+        help=("Output package format.  'conda' writes .conda packages: an uncompressed "
+              "container with separately zstd-compressed metadata and payload, which is faster "
+              "to read.  Needs the zstandard package.  conda cannot install .conda packages "
+              "yet, so they are not tested or uploaded, and later recipes in the same build "
+              "cannot depend on them.  Defaults to tar.bz2.")
+    )
     add_parser_channels(p)
 
     args = p.parse_args(args)
@@ -48,6 +48,21 @@ def parse_args(args):
         default=True,
         help="Don't remove entries for files that don't exist.",
     )
+    p.add_argument(
+        '--threads', '--processes',
+        type=int,
+        dest="threads",
+        default=None,
+        help="""Number of worker processes used to read packages.  Each changed package is
+        read once, computing its md5 and sha256 and extracting info/index.json in the same
+        pass.  Default is to read packages serially.""",
+    )
+    p.add_argument(
+        '--compact',
+        action="store_true",
+        help="""Write repodata json without indentation.  Much smaller and faster to write
+        for large channels.""",
+    )
 
     args = p.parse_args(args)
     return p, args
@@ -59,7 +74,8 @@ def execute(args):
     config.verbose = not args.quiet
 
     api.update_index(args.dir, config=config, force=args.force,
-            check_md5=args.check_md5, remove=args.remove)
+            check_md5=args.check_md5, remove=args.remove, threads=args.threads,
+            compact=args.compact)
 
 
 def main():
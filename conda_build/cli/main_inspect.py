@@ -32,7 +32,8 @@ options available.
     linkages_help = """
 Investigates linkages of binary libraries in a package (works in Linux and
 OS X). This is an advanced command to aid building packages that link against
-C libraries. Aggregates the output of ldd (on Linux) and otool -L (on OS X) by
+C libraries. Aggregates the libraries that each binary links against (as found
+by conda-build, or with --verify also by ldd on Linux and otool -L on OS X) by
 dependent packages. Useful for finding broken links, or links against system
 libraries that ought to be dependent conda packages.  """
     linkages = subcommand.add_parser(
@@ -78,6 +79,12 @@ libraries that ought to be dependent conda packages.  """
         action='store_true',
         help="Generate a report for all packages in the environment.",
     )
+    linkages.add_argument(
+        '--verify',
+        action='store_true',
+        help="""Cross-check the linkages found by conda-build's own parser against ldd (Linux)
+        or otool -L (OS X), warning about any differences.  Slower.""",
+    )
     add_parser_prefix(linkages)
 
     objects_help = """
@@ -195,7 +202,7 @@ def execute(args):
         print(api.inspect_linkages(args.packages, prefix=get_prefix(args),
                                    untracked=args.untracked, all_packages=args.all,
                                    show_files=args.show_files, groupby=args.groupby,
-                                   sysroot=expanduser(args.sysroot)))
+                                   sysroot=expanduser(args.sysroot), verify=args.verify))
     elif args.subcommand == 'objects':
         print(api.inspect_objects(args.packages, prefix=get_prefix(args), groupby=args.groupby))
     elif args.subcommand == 'prefix-lengths':
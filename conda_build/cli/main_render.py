@@ -107,6 +107,12 @@ source to try fill in related template variables.",
               "yours to handle. Any variants with overlapping names within a "
               "build will clobber each other.")
     )
+    p.add_argument(
+        "--render-processes", dest="render_processes", type=int,
+        default=int(cc_conda_build.get('render_processes', 1)),
+        help=("Number of worker processes used to render the variants of a recipe. "
+              "Defaults to 1 (serial rendering).")
+    )
 
     add_parser_channels(p)
     return p
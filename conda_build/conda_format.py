@@ -0,0 +1,190 @@
+"""
+Reading and writing the optional .conda package container.
+
+A .conda file is an uncompressed zip archive holding:
+
+    metadata.json         {"conda_pkg_format_version": 2}
+    info-<dist>.tar.zst   the package's info/ files, as a zstd-compressed tarball
+    pkg-<dist>.tar.zst    everything else, as a zstd-compressed tarball
+
+Zip members can be located and read on their own, so a package's metadata is available without
+decompressing (or even reading) its payload, and zstd decompresses much faster than bz2.  Writing
+and reading these packages needs the optional zstandard module; .tar.bz2 packages do not.
+"""
+from __future__ import absolute_import, division, print_function
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TAR_BZ2_EXTENSION = '.tar.bz2'
+CONDA_PKG_EXTENSION = '.conda'
+PACKAGE_EXTENSIONS = (TAR_BZ2_EXTENSION, CONDA_PKG_EXTENSION)
+CONDA_PKG_FORMAT_VERSION = 2
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("The .conda package format needs the zstandard python package.  "
+                           "Please run `conda install zstandard`.")
+
+
+def is_conda_pkg(path):
+    return path.endswith(CONDA_PKG_EXTENSION)
+
+
+def package_extension(config):
+    """File extension of packages built with config (see the package_format setting)"""
+    if getattr(config, 'package_format', 'tar.bz2') == 'conda':
+        return CONDA_PKG_EXTENSION
+    return TAR_BZ2_EXTENSION
+
+
+def strip_package_extension(fn):
+    """Returns fn without its package extension (.tar.bz2 or .conda)"""
+    for ext in PACKAGE_EXTENSIONS:
+        if fn.endswith(ext):
+            return fn[:-len(ext)]
+    return fn
+
+
+def _zstd_compress(src, dst, level, threads):
+    kwargs = {'level': level}
+    if threads and threads > 1:
+        kwargs['threads'] = threads
+    zstandard.ZstdCompressor(**kwargs).copy_stream(src, dst)
+
+
+def create_conda_pkg(path, prefix, files, level=19, threads=None):
+    """Write a .conda package at path from files (relative to prefix).
+
+    files are added to their component tarball in the order given, so callers keep control of
+    member ordering.  threads > 1 lets zstd compress each component on that many threads."""
+    _require_zstandard()
+    dist = strip_package_extension(os.path.basename(path))
+    components = (('info', [f for f in files if f.startswith('info/')]),
+                  ('pkg', [f for f in files if not f.startswith('info/')]))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as z:
+            z.writestr('metadata.json',
+                       json.dumps({'conda_pkg_format_version': CONDA_PKG_FORMAT_VERSION}))
+            for component, members in components:
+                tar_path = os.path.join(tmp_dir, component + '.tar')
+                with tarfile.open(tar_path, 'w') as t:
+                    for f in members:
+                        t.add(os.path.join(prefix, f), f)
+                zst_path = tar_path + '.zst'
+                with open(tar_path, 'rb') as src, open(zst_path, 'wb') as dst:
+                    _zstd_compress(src, dst, level, threads)
+                os.remove(tar_path)
+                z.write(zst_path, '{}-{}.tar.zst'.format(component, dist))
+                os.remove(zst_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return path
+
+
+def _component_member(z, component):
+    for name in z.namelist():
+        if name.startswith(component + '-') and name.endswith('.tar.zst'):
+            return name
+    raise RuntimeError("%s has no %s component.  File probably corrupt." % (z.filename,
+                                                                           component))
+
+
+def _decompress_component(z, component, dst):
+    _require_zstandard()
+    with z.open(_component_member(z, component)) as src:
+        zstandard.ZstdDecompressor().copy_stream(src, dst)
+    dst.seek(0)
+    return dst
+
+
+def open_info_tar(path):
+    """Returns a TarFile of the info/ files of the .conda package at path.  Only the (small)
+    info component is read and decompressed."""
+    with zipfile.ZipFile(path) as z:
+        return tarfile.open(fileobj=_decompress_component(z, 'info', io.BytesIO()))
+
+
+def read_info_file(path, file_path):
+    """Returns the contents of info file file_path (e.g. 'info/index.json') in the .conda package
+    at path, or None if the package does not have it."""
+    with open_info_tar(path) as t:
+        try:
+            return t.extractfile(file_path).read()
+        except KeyError:
+            return None
+
+
+class CondaPkgTar(object):
+    """
+    Read-only view of a .conda package with the parts of the tarfile.TarFile interface that
+    conda-build uses (getmembers, getnames, getmember, extractfile, iteration), so that code
+    written for .tar.bz2 packages can read .conda packages as well.  The payload is decompressed
+    to a temporary file the first time a payload member is asked for.
+    """
+
+    def __init__(self, path):
+        self.name = path
+        self._info = open_info_tar(path)
+        self._pkg = None
+        self._pkg_file = None
+
+    def _payload(self):
+        if self._pkg is None:
+            self._pkg_file = tempfile.TemporaryFile()
+            with zipfile.ZipFile(self.name) as z:
+                _decompress_component(z, 'pkg', self._pkg_file)
+            self._pkg = tarfile.open(fileobj=self._pkg_file)
+        return self._pkg
+
+    def getmembers(self):
+        return self._info.getmembers() + self._payload().getmembers()
+
+    def getnames(self):
+        return [m.name for m in self.getmembers()]
+
+    def getmember(self, name):
+        if name.startswith('info/'):
+            return self._info.getmember(name)
+        return self._payload().getmember(name)
+
+    def extractfile(self, member):
+        name = getattr(member, 'name', member)
+        tar = self._info if name.startswith('info/') else self._payload()
+        return tar.extractfile(member)
+
+    def __iter__(self):
+        return iter(self.getmembers())
+
+    def close(self):
+        self._info.close()
+        if self._pkg is not None:
+            self._pkg.close()
+            self._pkg_file.close()
+            self._pkg = self._pkg_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_type, e_value, traceback):
+        self.close()
+
+
+def open_package(path):
+    """Open a .tar.bz2 or .conda package for reading.  Returns a tarfile.TarFile or a
+    CondaPkgTar; both are context managers."""
+    if is_conda_pkg(path):
+        return CondaPkgTar(path)
+    return tarfile.open(path)
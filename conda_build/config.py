@@ -91,6 +91,20 @@ DEFAULTS = [Setting('activate', True),
             Setting('variant_config_files', []),
             Setting('ignore_system_variants', False),
             Setting('hash_length', 7),
+            # number of worker processes used to render variants; 1 renders serially
+            Setting('render_processes', int(cc_conda_build.get('render_processes', 1))),
+            # folder for compiled recipe templates shared between processes; None keeps them
+            #    in memory only
+            Setting('jinja_bytecode_cache', cc_conda_build.get('jinja_bytecode_cache')),
+            # threads used to compress output packages.  .tar.bz2 packages are only compressed on
+            #    several threads with bz2_multi_stream (see utils.ParallelBZ2Writer)
+            Setting('compression_threads', int(cc_conda_build.get('compression_threads', 1))),
+            # write .tar.bz2 packages as multi-stream bz2, which Python 2 reads only the first
+            #    stream of
+            Setting('bz2_multi_stream',
+                    cc_conda_build.get('bz2_multi_stream', 'false').lower() == 'true'),
+            # 'tar.bz2', or 'conda' for the .conda container (see conda_format; needs zstandard)
+            Setting('package_format', cc_conda_build.get('package_format', 'tar.bz2')),
 
             # append/clobber metadata section data (for global usage.  Can also add files to
             #    recipe.)
@@ -553,7 +567,9 @@ class Config(object):
         new = copy.copy(self)
         new.variant = copy.deepcopy(self.variant)
         if hasattr(self, 'variants'):
-            new.variants = copy.deepcopy(self.variants)
+            # the variant dicts themselves are never modified in place (conform_variants_to_value
+            #    builds new ones), so copies can share them
+            new.variants = list(self.variants)
         return new
 
     # context management - automatic cleanup if self.dirty or self.keep_old_work is not True
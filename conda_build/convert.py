@@ -21,6 +21,7 @@ import sys
 import tarfile
 
 from .conda_interface import PY3
+from .conda_format import open_package, strip_package_extension, TAR_BZ2_EXTENSION
 
 if PY3:
     from io import StringIO, BytesIO as bytes_io
@@ -116,12 +117,13 @@ def tar_update(source, dest, file_map, verbose=True, quiet=False):
     """
 
     # s -> t
-    if isinstance(source, tarfile.TarFile):
+    if hasattr(source, 'getmembers'):
+        # a tarfile.TarFile, or the conda_format.CondaPkgTar view of a .conda package
         s = source
     else:
-        if not source.endswith(('.tar', '.tar.bz2')):
-            raise TypeError("path must be a .tar or .tar.bz2 path")
-        s = tarfile.open(source)
+        if not source.endswith(('.tar', '.tar.bz2', '.conda')):
+            raise TypeError("path must be a .tar, .tar.bz2 or .conda path")
+        s = open_package(source)
     if isinstance(dest, tarfile.TarFile):
         t = dest
     else:
@@ -178,7 +180,7 @@ def _is_same_platform_arch(path, platform):
     If the source platform and architecture are the same as the target platform
     and architecture then the conversion of the package should be skipped.
     """
-    with tarfile.open(path) as tar:
+    with open_package(path) as tar:
         info = json.loads(tar.extractfile('info/index.json').read().decode('utf-8'))
 
     source_platform = info.get('platform')
@@ -421,7 +423,7 @@ def conda_convert(file_path, output_dir=".", show_imports=False, platforms=None,
     if not show_imports and platforms is None:
         sys.exit('Error: --platform option required for conda package conversion')
 
-    with tarfile.open(file_path) as t:
+    with open_package(file_path) as t:
         if show_imports:
             has_cext(t, show=True)
             return
@@ -431,7 +433,8 @@ def conda_convert(file_path, output_dir=".", show_imports=False, platforms=None,
                   "force conversion." % file_path, file=sys.stderr)
             return
 
-        fn = os.path.basename(file_path)
+        # converted packages are always written as .tar.bz2
+        fn = strip_package_extension(os.path.basename(file_path)) + TAR_BZ2_EXTENSION
 
         info = json.loads(t.extractfile('info/index.json')
                           .read().decode('utf-8'))
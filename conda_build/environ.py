@@ -2,6 +2,7 @@ from __future__ import absolute_import, division, print_function
 
 import contextlib
 from glob import glob
+import hashlib
 import json
 import logging
 import multiprocessing
@@ -11,6 +12,7 @@ import sys
 import warnings
 from collections import defaultdict
 from os.path import join, normpath
+import sqlite3
 import subprocess
 
 # noqa here because PY3 is used only on windows, and trips up flake8 otherwise.
@@ -21,13 +23,14 @@ from .conda_interface import package_cache
 from .conda_interface import install_actions, display_actions, execute_actions, execute_plan
 from .conda_interface import memoized
 from .conda_interface import MatchSpec
+from .conda_interface import Dist, cc_conda_build
 
 
 from conda_build.os_utils import external
 from conda_build import utils
 from conda_build.features import feature_list
 from conda_build.utils import prepend_bin_path, ensure_list
-from conda_build.index import get_build_index
+from conda_build.index import get_build_index, get_build_index_hash
 from conda_build.exceptions import DependencyNeedsBuildingError
 from conda_build.variants import get_default_variants
 
@@ -643,6 +646,102 @@ cached_actions = {}
 last_index_ts = 0
 
 
+class SolveCache(object):
+    """The packages that solves by any conda-build process chose, persisted in an sqlite database.
+
+    Only the solved set of packages to link is stored: what has to be fetched, extracted or
+    unlinked depends on the package cache and the target prefix at install time, so it is worked
+    out again for each use (see get_install_actions).  Entries are keyed on everything that a
+    solve depends on, including the content hash of the index it was solved against, so they
+    never go stale.  last_used is a logical clock, and the least recently used entries are evicted
+    when there are more than max_entries.  Any database error just means a cache miss.
+    """
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("""CREATE TABLE IF NOT EXISTS linked_packages (
+                            key TEXT PRIMARY KEY,
+                            dists TEXT NOT NULL,
+                            last_used INTEGER NOT NULL)""")
+        return conn
+
+    def get(self, key):
+        """Returns the dist strings that the solve for key linked, or None"""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    row = conn.execute("SELECT dists FROM linked_packages WHERE key = ?",
+                                       (key, )).fetchone()
+                    if row:
+                        conn.execute("""UPDATE linked_packages SET last_used = (
+                                            SELECT MAX(last_used) + 1 FROM linked_packages)
+                                        WHERE key = ?""", (key, ))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            utils.get_logger(__name__).debug("solve cache unavailable: %s", e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, dists):
+        data = json.dumps([str(dist) for dist in dists])
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("""INSERT OR REPLACE INTO linked_packages VALUES (?, ?, (
+                                        SELECT COALESCE(MAX(last_used), 0) + 1
+                                        FROM linked_packages))""",
+                                 (key, data))
+                    conn.execute("""DELETE FROM linked_packages WHERE key NOT IN (
+                                        SELECT key FROM linked_packages
+                                        ORDER BY last_used DESC LIMIT ?)""",
+                                 (self.max_entries, ))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            utils.get_logger(__name__).debug("solve cache unavailable: %s", e)
+
+
+# opt-in: set solve_cache_file in the conda-build section of condarc to share solves between
+#    conda-build processes
+solve_cache = (SolveCache(os.path.expanduser(cc_conda_build['solve_cache_file']),
+                          max_entries=int(cc_conda_build.get('solve_cache_max_entries', 1000)))
+               if cc_conda_build.get('solve_cache_file') else None)
+
+
+def _solve_cache_key(specs, env, subdir, channel_urls, disable_pip):
+    if not solve_cache:
+        return None
+    index_hash = get_build_index_hash()
+    if not index_hash:
+        return None
+    key = [sorted(str(spec) for spec in specs), env, subdir,
+           [str(url) for url in ensure_list(channel_urls)], bool(disable_pip), index_hash]
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def _pinned_specs(dists):
+    """Exact, channel-qualified specs for dists, so that re-solving them is trivial and can't pick
+    a package with the same name, version and build from another channel.  None if this conda's
+    Dist (a placeholder before conda 4.3) can't be taken apart, or if a dist's channel has no
+    canonical name (file:// and other URL channels) to put in a match spec."""
+    if not hasattr(Dist, 'to_matchspec'):
+        return None
+    specs = []
+    for dist in dists:
+        dist = Dist(str(dist))
+        if dist.channel and ('/' in dist.channel or ':' in dist.channel):
+            return None
+        spec = '%s %s %s' % (dist.name, dist.version, dist.build_string)
+        specs.append('%s::%s' % (dist.channel, spec) if dist.channel else spec)
+    return specs
+
+
 def get_install_actions(prefix, specs, env, retries=0, subdir=None,
                         verbose=True, debug=False, locking=True,
                         bldpkgs_dirs=None, timeout=90, disable_pip=False,
@@ -667,7 +766,9 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
 
     index, index_ts = get_build_index(subdir, list(bldpkgs_dirs)[0], output_folder=output_folder,
                                       channel_urls=channel_urls, debug=debug, verbose=verbose,
-                                      locking=locking, timeout=timeout)
+                                      locking=locking, timeout=timeout,
+                                      package_names=[str(spec).split()[0].split('::')[-1]
+                                                     for spec in specs])
     specs = tuple(_ensure_valid_spec(spec) for spec in specs)
 
     if (specs, env, subdir, channel_urls) in cached_actions and last_index_ts >= index_ts:
@@ -675,13 +776,23 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
         if "PREFIX" in actions:
             actions['PREFIX'] = prefix
     elif specs:
+        solve_key = _solve_cache_key(specs, env, subdir, channel_urls, disable_pip)
+        cached_dists = solve_cache.get(solve_key) if solve_key else None
+        # the cached solve only says what to link.  Pinning exactly those packages makes
+        #    conda plan the fetch, extract and unlink steps against the package cache and
+        #    prefix as they are now, without having to search for a solution again.
+        solve_specs = _pinned_specs(cached_dists) if cached_dists else None
+        if solve_specs:
+            log.debug("Using cached solve for specs %s", specs)
+        else:
+            solve_specs = specs
         # this is hiding output like:
         #    Fetching package metadata ...........
         #    Solving package specifications: ..........
         with utils.LoggingContext(conda_log_level):
             with capture():
                 try:
-                    actions = install_actions(prefix, index, specs, force=True)
+                    actions = install_actions(prefix, index, solve_specs, force=True)
                 except NoPackagesFoundError as exc:
                     raise DependencyNeedsBuildingError(exc, subdir=subdir)
                 except (SystemExit, PaddingError, LinkError, DependencyNeedsBuildingError,
@@ -726,6 +837,8 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
                                 if not spec.startswith('pip-') and
                                 not spec.startswith('setuptools-')]
         utils.trim_empty_keys(actions)
+        if solve_key and not cached_dists and actions.get('LINK'):
+            solve_cache.put(solve_key, actions['LINK'])
         cached_actions[(specs, env, subdir, channel_urls)] = actions.copy()
         last_index_ts = index_ts
     return actions
@@ -5,22 +5,47 @@ Functions related to creating repodata index files.
 from __future__ import absolute_import, division, print_function
 
 import bz2
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 from functools import partial
+import gzip
+import hashlib
 import json
 import logging
 import os
+import sqlite3
+import sys
 import tarfile
 from os.path import isfile, join, getmtime
 
-from conda_build.utils import file_info, get_lock, try_acquire_locks
+from six import reraise
+
+from conda_build.conda_format import is_conda_pkg, read_info_file, PACKAGE_EXTENSIONS
+from conda_build.utils import get_lock, try_acquire_locks
 from conda_build import utils, conda_interface
-from .conda_interface import PY3, md5_file, url_path, CondaHTTPError, get_index
+from .conda_interface import PY3, md5_file, url_path, CondaHTTPError, get_index, VersionOrder
 
 local_index_timestamp = 0
 cached_index = None
 local_subdir = ""
 cached_channels = []
+# the local channel's part of cached_index, and the (size, mtime, inode) of the local repodata
+#    files it was read from.  When only the local channel changes, just these records are
+#    re-read and merged into cached_index; remote channel data is left alone.
+cached_local_index = {}
+local_index_fingerprint = None
+# identifies the contents of cached_index, for caches that outlive this process
+cached_index_hash = None
+
+# {subdir path: ((size, mtime, inode) of repodata.json, repodata)} for the repodata this process
+#    last wrote, so that adding a few packages does not re-read every record in the subdir
+_written_repodata = {}
+
+# packages that have been written to a channel subdir, but whose index records have not been
+#    updated yet, as {subdir path: set of package filenames}.  Only collected within
+#    deferred_index_updates.
+pending_index_updates = {}
+_deferring_index_updates = 0
 
 
 def read_index_tar(tar_path, lock, locking=True, timeout=90):
@@ -29,6 +54,8 @@ def read_index_tar(tar_path, lock, locking=True, timeout=90):
     if locking:
         locks = [lock]
     with try_acquire_locks(locks, timeout):
+        if is_conda_pkg(tar_path):
+            return json.loads(read_info_file(tar_path, 'info/index.json').decode('utf-8'))
         with tarfile.open(tar_path) as t:
             try:
                 return json.loads(t.extractfile('info/index.json').read().decode('utf-8'))
@@ -42,26 +69,331 @@ def read_index_tar(tar_path, lock, locking=True, timeout=90):
                                 "File probably corrupt." % tar_path)
 
 
-def write_repodata(repodata, dir_path, lock, locking=90, timeout=90):
-    """ Write updated repodata.json and repodata.json.bz2 """
+class _HashingReader(object):
+    """Read-only file wrapper that feeds every byte read through md5 and sha256.  Lets us
+    compute package checksums while tarfile streams the same bytes to find info/index.json."""
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self, bufsize=1024 * 1024):
+        while self.read(bufsize):
+            pass
+
+
+def _read_conda_pkg_index_and_file_info(path):
+    # index.json comes straight out of the info component; the whole file is still read once
+    #    for its checksums
+    index = json.loads(read_info_file(path, 'info/index.json').decode('utf-8'))
+    with open(path, 'rb') as fi:
+        reader = _HashingReader(fi)
+        reader.drain()
+    index.update({'size': reader.size,
+                  'md5': reader.md5.hexdigest(),
+                  'sha256': reader.sha256.hexdigest(),
+                  'mtime': getmtime(path)})
+    return index
+
+
+def read_index_and_file_info(tar_path):
+    """Returns the index.json dict inside the given package tarball, updated with the size,
+    md5, sha256 and mtime of the tarball.  The tarball is read from disk exactly once."""
+    if is_conda_pkg(tar_path):
+        return _read_conda_pkg_index_and_file_info(tar_path)
+    index = None
+    with open(tar_path, 'rb') as fi:
+        reader = _HashingReader(fi)
+        try:
+            # stream mode: tarfile only ever reads forward, so every byte passes our hashes.
+            #    On Python 3, BZ2File also reads multi-stream packages (bz2_multi_stream)
+            if PY3:
+                t = tarfile.open(fileobj=bz2.BZ2File(reader), mode='r|')
+            else:
+                t = tarfile.open(fileobj=reader, mode='r|bz2')
+            with t:
+                for member in t:
+                    if member.name == 'info/index.json':
+                        index = json.loads(t.extractfile(member).read().decode('utf-8'))
+                        break
+        except EOFError:
+            raise RuntimeError("Could not extract %s. File probably corrupt."
+                % tar_path)
+        except tarfile.ReadError:
+            raise RuntimeError("Could not extract metadata from %s. "
+                            "File probably corrupt." % tar_path)
+        except (IOError, OSError) as e:
+            raise RuntimeError("Could not extract %s (%s)" % (tar_path, e))
+        # the rest of the payload only needs hashing, not decompressing
+        reader.drain()
+    if index is None:
+        raise RuntimeError("Could not extract metadata from %s. "
+                           "info/index.json not found." % tar_path)
+    index.update({'size': reader.size,
+                  'md5': reader.md5.hexdigest(),
+                  'sha256': reader.sha256.hexdigest(),
+                  'mtime': getmtime(tar_path)})
+    return index
+
+
+def _read_index_and_file_infos(paths, threads=None):
+    """Yields read_index_and_file_info results for each of paths, in order.  With threads > 1,
+    the packages are read on a pool of that many worker processes."""
+    if threads and threads > 1 and len(paths) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            for info in executor.map(read_index_and_file_info, paths):
+                yield info
+    else:
+        for path in paths:
+            yield read_index_and_file_info(path)
+
+
+def _write_compressed(path, data):
+    if path.endswith('.bz2'):
+        data = bz2.compress(data)
+        with open(path, 'wb') as fo:
+            fo.write(data)
+    else:
+        # fixed mtime keeps the output reproducible for unchanged repodata
+        with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as fo:
+            fo.write(data)
+
+
+def _version_key(version):
+    try:
+        return VersionOrder(version)
+    except ValueError:
+        return VersionOrder('0')
+
+
+def _latest_packages(packages):
+    latest = {}
+    for fn, info in packages.items():
+        name, key = info['name'], _version_key(info['version'])
+        if name not in latest or latest[name][0] < key:
+            latest[name] = (key, [fn])
+        elif latest[name][0] == key:
+            latest[name][1].append(fn)
+    return {fn: packages[fn] for _, fns in latest.values() for fn in fns}
+
+
+def current_repodata(repodata):
+    """Trim repodata down to the newest version of each package name.  All builds of that
+    version are kept, so that clients can still choose between e.g. python variants."""
+    current = dict(repodata, packages=_latest_packages(repodata['packages']))
+    if 'packages.conda' in repodata:
+        current['packages.conda'] = _latest_packages(repodata['packages.conda'])
+    return current
+
+
+def _dumps_repodata(repodata, compact=False):
+    if compact:
+        return json.dumps(repodata, sort_keys=True, separators=(',', ':')) + '\n'
+    data = json.dumps(repodata, indent=2, sort_keys=True)
+    # strip trailing whitespace
+    data = '\n'.join(line.rstrip() for line in data.splitlines())
+    # make sure we have newline at the end
+    if not data.endswith('\n'):
+        data += '\n'
+    return data
+
+
+def write_repodata(repodata, dir_path, lock, locking=90, timeout=90, compact=False):
+    """ Write updated repodata.json and current_repodata.json, each with .bz2 and .gz siblings.
+
+    current_repodata.json holds only the newest version of each package.  With compact=True, json
+    is written without indentation or whitespace, which is both faster and much smaller.
+    """
     locks = []
     if locking:
         locks = [lock]
     with try_acquire_locks(locks, timeout):
-        data = json.dumps(repodata, indent=2, sort_keys=True)
-        # strip trailing whitespace
-        data = '\n'.join(line.rstrip() for line in data.splitlines())
-        # make sure we have newline at the end
-        if not data.endswith('\n'):
-            data += '\n'
-        with open(join(dir_path, 'repodata.json'), 'w') as fo:
-            fo.write(data)
-        with open(join(dir_path, 'repodata.json.bz2'), 'wb') as fo:
-            fo.write(bz2.compress(data.encode('utf-8')))
+        compressed = []
+        for basename, data in (('repodata.json', repodata),
+                               ('current_repodata.json', current_repodata(repodata))):
+            data = _dumps_repodata(data, compact=compact)
+            with open(join(dir_path, basename), 'w') as fo:
+                fo.write(data)
+            data = data.encode('utf-8')
+            compressed.extend((join(dir_path, basename + ext), data) for ext in ('.bz2', '.gz'))
+        # bz2 and zlib release the GIL while compressing, so threads are enough here
+        with ThreadPoolExecutor(max_workers=len(compressed)) as executor:
+            for _ in executor.map(lambda args: _write_compressed(*args), compressed):
+                pass
+
+
+INDEX_CACHE_FILENAME = '.index.sqlite'
+# monolithic json index written by older versions of conda-build.  Imported once, then removed.
+_LEGACY_INDEX_FILENAME = '.index.json'
+
+
+def _stat_key(st):
+    return st.st_size, st.st_mtime, st.st_ino
+
+
+class IndexCache(object):
+    """sqlite-backed store of the index.json records of the packages in one channel subdir.
+
+    Records are keyed by filename, and stored along with the (size, mtime, inode) of the tarball
+    that they were read from.  Changed packages are detected with one stat call each, and adding
+    or replacing a package touches only that package's row - nothing else is read or rewritten.
+    """
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.path = join(dir_path, INDEX_CACHE_FILENAME)
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS packages (
+                                      fn TEXT PRIMARY KEY,
+                                      size INTEGER NOT NULL,
+                                      mtime REAL NOT NULL,
+                                      inode INTEGER NOT NULL,
+                                      md5 TEXT NOT NULL,
+                                      info TEXT NOT NULL)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_type, e_value, traceback):
+        if e_type is None:
+            self._conn.commit()
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def commit(self):
+        self._conn.commit()
+
+    def stat_keys(self):
+        """Returns a dict of filename: ((size, mtime, inode), md5) for all records"""
+        return {fn: ((size, mtime, inode), md5) for fn, size, mtime, inode, md5 in
+                self._conn.execute("SELECT fn, size, mtime, inode, md5 FROM packages")}
+
+    def records(self, fns=None):
+        """Returns a dict of filename: index.json record for all records, or only for those of
+        the filenames fns that are in the cache"""
+        if fns is None:
+            return {fn: json.loads(info) for fn, info in
+                    self._conn.execute("SELECT fn, info FROM packages")}
+        records = {}
+        for fn in fns:
+            for info, in self._conn.execute("SELECT info FROM packages WHERE fn = ?", (fn, )):
+                records[fn] = json.loads(info)
+        return records
+
+    def upsert(self, fn, info, st):
+        """Add or replace the record for fn.  st is the os.stat result of the tarball, taken
+        before it was read."""
+        size, mtime, inode = _stat_key(st)
+        self._conn.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?)",
+                           (fn, size, mtime, inode, info['md5'],
+                            json.dumps(info, sort_keys=True, default=str)))
+
+    def remove(self, fns):
+        self._conn.executemany("DELETE FROM packages WHERE fn = ?", ((fn, ) for fn in fns))
+
+    def clear(self):
+        self._conn.execute("DELETE FROM packages")
+
+
+def _import_legacy_index(cache, dir_path):
+    """Move records from an old .index.json into cache, keeping only those whose tarball has not
+    changed since it was written."""
+    index_path = join(dir_path, _LEGACY_INDEX_FILENAME)
+    if not isfile(index_path):
+        return
+    try:
+        mode_dict = {'mode': 'r', 'encoding': 'utf-8'} if PY3 else {'mode': 'rb'}
+        with open(index_path, **mode_dict) as fi:
+            index = json.load(fi)
+    except (IOError, ValueError):
+        index = {}
+    for fn, info in index.items():
+        path = join(dir_path, fn)
+        if isfile(path):
+            st = os.stat(path)
+            if info.get('mtime') == st.st_mtime and 'md5' in info:
+                cache.upsert(fn, info, st)
+    os.remove(index_path)
+
+
+def _update_cache(cache, dir_path, fns, verbose=True, threads=None):
+    """Read the given package filenames in dir_path and upsert their records into cache"""
+    paths = [join(dir_path, fn) for fn in fns]
+    # stat before reading, so that a package changing under us is picked up next time
+    stats = [os.stat(path) for path in paths]
+    for fn, st, info in zip(fns, stats, _read_index_and_file_infos(paths, threads)):
+        if verbose:
+            print('updating:', fn)
+        cache.upsert(fn, info, st)
+
+
+def _repodata_record(dir_path, fn, info):
+    for varname in 'arch', 'platform', 'mtime', 'ucs':
+        try:
+            del info[varname]
+        except KeyError:
+            pass
+
+    if 'requires' in info and 'depends' not in info:
+        info['depends'] = info['requires']
+    info['sig'] = '.' if isfile(join(dir_path, fn + '.sig')) else None
+    return info
+
+
+def _repodata_stat_key(dir_path):
+    try:
+        return _stat_key(os.stat(join(dir_path, 'repodata.json')))
+    except OSError:
+        return None
+
+
+def _write_repodata_from_cache(cache, dir_path, lock, locking=True, timeout=90, compact=False,
+                               changed=None):
+    """Write repodata for the records in cache.  With changed (filenames whose records were
+    added, replaced or removed), the repodata this process last wrote to dir_path is updated
+    with just those records, as long as repodata.json has not been rewritten since; otherwise
+    every record is read from the cache."""
+    written = _written_repodata.get(os.path.abspath(dir_path))
+    if changed is not None and written and written[0] == _repodata_stat_key(dir_path):
+        repodata = written[1]
+        records = cache.records(changed)
+        for fn in changed:
+            # .conda packages go under their own key, which clients that cannot install them
+            #    ignore
+            packages = repodata.setdefault('packages.conda' if is_conda_pkg(fn) else
+                                           'packages', {})
+            if fn in records:
+                packages[fn] = _repodata_record(dir_path, fn, records[fn])
+            else:
+                packages.pop(fn, None)
+    else:
+        index = cache.records()
+        repodata = {'packages': {fn: _repodata_record(dir_path, fn, info)
+                                 for fn, info in index.items() if not is_conda_pkg(fn)},
+                    'packages.conda': {fn: _repodata_record(dir_path, fn, info)
+                                       for fn, info in index.items() if is_conda_pkg(fn)},
+                    'info': {}}
+    if not repodata.get('packages.conda'):
+        repodata.pop('packages.conda', None)
+    write_repodata(repodata, dir_path, lock=lock, locking=locking, timeout=timeout,
+                   compact=compact)
+    _written_repodata[os.path.abspath(dir_path)] = (_repodata_stat_key(dir_path), repodata)
 
 
 def update_index(dir_path, force=False, check_md5=False, remove=True, lock=None,
-                 could_be_mirror=True, verbose=True, locking=True, timeout=90):
+                 could_be_mirror=True, verbose=True, locking=True, timeout=90, threads=None,
+                 compact=False):
     """
     Update all index files in dir_path with changed packages.
 
@@ -70,9 +402,14 @@ def update_index(dir_path, force=False, check_md5=False, remove=True, lock=None,
     :param force: Whether to re-index all packages (including those that
                   haven't changed) or not.
     :type force: bool
-    :param check_md5: Whether to check MD5s instead of mtimes for determining
-                      if a package changed.
+    :param check_md5: Whether to check MD5s instead of size, mtime and inode for
+                      determining if a package changed.
     :type check_md5: bool
+    :param threads: Number of worker processes used to read changed packages.  None or 1
+                    reads them serially in this process.
+    :type threads: int
+    :param compact: Write repodata json without indentation.
+    :type compact: bool
     """
 
     log = utils.get_logger(__name__)
@@ -81,8 +418,6 @@ def update_index(dir_path, force=False, check_md5=False, remove=True, lock=None,
     if not os.path.isdir(dir_path):
         os.makedirs(dir_path)
 
-    index_path = join(dir_path, '.index.json')
-
     if not lock:
         lock = get_lock(dir_path)
 
@@ -90,61 +425,115 @@ def update_index(dir_path, force=False, check_md5=False, remove=True, lock=None,
     if locking:
         locks.append(lock)
 
-    index = {}
-
     with try_acquire_locks(locks, timeout):
-        if not force:
-            try:
-                mode_dict = {'mode': 'r', 'encoding': 'utf-8'} if PY3 else {'mode': 'rb'}
-                with open(index_path, **mode_dict) as fi:
-                    index = json.load(fi)
-            except (IOError, ValueError):
-                index = {}
-
-        files = set(fn for fn in os.listdir(dir_path) if fn.endswith('.tar.bz2'))
-        for fn in files:
-            path = join(dir_path, fn)
-            if fn in index:
-                if check_md5:
-                    if index[fn]['md5'] == md5_file(path):
+        with IndexCache(dir_path) as cache:
+            if force:
+                cache.clear()
+            _import_legacy_index(cache, dir_path)
+            stat_keys = cache.stat_keys()
+
+            files = set(fn for fn in os.listdir(dir_path) if fn.endswith(PACKAGE_EXTENSIONS))
+            changed = []
+            for fn in sorted(files):
+                path = join(dir_path, fn)
+                if fn in stat_keys:
+                    key, md5 = stat_keys[fn]
+                    if check_md5:
+                        if md5 == md5_file(path):
+                            continue
+                    elif key == _stat_key(os.stat(path)):
                         continue
-                elif index[fn]['mtime'] == getmtime(path):
-                    continue
-            if verbose:
-                print('updating:', fn)
-            d = read_index_tar(path, lock=lock, locking=locking, timeout=timeout)
-            d.update(file_info(path))
-            index[fn] = d
-
-        for fn in files:
-            index[fn]['sig'] = '.' if isfile(join(dir_path, fn + '.sig')) else None
-
-        if remove:
-            # remove files from the index which are not on disk
-            for fn in set(index) - files:
+                changed.append(fn)
+            _update_cache(cache, dir_path, changed, verbose=verbose, threads=threads)
+
+            if remove:
+                # remove files from the index which are not on disk
+                removed = sorted(set(stat_keys) - files)
                 if verbose:
-                    print("removing:", fn)
-                del index[fn]
-
-        # Deal with Python 2 and 3's different json module type reqs
-        mode_dict = {'mode': 'w', 'encoding': 'utf-8'} if PY3 else {'mode': 'wb'}
-        with open(index_path, **mode_dict) as fo:
-            json.dump(index, fo, indent=2, sort_keys=True, default=str)
-
-        # --- new repodata
-        for fn in index:
-            info = index[fn]
-            for varname in 'arch', 'platform', 'mtime', 'ucs':
-                try:
-                    del info[varname]
-                except KeyError:
-                    pass
+                    for fn in removed:
+                        print("removing:", fn)
+                cache.remove(removed)
+            cache.commit()
+
+            _write_repodata_from_cache(cache, dir_path, lock=lock, locking=locking,
+                                       timeout=timeout, compact=compact)
+
+
+def update_index_for_packages(dir_path, fns, lock=None, verbose=True, locking=True,
+                              timeout=90, compact=False):
+    """
+    Add or replace the index records of the given package filenames in dir_path, and regenerate
+    repodata.  Other packages in dir_path are neither listed nor read.
 
-            if 'requires' in info and 'depends' not in info:
-                info['depends'] = info['requires']
+    Falls back to a full update_index if dir_path has not been indexed yet.
+    """
+    if not isfile(join(dir_path, INDEX_CACHE_FILENAME)):
+        return update_index(dir_path, lock=lock, verbose=verbose, locking=locking,
+                            timeout=timeout, compact=compact)
 
-        repodata = {'packages': index, 'info': {}}
-        write_repodata(repodata, dir_path, lock=lock, locking=locking, timeout=timeout)
+    if not lock:
+        lock = get_lock(dir_path)
+
+    locks = []
+    if locking:
+        locks.append(lock)
+
+    with try_acquire_locks(locks, timeout):
+        with IndexCache(dir_path) as cache:
+            fns = sorted(set(utils.ensure_list(fns)))
+            _update_cache(cache, dir_path, fns, verbose=verbose)
+            cache.commit()
+            _write_repodata_from_cache(cache, dir_path, lock=lock, locking=locking,
+                                       timeout=timeout, compact=compact, changed=fns)
+
+
+def add_packages_to_index(dir_path, fns, verbose=True, locking=True, timeout=90):
+    """Index the given package filenames in dir_path.  Within deferred_index_updates, the
+    packages are only recorded, and indexed later together with any others in dir_path."""
+    if _deferring_index_updates:
+        pending_index_updates.setdefault(dir_path, set()).update(utils.ensure_list(fns))
+    else:
+        update_index_for_packages(dir_path, fns, verbose=verbose, locking=locking,
+                                  timeout=timeout)
+
+
+def flush_index_updates(verbose=True, locking=True, timeout=90):
+    """Apply all pending index updates, one incremental update per subdir"""
+    for dir_path in sorted(pending_index_updates):
+        update_index_for_packages(dir_path, sorted(pending_index_updates[dir_path]),
+                                  verbose=verbose, locking=locking, timeout=timeout)
+        del pending_index_updates[dir_path]
+
+
+def _pending_package_names():
+    return set(fn.rsplit('-', 2)[0] for fns in pending_index_updates.values() for fn in fns)
+
+
+@contextlib.contextmanager
+def deferred_index_updates(verbose=True, locking=True, timeout=90):
+    """Batch up add_packages_to_index calls, and apply them when the outermost context exits.
+
+    Anything that looks for one of the pending packages before then (see the package_names
+    argument of get_build_index) gets the pending updates applied first.  If the context exits
+    with an error, a failure to apply the updates is logged rather than raised, so that the
+    original error is the one that propagates."""
+    global _deferring_index_updates
+    _deferring_index_updates += 1
+    try:
+        yield
+    except BaseException:
+        exc_info = sys.exc_info()
+        _deferring_index_updates -= 1
+        if not _deferring_index_updates:
+            try:
+                flush_index_updates(verbose=verbose, locking=locking, timeout=timeout)
+            except Exception as e:
+                utils.get_logger(__name__).error("Failed to index built packages: %s", e)
+        reraise(*exc_info)
+    else:
+        _deferring_index_updates -= 1
+        if not _deferring_index_updates:
+            flush_index_updates(verbose=verbose, locking=locking, timeout=timeout)
 
 
 def ensure_valid_channel(local_folder, subdir, verbose=True, locking=True, timeout=90):
@@ -156,50 +545,69 @@ def ensure_valid_channel(local_folder, subdir, verbose=True, locking=True, timeo
             update_index(path, verbose=verbose, locking=locking, timeout=timeout)
 
 
+def _local_channel_fingerprint(output_folder, subdir):
+    fingerprint = []
+    for folder in (subdir, 'noarch'):
+        try:
+            fingerprint.append(_stat_key(os.stat(join(output_folder, folder, 'repodata.json'))))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
 def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
                     omit_defaults=False, channel_urls=None, debug=False, verbose=True,
-                    locking=True, timeout=90):
+                    locking=True, timeout=90, package_names=None):
+    """package_names: names of the packages the caller is about to look for.  If any of them
+    has been built but not yet indexed (see deferred_index_updates), the pending index updates
+    are applied first."""
     global local_index_timestamp
     global local_subdir
     global cached_index
     global cached_channels
+    global cached_local_index
+    global local_index_fingerprint
+    global cached_index_hash
     log = utils.get_logger(__name__)
-    mtime = 0
 
     channel_urls = list(utils.ensure_list(channel_urls))
 
     if not output_folder:
         output_folder = os.path.dirname(bldpkgs_dir)
 
-    # check file modification time - this is the age of our index.
+    # packages built since the last index update need to be visible to whoever is asking for them
+    if package_names and set(package_names) & _pending_package_names():
+        flush_index_updates(verbose=verbose, locking=locking, timeout=timeout)
+
+    # the fingerprint of the local channel's repodata is the age of our index.
     index_file = os.path.join(output_folder, subdir, 'repodata.json')
-    if os.path.isfile(index_file):
-        mtime = os.path.getmtime(index_file)
+    fingerprint = _local_channel_fingerprint(output_folder, subdir)
+
+    capture = contextlib.contextmanager(lambda: (yield))
+    if debug:
+        log_context = partial(utils.LoggingContext, logging.DEBUG)
+    elif verbose:
+        log_context = partial(utils.LoggingContext, logging.WARN)
+    else:
+        log_context = partial(utils.LoggingContext, logging.CRITICAL + 1)
+        capture = utils.capture
 
     if (clear_cache or
+            cached_index is None or
             not os.path.isfile(index_file) or
             local_subdir != subdir or
-            mtime > local_index_timestamp or
             cached_channels != channel_urls):
 
         log.debug("Building new index for subdir '{}' with channels {}, condarc channels "
                   "= {}".format(subdir, channel_urls, not omit_defaults))
         # priority: local by croot (can vary), then channels passed as args,
         #     then channels from config.
-        capture = contextlib.contextmanager(lambda: (yield))
-        if debug:
-            log_context = partial(utils.LoggingContext, logging.DEBUG)
-        elif verbose:
-            log_context = partial(utils.LoggingContext, logging.WARN)
-        else:
-            log_context = partial(utils.LoggingContext, logging.CRITICAL + 1)
-            capture = utils.capture
-
         urls = list(channel_urls)
         if os.path.isdir(output_folder):
             urls.insert(0, url_path(output_folder))
         ensure_valid_channel(output_folder, subdir, verbose=verbose, locking=locking,
                              timeout=timeout)
+        fingerprint = _local_channel_fingerprint(output_folder, subdir)
 
         # silence output from conda about fetching index files
         with log_context():
@@ -224,7 +632,67 @@ def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
                                              use_local=False,
                                              use_cache=False,
                                              platform=subdir)
-        local_index_timestamp = os.path.getmtime(index_file)
+        cached_local_index = _local_channel_records(cached_index, output_folder)
         local_subdir = subdir
         cached_channels = channel_urls
+        cached_index_hash = None
+
+    elif fingerprint != local_index_fingerprint:
+        log.debug("Merging changed local channel records into index for subdir '{}'"
+                  .format(subdir))
+        with log_context():
+            with capture():
+                new_local_index = _get_local_channel_index(output_folder, subdir)
+        for dist in set(cached_local_index) - set(new_local_index):
+            cached_index.pop(dist, None)
+        for dist, record in new_local_index.items():
+            if cached_local_index.get(dist) != record:
+                cached_index[dist] = record
+        cached_local_index = new_local_index
+        cached_index_hash = None
+
+    local_index_fingerprint = fingerprint
+    # any change to either local repodata file must invalidate things keyed on this timestamp
+    local_index_timestamp = max([key[1] for key in fingerprint if key] or [0])
     return cached_index, local_index_timestamp
+
+
+def _hash_index(index):
+    """sha256 over the dists in index and the md5s of their tarballs.  Local packages can be
+    rebuilt under the same name, so the dists alone are not enough."""
+    h = hashlib.sha256()
+    for dist, md5 in sorted((str(dist), record.get('md5') or '')
+                            for dist, record in index.items()):
+        h.update('{} {}\n'.format(dist, md5).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_build_index_hash():
+    """Returns the content hash of the index last returned by get_build_index, or None if no
+    solve cache is configured (the hash is only needed to key that cache)."""
+    global cached_index_hash
+    from conda_build import environ
+    if cached_index is None or not environ.solve_cache:
+        return None
+    if cached_index_hash is None:
+        cached_index_hash = _hash_index(cached_index)
+    return cached_index_hash
+
+
+def _local_channel_records(index, output_folder):
+    """The records in index that come from the local channel in output_folder"""
+    local_url = url_path(output_folder).rstrip('/') + '/'
+    return {dist: record for dist, record in index.items()
+            if (record.get('url') or '').startswith(local_url)}
+
+
+def _get_local_channel_index(output_folder, subdir):
+    """Index of only the local channel.  As the first channel in the full index, its records get
+    the same priority on their own as they do there."""
+    if not os.path.isdir(output_folder):
+        return {}
+    return get_index(channel_urls=[url_path(output_folder)],
+                     prepend=False,
+                     use_local=False,
+                     use_cache=False,
+                     platform=subdir)
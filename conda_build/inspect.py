@@ -20,6 +20,7 @@ from .conda_interface import (iteritems, specs_from_args, is_linked, linked_data
 from .conda_interface import display_actions, install_actions
 
 
+from conda_build.conda_format import strip_package_extension
 from conda_build.os_utils.ldd import get_linkages, get_package_obj_files, get_untracked_obj_files
 from conda_build.os_utils.macho import get_rpaths, human_filetype
 from conda_build.utils import (groupby, getter, comma_join, rm_rf, package_has_file, get_logger,
@@ -190,7 +191,8 @@ def _underlined_text(text):
 
 
 def inspect_linkages(packages, prefix=sys.prefix, untracked=False,
-                     all_packages=False, show_files=False, groupby="package", sysroot=""):
+                     all_packages=False, show_files=False, groupby="package", sysroot="",
+                     verify=False):
     pkgmap = {}
 
     installed = _installed(prefix)
@@ -219,7 +221,7 @@ def inspect_linkages(packages, prefix=sys.prefix, untracked=False,
             obj_files = get_untracked_obj_files(prefix)
         else:
             obj_files = get_package_obj_files(dist, prefix)
-        linkages = get_linkages(obj_files, prefix, sysroot)
+        linkages = get_linkages(obj_files, prefix, sysroot, verify=verify)
         depmap = defaultdict(list)
         pkgmap[pkg] = depmap
         depmap['not found'] = []
@@ -317,7 +319,7 @@ def get_hash_input(packages):
     log = get_logger(__name__)
     hash_inputs = {}
     for pkg in ensure_list(packages):
-        pkgname = os.path.basename(pkg)[:-8]
+        pkgname = strip_package_extension(os.path.basename(pkg))
         hash_inputs[pkgname] = {}
         hash_input = package_has_file(pkg, 'info/hash_input.json')
         if hash_input:
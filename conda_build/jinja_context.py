@@ -76,6 +76,60 @@ class FilteredLoader(jinja2.BaseLoader):
         return select_lines(contents, ns_cfg(self.config)), filename, uptodate
 
 
+class TemplateCodeCache(jinja2.BytecodeCache):
+    """
+    Keeps compiled template code in memory for the life of the process, so that parsing a
+    recipe again only costs a render.  Entries are keyed by template path and mtime, plus the
+    checksum jinja2 takes of the (selector-filtered) source, so editing a recipe or rendering
+    it with different selectors compiles a new entry.  If bytecode_dir is given, compiled code
+    is also written there and read back by later processes.
+    """
+
+    def __init__(self, bytecode_dir=None):
+        self._code = {}
+        self._disk_cache = None
+        if bytecode_dir:
+            if not os.path.isdir(bytecode_dir):
+                os.makedirs(bytecode_dir)
+            self._disk_cache = jinja2.FileSystemBytecodeCache(bytecode_dir)
+
+    def get_cache_key(self, name, filename=None):
+        key = super(TemplateCodeCache, self).get_cache_key(name, filename)
+        if filename and os.path.isfile(filename):
+            key = '{}-{}'.format(key, os.path.getmtime(filename))
+        return key
+
+    def load_bytecode(self, bucket):
+        code = self._code.get((bucket.key, bucket.checksum))
+        if code is not None:
+            bucket.code = code
+        elif self._disk_cache:
+            self._disk_cache.load_bytecode(bucket)
+            if bucket.code is not None:
+                self._code[(bucket.key, bucket.checksum)] = bucket.code
+
+    def dump_bytecode(self, bucket):
+        self._code[(bucket.key, bucket.checksum)] = bucket.code
+        if self._disk_cache:
+            self._disk_cache.dump_bytecode(bucket)
+
+    def clear(self):
+        self._code.clear()
+        if self._disk_cache:
+            self._disk_cache.clear()
+
+
+_template_code_caches = {}
+
+
+def get_template_code_cache(config):
+    """Return the per-process TemplateCodeCache for config's jinja_bytecode_cache folder"""
+    bytecode_dir = getattr(config, 'jinja_bytecode_cache', None)
+    if bytecode_dir not in _template_code_caches:
+        _template_code_caches[bytecode_dir] = TemplateCodeCache(bytecode_dir)
+    return _template_code_caches[bytecode_dir]
+
+
 def load_setup_py_data(config, setup_file='setup.py', from_recipe_dir=False, recipe_dir=None,
                        permit_undefined_jinja=True):
     _setuptools_data = {}
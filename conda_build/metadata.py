@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 
+import ast
 from collections import OrderedDict
 import copy
 import hashlib
@@ -10,6 +11,8 @@ import re
 import sys
 import time
 
+from six.moves import builtins
+
 from .conda_interface import iteritems, PY3, text_type
 from .conda_interface import md5_file
 from .conda_interface import non_x86_linux_machines
@@ -19,6 +22,7 @@ from .conda_interface import envs_dirs
 from .conda_interface import string_types
 
 from conda_build import exceptions, utils, variants
+from conda_build.conda_format import package_extension
 from conda_build.features import feature_list
 from conda_build.config import Config, get_or_merge_config
 from conda_build.utils import (ensure_list, find_recipe, expand_globs, get_installed_packages,
@@ -44,7 +48,36 @@ ARCH_MAP = {'32': 'x86',
             '64': 'x86_64'}
 
 
+# fingerprint of the config fields ns_cfg reads -> namespace, minus os.environ
+_ns_cfg_cache = {}
+
+
+def _ns_cfg_key(config):
+    variant = config.variant
+    return (config.build_subdir, variant.get('python'), variant.get('numpy'),
+            variant.get('perl'), variant.get('lua'), os.environ.get('FEATURE_NOMKL'))
+
+
+def clear_ns_cfg_cache():
+    """Forget all namespaces computed by ns_cfg.  Only needed if something other than the config's
+    platform or variant (both part of the cache key) changes what ns_cfg would return."""
+    _ns_cfg_cache.clear()
+
+
 def ns_cfg(config):
+    """Return the namespace that selectors and jinja2 templates are evaluated against.
+
+    The platform and variant-derived part is computed once per distinct config fingerprint;
+    os.environ is layered on top on each call."""
+    key = _ns_cfg_key(config)
+    if key not in _ns_cfg_cache:
+        _ns_cfg_cache[key] = _compute_ns_cfg(config)
+    d = dict(_ns_cfg_cache[key])
+    d.update(os.environ)
+    return d
+
+
+def _compute_ns_cfg(config):
     # Remember to update the docs of any of this changes
     plat = config.build_subdir
     d = dict(
@@ -92,7 +125,6 @@ def ns_cfg(config):
 
     for feature, value in feature_list:
         d[feature] = value
-    d.update(os.environ)
     return d
 
 
@@ -107,30 +139,36 @@ def ns_cfg(config):
 sel_pat = re.compile(r'(.+?)\s*(#.*)?\[([^\[\]]+)\](?(2).*)$')
 
 
-# this function extracts the variable name from a NameError exception, it has the form of:
-# "NameError: name 'var' is not defined", where var is the variable that is not defined. This gets
-#    returned
-def parseNameNotFound(error):
-    m = re.search('\'(.+?)\'', str(error))
-    if len(m.groups()) == 1:
-        return m.group(1)
-    else:
-        return ""
+# selector string -> (code object, names the selector reads).  Selectors are compiled once per
+#    process; every later evaluation is a plain eval of the code object.
+_compiled_selectors = {}
+
+
+def _compile_selector(selector_string):
+    if selector_string not in _compiled_selectors:
+        tree = ast.parse(selector_string.strip(), mode='eval')
+        names = set(node.id for node in ast.walk(tree)
+                    if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load))
+        _compiled_selectors[selector_string] = (compile(tree, '<selector>', 'eval'),
+                                                sorted(names))
+    return _compiled_selectors[selector_string]
 
 
 # We evaluate the selector and return True (keep this line) or False (drop this line)
-# If we encounter a NameError (unknown variable in selector), then we replace it by False and
-#     re-run the evaluation
+# Names that are neither in the namespace nor builtins (unknown variables in the selector) are
+#     treated as False
 def eval_selector(selector_string, namespace):
-    try:
-        # TODO: is there a way to do this without eval?  Eval allows arbitrary
-        #    code execution.
-        return eval(selector_string, namespace, {})
-    except NameError as e:
-        missing_var = parseNameNotFound(e)
-        print("Warning: Treating unknown selector \'" + missing_var + "\' as if it was False.")
-        next_string = selector_string.replace(missing_var, "False")
-        return eval_selector(next_string, namespace)
+    code, names = _compile_selector(selector_string)
+    missing = [name for name in names
+               if name not in namespace and not hasattr(builtins, name)]
+    if missing:
+        for missing_var in missing:
+            print("Warning: Treating unknown selector \'" + missing_var + "\' as if it was False.")
+        namespace = dict(namespace)
+        namespace.update(dict.fromkeys(missing, False))
+    # TODO: is there a way to do this without eval?  Eval allows arbitrary
+    #    code execution.
+    return eval(code, namespace, {})
 
 
 def select_lines(data, namespace):
@@ -651,6 +689,118 @@ def get_updated_output_dict_from_reparsed_metadata(original_dict, new_outputs):
     return output_d
 
 
+class SharedSectionsDict(dict):
+    """
+    The meta dict of a MetaData object.  copy() only deep-copies the sections that have been
+    handed out (looked up through [], get, setdefault, pop, items or values, or assigned), since
+    a caller may still hold and change those.  The other sections are shared between the copy
+    and the original, and a shared section is deep-copied the first time it is looked up on
+    either side.  Only sections that are actually touched are duplicated, which keeps the many
+    copies made while rendering variants and outputs cheap.
+
+    Raw iteration (dict(d), json.dumps, yaml) reads sections without copying them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SharedSectionsDict, self).__init__(*args, **kwargs)
+        self._shared = set()
+        # the caller may still hold the sections it passed in
+        self._handed_out = set(dict.keys(self))
+
+    def _own(self, key):
+        if key in self._shared:
+            self._shared.discard(key)
+            dict.__setitem__(self, key, copy.deepcopy(dict.__getitem__(self, key)))
+        if key in self:
+            self._handed_out.add(key)
+
+    def _own_all(self):
+        for key in list(dict.keys(self)):
+            self._own(key)
+
+    def __getitem__(self, key):
+        self._own(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._shared.discard(key)
+        self._handed_out.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._shared.discard(key)
+        self._handed_out.discard(key)
+        dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        self._own(key)
+        self._handed_out.discard(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._own_all()
+        key, value = dict.popitem(self)
+        self._handed_out.discard(key)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self._shared.clear()
+        self._handed_out.clear()
+        dict.clear(self)
+
+    def items(self):
+        self._own_all()
+        return dict.items(self)
+
+    def values(self):
+        self._own_all()
+        return dict.values(self)
+
+    if not PY3:
+        def iteritems(self):
+            self._own_all()
+            return dict.iteritems(self)
+
+        def itervalues(self):
+            self._own_all()
+            return dict.itervalues(self)
+
+    def copy(self):
+        new = SharedSectionsDict()
+        for key, value in dict.items(self):
+            if key in self._handed_out:
+                dict.__setitem__(new, key, copy.deepcopy(value))
+            else:
+                dict.__setitem__(new, key, value)
+                self._shared.add(key)
+                new._shared.add(key)
+        return new
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        new = SharedSectionsDict()
+        for key, value in dict.items(self):
+            dict.__setitem__(new, key, copy.deepcopy(value, memo))
+        return new
+
+    def __reduce__(self):
+        return SharedSectionsDict, (dict(dict.items(self)), )
+
+
 class MetaData(object):
     def __init__(self, path, config=None, variant=None):
 
@@ -1092,7 +1242,7 @@ class MetaData(object):
         return '%s-%s-%s' % (self.name(), self.version(), self.build_id())
 
     def pkg_fn(self):
-        return "%s.tar.bz2" % self.dist()
+        return self.dist() + package_extension(self.config)
 
     def is_app(self):
         return bool(self.get_value('app/entry'))
@@ -1235,7 +1385,8 @@ class MetaData(object):
             with open(self.meta_path) as fd:
                 return fd.read()
 
-        from conda_build.jinja_context import context_processor, UndefinedNeverFail, FilteredLoader
+        from conda_build.jinja_context import (context_processor, UndefinedNeverFail,
+                                               FilteredLoader, get_template_code_cache)
 
         path, filename = os.path.split(self.meta_path)
         loaders = [  # search relative to '<conda_root>/Lib/site-packages/conda_build/templates'
@@ -1260,7 +1411,9 @@ class MetaData(object):
             undefined_type = UndefinedNeverFail
 
         loader = FilteredLoader(jinja2.ChoiceLoader(loaders), config=self.config)
-        env = jinja2.Environment(loader=loader, undefined=undefined_type)
+        # compiled templates are shared between parses; only the render below is repeated
+        env = jinja2.Environment(loader=loader, undefined=undefined_type,
+                                 bytecode_cache=get_template_code_cache(self.config))
 
         env.globals.update(ns_cfg(self.config))
         env.globals.update(context_processor(self, path, config=self.config,
@@ -1415,9 +1568,18 @@ class MetaData(object):
     def copy(self):
         new = copy.copy(self)
         new.config = self.config.copy()
-        new.meta = copy.deepcopy(self.meta)
+        new.meta = self.meta.copy()
         return new
 
+    @property
+    def meta(self):
+        return self._meta
+
+    @meta.setter
+    def meta(self, value):
+        self._meta = (value if isinstance(value, SharedSectionsDict) else
+                      SharedSectionsDict(value))
+
     @property
     def noarch(self):
         return self.get_value('build/noarch')
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import re
 import subprocess
@@ -8,10 +9,13 @@ from os.path import join, basename
 from conda_build.conda_interface import memoized
 from conda_build.conda_interface import untracked
 from conda_build.conda_interface import linked_data
+from conda_build.conda_interface import cc_conda_build
 
 from conda_build import post
+from conda_build.environ import get_cpu_count
+from conda_build.utils import get_logger
 from conda_build.os_utils.macho import otool
-from conda_build.os_utils.pyldd import inspect_linkages
+from conda_build.os_utils.pyldd import codefile_memo, codefile_parse_cache, inspect_linkages
 
 LDD_RE = re.compile(r'\s*(.*?)\s*=>\s*(.*?)\s*\(.*\)')
 LDD_NOT_FOUND_RE = re.compile(r'\s*(.*?)\s*=>\s*not found')
@@ -41,62 +45,82 @@ def ldd(path):
     return res
 
 
+def linkage_cache_dir():
+    """Folder of the on-disk cache of parsed code files shared by get_linkages calls (see
+    pyldd.codefile_parse_cache), or None.  The cache is opt-in: it is only used when the
+    conda_build/linkage_cache_dir condarc setting names a folder for it.  Nothing is ever
+    evicted from it, so it is best kept somewhere that can be cleared at will."""
+    return cc_conda_build.get('linkage_cache_dir')
+
+
+def _inspect_file_linkages(path, sysroot, verify, memo=None):
+    res_py = [(basename(lp), lp) for lp in inspect_linkages(path, sysroot=sysroot, memo=memo)]
+    get_logger(__name__).debug("pyldd linkages of %s: %s", path, set(res_py))
+    if not verify:
+        return res_py
+    # ldd quite often fails on foreign architectures.
+    try:
+        if sys.platform.startswith('linux'):
+            res = ldd(path)
+        elif sys.platform.startswith('darwin'):
+            links = otool(path)
+            res = [(basename(l['name']), l['name']) for l in links]
+        else:
+            return res_py
+    except:
+        return res_py
+    if set(res) != set(res_py):
+        print("WARNING: pyldd disagrees with ldd/otool. This will not cause any\n"
+              "WARNING: problems for this build, but please file a bug at:\n"
+              "WARNING: https://github.com/conda/conda-build\n"
+              "WARNING: and (if possible) attach file {}\n"
+              "WARNING: ldd/tool gives {}, pyldd gives {}".format(path, set(res), set(res_py)))
+    return res
+
+
 @memoized
-def get_linkages(obj_files, prefix, sysroot):
-    res = {}
-
-    for f in obj_files:
-        path = join(prefix, f)
-        # ldd quite often fails on foreign architectures.
-        ldd_failed = False
-        try:
-            if sys.platform.startswith('linux'):
-                res[f] = ldd(path)
-            elif sys.platform.startswith('darwin'):
-                links = otool(path)
-                res[f] = [(basename(l['name']), l['name']) for l in links]
-        except:
-            ldd_failed = True
-        finally:
-            res_py = inspect_linkages(path, sysroot)
-            res_py = [(basename(lp), lp) for lp in res_py]
-            print("set(res_py) {}".format(set(res_py)))
-            if ldd_failed:
-                res[f] = res_py
-            else:
-                print("set(res[f]) = {}".format(set(res[f])))
-                if set(res[f]) != set(res_py):
-                    print("WARNING: pyldd disagrees with ldd/otool. This will not cause any")
-                    print("WARNING: problems for this build, but please file a bug at:")
-                    print("WARNING: https://github.com/conda/conda-build")
-                    print("WARNING: and (if possible) attach file {}".format(path))
-                    print("WARNING: ldd/tool gives {}, pyldd gives {}"
-                              .format(set(res[f]), set(res_py)))
+def get_linkages(obj_files, prefix, sysroot, verify=False, threads=None, use_cache=True):
+    """Returns {f: [(library name, resolved path), ...]} for the object files obj_files
+    (relative to prefix).
 
-    return res
+    Linkages are read with pyldd.  With verify, ldd (Linux) or otool (OS X) is run as well: its
+    result is used and disagreements with pyldd are reported.  Files are inspected on threads
+    (default: one per CPU).  With use_cache and a linkage_cache_dir() configured, what pyldd
+    parses out of each file (not the resolved linkages, which depend on what else is installed)
+    is kept there, keyed by file contents, for this and later runs."""
+    cache_dir = linkage_cache_dir() if use_cache else None
+    parse_cache = codefile_parse_cache(cache_dir) if cache_dir else None
+    # libraries common to many of the files are only parsed once
+    memo = codefile_memo(parse_cache)
+
+    def linkages(f):
+        return _inspect_file_linkages(join(prefix, f), sysroot, verify, memo=memo)
+
+    if threads is None:
+        threads = int(get_cpu_count())
+    with ThreadPoolExecutor(max(threads, 1)) as executor:
+        return dict(zip(obj_files, executor.map(linkages, obj_files)))
 
 
 @memoized
-def get_package_obj_files(dist, prefix):
+def get_package_obj_files(dist, prefix, file_classes=None):
+    """file_classes: {f: post.FileClass} for (at least) the files of dist, if already known"""
     data = linked_data(prefix).get(dist)
 
     res = []
     if data:
-        for f in data.get('files', []):
-            path = join(prefix, f)
-            if post.is_obj(path):
-                res.append(f)
+        files = data.get('files', [])
+        if file_classes is None:
+            file_classes = post.classify_files(files, prefix)
+        res = [f for f in files if file_classes[f].is_obj]
 
     return res
 
 
 @memoized
-def get_untracked_obj_files(prefix):
-    res = []
+def get_untracked_obj_files(prefix, file_classes=None):
+    """file_classes: {f: post.FileClass} for (at least) the untracked files, if already known"""
     files = untracked(prefix)
-    for f in files:
-        path = join(prefix, f)
-        if post.is_obj(path):
-            res.append(f)
-
-    return res
+    if file_classes is None:
+        file_classes = post.classify_files(files, prefix)
+    return [f for f in files if file_classes[f].is_obj]
@@ -182,13 +182,22 @@ def get_rpaths(path):
     return [rpath['path'] for rpath in rpaths]
 
 
+def _print_stdout(stdout):
+    # install_name_tool's output goes through sys.stdout, so that post-build can keep it with
+    #    the messages about the file it was run on
+    stdout = stdout.decode('utf-8').rstrip()
+    if stdout:
+        print(stdout)
+
+
 def add_rpath(path, rpath, verbose=False):
     """Add an `rpath` to the Mach-O file at `path`"""
     args = ['install_name_tool', '-add_rpath', rpath, path]
     if verbose:
         print(' '.join(args))
-    p = Popen(args, stderr=PIPE)
+    p = Popen(args, stdout=PIPE, stderr=PIPE)
     stdout, stderr = p.communicate()
+    _print_stdout(stdout)
     stderr = stderr.decode('utf-8')
     if "Mach-O dynamic shared library stub file" in stderr:
         print("Skipping Mach-O dynamic shared library stub file %s\n" % path)
@@ -208,8 +217,9 @@ def delete_rpath(path, rpath, verbose=False):
     args = ['install_name_tool', '-delete_rpath', rpath, path]
     if verbose:
         print(' '.join(args))
-    p = Popen(args, stderr=PIPE)
-    _, stderr = p.communicate()
+    p = Popen(args, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = p.communicate()
+    _print_stdout(stdout)
     stderr = stderr.decode('utf-8')
     if "Mach-O dynamic shared library stub file" in stderr:
         print("Skipping Mach-O dynamic shared library stub file %s\n" % path)
@@ -250,8 +260,9 @@ def install_name_change(path, cb_func, verbose=False):
             args.extend(('-change', dylibs[index]['name'], new_name, path))
         if verbose:
             print(' '.join(args))
-        p = Popen(args, stderr=PIPE)
-        _, stderr = p.communicate()
+        p = Popen(args, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = p.communicate()
+        _print_stdout(stdout)
         stderr = stderr.decode('utf-8')
         if "Mach-O dynamic shared library stub file" in stderr:
             print("Skipping Mach-O dynamic shared library stub file %s" % path)
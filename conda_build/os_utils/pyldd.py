@@ -1,10 +1,17 @@
 from __future__ import print_function
 import argparse
+from bisect import bisect_right
+from collections import namedtuple
 import glob
+import hashlib
+import io
+import json
+import mmap
 import os
 import re
 import struct
 import sys
+import tempfile
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -451,6 +458,9 @@ SHT_GROUP = 0x11
 SHT_SYMTAB_SHNDX = 0x12
 SHT_NUM = 0x13
 SHT_LOOS = 0x60000000
+SHT_GNU_verdef = 0x6ffffffd
+SHT_GNU_verneed = 0x6ffffffe
+SHT_GNU_versym = 0x6fffffff
 
 SHF_WRITE = 0x1
 SHF_ALLOC = 0x2
@@ -498,48 +508,102 @@ DT_INIT_ARRAYSZ = 27
 DT_FINI_ARRAYSZ = 28
 DT_RUNPATH = 29
 DT_LOOS = 0x60000000
+DT_CONFIG = 0x6ffffefa
+DT_DEPAUDIT = 0x6ffffefb
+DT_AUDIT = 0x6ffffefc
 DT_HIOS = 0x6fffffff
 DT_LOPROC = 0x70000000
+DT_AUXILIARY = 0x7ffffffd
+DT_FILTER = 0x7fffffff
 DT_HIPROC = 0x7fffffff
+# Tags whose d_val is an offset into the dynamic string table
+DT_STRING_TAGS = (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH, DT_CONFIG, DT_DEPAUDIT, DT_AUDIT,
+                  DT_AUXILIARY, DT_FILTER)
 
+# An rpath of the dynamic section: its tag (DT_RPATH or DT_RUNPATH), the file offset of the
+#    dynamic entry, the entry's d_val (an offset into the string table), the file offset of the
+#    string and the string itself (still ':'-separated).
+elfrpath = namedtuple('elfrpath', ('d_tag', 'entry_offset', 'd_val', 'string_offset', 'value'))
+
+
+class elfdata(object):
+    """
+    The bytes of an ELF file for the parser.  When the file can be mmap'ed (python 3, a real
+    file) reads are zero-copy memoryview slices of the mapping and struct.unpack_from works on
+    them directly; otherwise each read is a seek and read of the file object.
+    """
 
-class elfheader(object):
     def __init__(self, file):
-        self.hdr, = struct.unpack(BIG_ENDIAN + 'L', file.read(4))
+        self.file = file
+        self.mmap = None
+        self.view = None
+        try:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            # python 2's mmap does not support memoryview
+            self.view = memoryview(self.mmap)
+        except (AttributeError, EnvironmentError, TypeError, ValueError,
+                io.UnsupportedOperation):
+            self.close()
+
+    def read(self, offset, size):
+        if self.view is not None:
+            return self.view[offset:offset + size]
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def string(self, offset, limit):
+        'Returns the NUL-terminated string at offset, looking at most limit bytes ahead'
+        if self.mmap is not None:
+            end = self.mmap.find(b'\0', offset, offset + limit)
+            return self.mmap[offset:end if end != -1 else offset + limit].decode('utf-8')
+        data = self.read(offset, limit)
+        end = data.find(b'\0')
+        return data[:end if end != -1 else len(data)].decode('utf-8')
+
+    def close(self):
+        try:
+            if self.view is not None:
+                self.view.release()
+            if self.mmap is not None:
+                self.mmap.close()
+        except BufferError:
+            # slices are still referenced (by a traceback, say); the mapping goes with them
+            pass
+        self.view = self.mmap = None
+
+
+class elfheader(object):
+    def __init__(self, data):
+        ident = data.read(0, 16)
+        self.hdr, = struct.unpack_from(BIG_ENDIAN + 'L', ident, 0)
         self.dt_needed = []
         self.dt_rpath = []
         if self.hdr != ELF_HDR:
             return
-        bitness, = struct.unpack(LITTLE_ENDIAN + 'B', file.read(1))
+        bitness, endian, self.version, self.osabi, self.abiver = \
+            struct.unpack_from(LITTLE_ENDIAN + 'BBBBB', ident, 4)
         bitness = 32 if bitness == 1 else 64
         sz_ptr = int(bitness / 8)
         ptr_type = 'Q' if sz_ptr == 8 else 'L'
         self.bitness = bitness
         self.sz_ptr = sz_ptr
         self.ptr_type = ptr_type
-        endian, = struct.unpack(LITTLE_ENDIAN + 'B', file.read(1))
         endian = LITTLE_ENDIAN if endian == 1 else BIG_ENDIAN
         self.endian = endian
-        self.version, = struct.unpack(endian + 'B', file.read(1))
-        self.osabi, = struct.unpack(endian + 'B', file.read(1))
-        self.abiver, = struct.unpack(endian + 'B', file.read(1))
-        struct.unpack(endian + 'B' * 7, file.read(7))
-        self.type, = struct.unpack(endian + 'H', file.read(2))
-        self.machine, = struct.unpack(endian + 'H', file.read(2))
-        self.version, = struct.unpack(endian + 'L', file.read(4))
-        self.entry, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.phoff, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.shoff, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.flags, = struct.unpack(endian + 'L', file.read(4))
-        self.ehsize, = struct.unpack(endian + 'H', file.read(2))
-        self.phentsize, = struct.unpack(endian + 'H', file.read(2))
-        self.phnum, = struct.unpack(endian + 'H', file.read(2))
-        self.shentsize, = struct.unpack(endian + 'H', file.read(2))
-        self.shnum, = struct.unpack(endian + 'H', file.read(2))
-        self.shstrndx, = struct.unpack(endian + 'H', file.read(2))
-        loc = file.tell()
+        fields = struct.Struct(endian + 'HHL' + ptr_type * 3 + 'LHHHHHH')
+        (self.type, self.machine, self.version, self.entry, self.phoff, self.shoff, self.flags,
+         self.ehsize, self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = \
+            fields.unpack_from(data.read(16, fields.size), 0)
+        loc = 16 + fields.size
         if loc != self.ehsize:
-            log.warning('file.tell()={} != ehsize={}'.format(loc, self.ehsize))
+            log.warning('ELF header ends at {} != ehsize={}'.format(loc, self.ehsize))
+        # Layouts of the section header, program header and dynamic section entries
+        self.shdr_struct = struct.Struct(endian + 'LL' + ptr_type * 4 + 'LL' + ptr_type * 2)
+        if bitness == 64:
+            self.phdr_struct = struct.Struct(endian + 'LL' + ptr_type * 6)
+        else:
+            self.phdr_struct = struct.Struct(endian + 'L' + ptr_type * 5 + 'L' + ptr_type)
+        self.dyn_struct = struct.Struct(endian + ptr_type * 2)
 
     def __str__(self):
         return 'bitness {}, endian {}, version {}, type {}, machine {}, entry {}'.format( # noqa
@@ -552,37 +616,16 @@ class elfheader(object):
 
 
 class elfsection(object):
-    def __init__(self, eh, file):
-        ptr_type = eh.ptr_type
-        sz_ptr = eh.sz_ptr
-        endian = eh.endian
-        # It'd be quicker to use struct.calcsize here and a single
-        # struct.unpack but it would be ugly and harder to maintain.
-        self.sh_name, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_type, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_flags, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_addr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_offset, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_size, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_link, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_info, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_addralign, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_entsize, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        # Lower priority == post processed earlier so that those
-        # with higher priority can assume already initialized.
-        if self.sh_type == SHT_STRTAB:
-            self.priority = 0
-        else:
-            self.priority = 1
-
-    def postprocess(self, elffile, file):
-        ptr_type = elffile.ehdr.ptr_type
-        sz_ptr = elffile.ehdr.sz_ptr
-        endian = elffile.ehdr.endian
-        if self.sh_type == SHT_STRTAB:
-            file.seek(self.sh_offset)
-            self.table = file.read(self.sh_size).decode()
-        elif self.sh_type == SHT_DYNAMIC:
+    __slots__ = ('sh_name', 'sh_type', 'sh_flags', 'sh_addr', 'sh_offset', 'sh_size', 'sh_link',
+                 'sh_info', 'sh_addralign', 'sh_entsize')
+
+    def __init__(self, eh, table, offset):
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset, self.sh_size,
+         self.sh_link, self.sh_info, self.sh_addralign, self.sh_entsize) = \
+            eh.shdr_struct.unpack_from(table, offset)
+
+    def postprocess(self, elffile, data):
+        if self.sh_type == SHT_DYNAMIC:
             #
             # Required reading 1:
             # http://blog.qt.io/blog/2011/10/28/rpath-and-runpath/
@@ -630,88 +673,84 @@ class elfsection(object):
             dt_needed = []
             dt_rpath = []
             dt_runpath = []
+            # (d_tag, file offset of the entry, d_val) of the entries holding rpaths
+            rpath_entries = []
+            dyn_struct = elffile.ehdr.dyn_struct
+            entries = data.read(self.sh_offset, self.sh_size)
             for m in range(int(self.sh_size / self.sh_entsize)):
-                file.seek(self.sh_offset + (m * self.sh_entsize))
-                d_tag, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-                d_val_ptr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
+                d_tag, d_val_ptr = dyn_struct.unpack_from(entries, m * self.sh_entsize)
+                if d_tag in DT_STRING_TAGS:
+                    elffile.dynstr_refs.append(d_val_ptr)
                 if d_tag == DT_NEEDED:
                     dt_needed.append(d_val_ptr)
                 elif d_tag == DT_RPATH:
                     dt_rpath.append(d_val_ptr)
-                elif d_tag == DT_RPATH:
+                elif d_tag == DT_RUNPATH:
                     dt_runpath.append(d_val_ptr)
                 elif d_tag == DT_STRTAB:
                     dt_strtab_ptr = d_val_ptr
+                if d_tag in (DT_RPATH, DT_RUNPATH):
+                    rpath_entries.append((d_tag, self.sh_offset + (m * self.sh_entsize),
+                                          d_val_ptr))
+            del entries
             if dt_strtab_ptr:
                 strsec, offset = elffile.find_section_and_offset(dt_strtab_ptr)
                 if strsec and strsec.sh_type == SHT_STRTAB:
+                    elffile.dynstr_section = (strsec, offset)
+
+                    def string(n):
+                        return data.string(strsec.sh_offset + offset + n,
+                                           strsec.sh_size - offset - n)
+
+                    for d_tag, entry_offset, r in rpath_entries:
+                        elffile.rpath_entries.append(
+                            elfrpath(d_tag, entry_offset, r, strsec.sh_offset + offset + r,
+                                     string(r)))
                     for n in dt_needed:
-                        end = n + strsec.table[n:].index('\0')
-                        elffile.dt_needed.append(strsec.table[n:end])
+                        elffile.dt_needed.append(string(n))
                     for r in dt_rpath:
-                        end = r + strsec.table[r:].index('\0')
-                        path = strsec.table[r:end]
+                        path = string(r)
                         rpaths = [path for path in path.split(':') if path]
                         elffile.dt_rpath.extend([path if not path.endswith('/')
                                                  else path.rstrip('/')
                                                  for path in rpaths])
                     for r in dt_runpath:
-                        end = r + strsec.table[r:].index('\0')
-                        path = strsec.table[r:end]
+                        path = string(r)
                         rpaths = [path for path in path.split(':') if path]
-                        elffile.dt_runpath.extend([rp if rp.endswith(os.sep)
-                                                   else rp + os.sep
-                                                   for rp in rpaths])
+                        elffile.dt_runpath.extend([path if not path.endswith('/')
+                                                   else path.rstrip('/')
+                                                   for path in rpaths])
             # runpath always takes precedence.
             if len(elffile.dt_runpath):
                 elffile.dt_rpath = []
 
 
 class programheader(object):
-    def __init__(self, eh, file):
-        ptr_type = eh.ptr_type
-        sz_ptr = eh.sz_ptr
-        endian = eh.endian
-        self.p_type, = struct.unpack(endian + 'L', file.read(4))
+    __slots__ = ('p_type', 'p_flags', 'p_offset', 'p_vaddr', 'p_paddr', 'p_filesz', 'p_memsz',
+                 'p_align')
+
+    def __init__(self, eh, table, offset):
         if eh.bitness == 64:
-            self.p_flags, = struct.unpack(endian + 'L', file.read(4))
-        self.p_offset, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_vaddr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_paddr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_filesz, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_memsz, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        if eh.bitness == 32:
-            self.p_flags, = struct.unpack(endian + 'L', file.read(4))
-        self.p_align, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-
-    def postprocess(self, elffile, file):
+            (self.p_type, self.p_flags, self.p_offset, self.p_vaddr, self.p_paddr, self.p_filesz,
+             self.p_memsz, self.p_align) = eh.phdr_struct.unpack_from(table, offset)
+        else:
+            (self.p_type, self.p_offset, self.p_vaddr, self.p_paddr, self.p_filesz,
+             self.p_memsz, self.p_flags, self.p_align) = eh.phdr_struct.unpack_from(table, offset)
+
+    def postprocess(self, elffile, data):
         if self.p_type == PT_INTERP:
-            file.seek(self.p_offset)
-            elffile.program_interpreter = file.read(self.p_filesz - 1).decode()
+            elffile.program_interpreter = data.string(self.p_offset, self.p_filesz)
 
 
 class elffile(object):
     def __init__(self, file, initial_rpaths_transitive=[]):
-        self.ehdr = elfheader(file)
-        self.dt_needed = []
-        self.dt_rpath = []
-        self.dt_runpath = []
-        self.programheaders = []
-        self.elfsections = []
-        self.program_interpreter = None
+        data = elfdata(file)
+        try:
+            self._parse(data)
+        finally:
+            data.close()
         # Not actually used ..
         self.selfdir = os.path.dirname(file.name)
-
-        for n in range(self.ehdr.phnum):
-            self.programheaders.append(programheader(self.ehdr, file))
-        for n in range(self.ehdr.shnum):
-            file.seek(self.ehdr.shoff + (n * self.ehdr.shentsize))
-            self.elfsections.append(elfsection(self.ehdr, file))
-        self.elfsections.sort(key=lambda x: x.priority)
-        for ph in self.programheaders:
-            ph.postprocess(self, file)
-        for es in self.elfsections:
-            es.postprocess(self, file)
         # TODO :: If we have a program_interpreter we need to run it as:
         # TODO :: LD_DEBUG=all self.program_interpreter --inhibit-cache --list file.name
         # TODO :: then process the output line e.g.:
@@ -732,10 +771,109 @@ class elffile(object):
         self.shared_libraries = [(needed, '$RPATH/' + needed)
                                  for needed in self.dt_needed]
 
+    def _parse(self, data):
+        self.ehdr = elfheader(data)
+        self.dt_needed = []
+        self.dt_rpath = []
+        self.dt_runpath = []
+        self.rpath_entries = []
+        # offsets of the strings that anything refers to in the dynamic string table, and the
+        #    table itself (see read_dynstr_refs)
+        self.dynstr_refs = []
+        self.dynstr = None
+        self.dynstr_section = None
+        self.programheaders = []
+        self.elfsections = []
+        self.program_interpreter = None
+
+        # The header tables are read in one go each
+        ehdr = self.ehdr
+        table = data.read(ehdr.phoff, ehdr.phnum * ehdr.phentsize)
+        for n in range(ehdr.phnum):
+            self.programheaders.append(programheader(ehdr, table, n * ehdr.phentsize))
+        table = data.read(ehdr.shoff, ehdr.shnum * ehdr.shentsize)
+        for n in range(ehdr.shnum):
+            self.elfsections.append(elfsection(ehdr, table, n * ehdr.shentsize))
+        del table
+        # Address index for find_section_and_offset: the sections that occupy memory, by start
+        #    address.  Those do not overlap, except for TLS .tbss which takes no address space.
+        mapped = sorted((es for es in self.elfsections
+                         if es.sh_flags & SHF_ALLOC and es.sh_size and
+                         not (es.sh_type == SHT_NOBITS and es.sh_flags & SHF_TLS)),
+                        key=lambda es: es.sh_addr)
+        self._section_addrs = [es.sh_addr for es in mapped]
+        self._sections_by_addr = mapped
+        for ph in self.programheaders:
+            ph.postprocess(self, data)
+        for es in self.elfsections:
+            es.postprocess(self, data)
+
+    def read_dynstr_refs(self, file):
+        """Reads the dynamic string table, and adds the references into it from the symbol and
+        version tables to dynstr_refs (which holds those from the dynamic section already).  If
+        any other section refers to the table, its references cannot be told, and dynstr_refs is
+        set to None.  Only rpath_rewritable_in_place needs these, so parsing leaves them out."""
+        if self.dynstr is not None or not self.dynstr_section:
+            return
+        data = elfdata(file)
+        try:
+            self._read_dynstr_refs(data)
+        finally:
+            data.close()
+
+    def _read_dynstr_refs(self, data):
+        strsec, base = self.dynstr_section
+        self.dynstr = bytes(data.read(strsec.sh_offset + base, strsec.sh_size - base))
+        strsec_index = self.elfsections.index(strsec)
+        endian = self.ehdr.endian
+        word = struct.Struct(endian + 'L')
+        for es in self.elfsections:
+            if es.sh_link != strsec_index or es.sh_type == SHT_DYNAMIC:
+                continue
+            table = data.read(es.sh_offset, es.sh_size)
+            refs = []
+            if es.sh_type == SHT_DYNSYM and es.sh_entsize:
+                # st_name comes first in both Elf32_Sym and Elf64_Sym
+                for n in range(int(es.sh_size / es.sh_entsize)):
+                    refs.append(word.unpack_from(table, n * es.sh_entsize)[0])
+            elif es.sh_type == SHT_GNU_verneed:
+                # Elf_Verneed entries, each followed by Elf_Vernaux entries
+                offset = 0
+                for _ in range(es.sh_info):
+                    _, cnt, vn_file, vn_aux, vn_next = \
+                        struct.unpack_from(endian + 'HHLLL', table, offset)
+                    refs.append(vn_file)
+                    aux = offset + vn_aux
+                    for _ in range(cnt):
+                        _, _, _, vna_name, vna_next = \
+                            struct.unpack_from(endian + 'LHHLL', table, aux)
+                        refs.append(vna_name)
+                        aux += vna_next
+                    offset += vn_next
+            elif es.sh_type == SHT_GNU_verdef:
+                # Elf_Verdef entries, each followed by Elf_Verdaux entries
+                offset = 0
+                for _ in range(es.sh_info):
+                    _, _, _, cnt, _, vd_aux, vd_next = \
+                        struct.unpack_from(endian + 'HHHHLLL', table, offset)
+                    aux = offset + vd_aux
+                    for _ in range(cnt):
+                        vda_name, vda_next = struct.unpack_from(endian + 'LL', table, aux)
+                        refs.append(vda_name)
+                        aux += vda_next
+                    offset += vd_next
+            else:
+                self.dynstr_refs = None
+                return
+            # section-relative offsets, where DT_STRTAB may point past the start of the section
+            self.dynstr_refs.extend(ref - base for ref in refs)
+
     def find_section_and_offset(self, addr):
         'Can be called immediately after the elfsections have been constructed'
-        for es in self.elfsections:
-            if addr >= es.sh_addr and addr < es.sh_addr + es.sh_size:
+        i = bisect_right(self._section_addrs, addr) - 1
+        if i >= 0:
+            es = self._sections_by_addr[i]
+            if addr < es.sh_addr + es.sh_size:
                 return es, addr - es.sh_addr
         return None, None
 
@@ -762,6 +900,37 @@ class elffile(object):
     def selfdir(self):
         return None
 
+    def get_rpath(self):
+        """Returns the elfrpath the dynamic linker uses: DT_RUNPATH if there is one, else
+        DT_RPATH, else None."""
+        for d_tag in (DT_RUNPATH, DT_RPATH):
+            for entry in self.rpath_entries:
+                if entry.d_tag == d_tag:
+                    return entry
+        return None
+
+    def rpath_rewritable_in_place(self, rpath):
+        """Whether the rpath string can be replaced with rpath without moving anything: there is
+        exactly one rpath entry, rpath is no longer than the current string and nothing else
+        provably uses the current string's bytes.  Linkers merge strings with common tails, so
+        that means no other reference into the dynamic string table (from the dynamic section,
+        the dynamic symbols or the version tables) points into the string, nor to a string that
+        runs on into it.  read_dynstr_refs must have been called."""
+        if len(self.rpath_entries) != 1 or self.dynstr_refs is None or self.dynstr is None:
+            return False
+        entry = self.rpath_entries[0]
+        size = len(entry.value.encode('utf-8'))
+        if len(rpath.encode('utf-8')) > size:
+            return False
+        refs = list(self.dynstr_refs)
+        refs.remove(entry.d_val)
+        for ref in refs:
+            if entry.d_val <= ref <= entry.d_val + size:
+                return False
+            if ref < entry.d_val and b'\0' not in self.dynstr[ref:entry.d_val]:
+                return False
+        return True
+
 
 class inscrutablefile(object):
     def __init__(self, file, initial_rpaths_transitive=[]):
@@ -816,43 +985,237 @@ def is_codefile(filename, skip_symlinks=True):
     return True
 
 
-# TODO :: Consider memoizing instead of repeatedly scanning
-# TODO :: libc.so/libSystem.dylib when inspect_linkages(recurse=True)
-def _inspect_linkages_this(filename, sysroot='', arch='native'):
+def get_elf_rpath(filename):
+    """Returns the rpath of ELF file filename (its DT_RUNPATH, else its DT_RPATH) as a
+    ':'-separated string, '' if it has neither, or None if filename is not an ELF file or has no
+    dynamic section (a static binary or an object file), like patchelf --print-rpath failing."""
+    with open(filename, 'rb') as f:
+        cf = codefile(f)
+    if not isinstance(cf, elffile):
+        return None
+    if not any(es.sh_type == SHT_DYNAMIC for es in cf.elfsections):
+        return None
+    entry = cf.get_rpath()
+    return entry.value if entry else ''
+
+
+def set_elf_rpath(filename, rpath, force_rpath=False):
+    """Replaces the rpath string of ELF file filename with rpath, in place.  With force_rpath the
+    entry becomes a DT_RPATH (like patchelf --force-rpath), else it keeps its tag.
+
+    Returns False, leaving the file untouched, when that is not possible without growing the
+    dynamic string table or section (see elffile.rpath_rewritable_in_place); patchelf is
+    needed then."""
+    with open(filename, 'r+b') as f:
+        cf = codefile(f)
+        if not isinstance(cf, elffile):
+            return False
+        cf.read_dynstr_refs(f)
+        if not cf.rpath_rewritable_in_place(rpath):
+            return False
+        entry = cf.rpath_entries[0]
+        f.seek(entry.string_offset)
+        # NUL-pad over the whole of the old string
+        f.write(rpath.encode('utf-8').ljust(len(entry.value.encode('utf-8')) + 1, b'\0'))
+        d_tag = DT_RPATH if force_rpath else entry.d_tag
+        if d_tag != entry.d_tag:
+            f.seek(entry.entry_offset)
+            f.write(struct.pack(cf.ehdr.endian + cf.ehdr.ptr_type, d_tag))
+    return True
+
+
+class codefile_linkages(object):
+    """
+    What resolving the linkages of a codefile takes from it: the libraries it asks for and its
+    rpaths, with $SELFDIR, $RPATH etc. still unresolved.  Unlike the codefile, this does not
+    depend on where the file is, nor on what else is installed, so it can be kept across runs.
+    """
+    __slots__ = ('shared_libraries', 'rpaths_transitive', 'rpaths_nontransitive')
+
+    def __init__(self, shared_libraries, rpaths_transitive, rpaths_nontransitive):
+        self.shared_libraries = [tuple(so) for so in shared_libraries]
+        self.rpaths_transitive = list(rpaths_transitive)
+        self.rpaths_nontransitive = list(rpaths_nontransitive)
+
+    @classmethod
+    def from_codefile(cls, cf):
+        return cls(getattr(cf, 'shared_libraries', []), getattr(cf, 'rpaths_transitive', []),
+                   getattr(cf, 'rpaths_nontransitive', []))
+
+    def to_json(self):
+        return [self.shared_libraries, self.rpaths_transitive, self.rpaths_nontransitive]
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(*data)
+
+    def get_rpaths_transitive(self):
+        return self.rpaths_transitive
+
+    def get_rpaths_nontransitive(self):
+        return self.rpaths_nontransitive
+
+    def get_resolved_shared_libraries(self, src_exedir, src_selfdir, sysroot=''):
+        result = []
+        for so_orig, so in self.shared_libraries:
+            resolved, rpath, in_sysroot = \
+                _get_resolved_location(self, so, src_exedir, src_selfdir, sysroot)
+            result.append((so_orig, resolved, rpath, in_sysroot))
+        return result
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class codefile_parse_cache(object):
+    """
+    codefile_linkages kept in cache_dir across runs, keyed by the contents of the file they were
+    parsed from (and by arch and the initial rpaths).  Only the parse is kept: it is resolved
+    against the filesystem afresh on every run, so libraries installed or removed since are
+    noticed.  A file is only hashed when its (realpath, size, mtime, inode) are not on record
+    yet.  Any I/O error just means a cache miss.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, kind, key):
+        return os.path.join(self.cache_dir, '%s-%s.json' % (kind, key))
+
+    def _read(self, kind, key):
+        try:
+            with open(self._path(kind, key)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, kind, key, value):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.rename(tmp_path, self._path(kind, key))
+        except (IOError, OSError) as e:
+            log.debug("Could not write to the codefile cache in %s: %s", self.cache_dir, e)
+
+    def _content_hash(self, filename, st):
+        signature = _sha256(json.dumps([os.path.realpath(filename), st.st_size, st.st_mtime,
+                                        st.st_ino]))
+        content_hash = self._read('stat', signature)
+        if content_hash is None:
+            sha = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            content_hash = sha.hexdigest()
+            self._write('stat', signature, content_hash)
+        return content_hash
+
+    def key(self, filename, st, arch, initial_rpaths_transitive):
+        return _sha256(json.dumps([self._content_hash(filename, st), arch,
+                                   list(initial_rpaths_transitive)]))
+
+    def get(self, key):
+        data = self._read('parse', key)
+        return codefile_linkages.from_json(data) if data is not None else None
+
+    def put(self, key, linkages):
+        self._write('parse', key, linkages.to_json())
+
+
+class codefile_memo(object):
+    """
+    codefile_linkages of the files seen in one run, keyed by (realpath, inode, mtime) so that a
+    library is parsed only once however many binaries (or symlinks) lead to it.  With a
+    codefile_parse_cache, parses are kept across runs as well.  Safe to share between threads:
+    at worst two threads parse the same file at once.
+    """
+
+    def __init__(self, parse_cache=None):
+        self._parsed = {}
+        self.parse_cache = parse_cache
+
+    def get(self, filename, arch, initial_rpaths_transitive):
+        st = os.stat(filename)
+        key = (os.path.realpath(filename), st.st_ino, st.st_mtime, arch,
+               tuple(initial_rpaths_transitive))
+        linkages = self._parsed.get(key)
+        if linkages is None:
+            cache_key = None
+            if self.parse_cache is not None:
+                cache_key = self.parse_cache.key(filename, st, arch, initial_rpaths_transitive)
+                linkages = self.parse_cache.get(cache_key)
+            if linkages is None:
+                with open(filename, 'rb') as f:
+                    linkages = codefile_linkages.from_codefile(
+                        codefile(f, arch, initial_rpaths_transitive))
+                if cache_key is not None:
+                    self.parse_cache.put(cache_key, linkages)
+            self._parsed[key] = linkages
+        return linkages
+
+    def __len__(self):
+        return len(self._parsed)
+
+
+def _inspect_linkages_this(filename, sysroot='', arch='native', memo=None):
     while sysroot.endswith('/') or sysroot.endswith('\\'):
         sysroot = sysroot[:-1]
     if arch == 'native':
         _, _, _, _, arch = os.uname()
     if not os.path.exists(filename):
         return [], []
-    with open(filename, 'rb') as f:
-        # TODO :: Problems here:
-        # TODO :: 1. macOS can modify RPATH for children in each .so
-        # TODO :: 2. Linux can identify the program interpreter which can change the initial RPATHs
-        cf = codefile(f, arch, ['/lib', '/usr/lib'])
-        dirname = os.path.dirname(filename)
-        results = cf.get_resolved_shared_libraries(dirname, dirname, sysroot)
-        if not results:
-            return [], []
-        orig_names, resolved_names, _, in_sysroot = map(list, zip(*results))
-        return orig_names, resolved_names
+    # TODO :: Problems here:
+    # TODO :: 1. macOS can modify RPATH for children in each .so
+    # TODO :: 2. Linux can identify the program interpreter which can change the initial RPATHs
+    if memo is None:
+        memo = codefile_memo()
+    linkages = memo.get(filename, arch, ['/lib', '/usr/lib'])
+    dirname = os.path.dirname(filename)
+    results = linkages.get_resolved_shared_libraries(dirname, dirname, sysroot)
+    if not results:
+        return [], []
+    orig_names, resolved_names, _, in_sysroot = map(list, zip(*results))
+    return orig_names, resolved_names
 
 
-# TODO :: Consider returning a tree structure or a dict when recurse is True?
-def inspect_linkages(filename, resolve_filenames=True, recurse=True, sysroot='', arch='native'):
-    todo = set([filename])
-    done = set()
+def linkage_graph(filenames, sysroot='', arch='native', memo=None):
+    """
+    Returns the dependency graph of filenames: {filename: [(original name, resolved name), ...]}
+    for each of filenames and, recursively, for every library they resolve to.  Libraries that
+    could not be found have no entries of their own.  Each file is parsed once; pass a
+    codefile_memo to share the parsing with other calls.
+    """
+    if memo is None:
+        memo = codefile_memo()
+    graph = {}
+    todo = list(filenames)
+    while todo:
+        filename = todo.pop()
+        if filename in graph:
+            continue
+        these_orig, these_resolved = _inspect_linkages_this(filename, sysroot=sysroot,
+                                                            arch=arch, memo=memo)
+        graph[filename] = list(zip(these_orig, these_resolved))
+        todo.extend(resolved for resolved in these_resolved
+                    if resolved not in graph and os.path.exists(resolved))
+    return graph
+
+
+def inspect_linkages(filename, resolve_filenames=True, recurse=True, sysroot='', arch='native',
+                     memo=None):
+    if recurse:
+        graph = linkage_graph([filename], sysroot=sysroot, arch=arch, memo=memo)
+    else:
+        these_orig, these_resolved = _inspect_linkages_this(filename, sysroot=sysroot,
+                                                            arch=arch, memo=memo)
+        graph = {filename: list(zip(these_orig, these_resolved))}
     results = set()
-    while todo != done:
-        filename = next(iter(todo - done))
-        these_orig, these_resolved = _inspect_linkages_this(filename, sysroot=sysroot, arch=arch)
-        if resolve_filenames:
-            results.update(these_resolved)
-        else:
-            results.update(these_orig)
-        if recurse:
-            todo.update(these_resolved)
-        done.add(filename)
+    for links in graph.values():
+        results.update(resolved if resolve_filenames else orig for orig, resolved in links)
     return results
 
 
@@ -1,29 +1,40 @@
 from __future__ import absolute_import, division, print_function
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import fnmatch
 from functools import partial
 from glob import glob
 import io
+import json
 import locale
 import re
 import os
+import shutil
 import stat
-from subprocess import call, check_output
+import struct
+from subprocess import Popen, PIPE, STDOUT
 import sys
+import tempfile
+import time
 try:
     from os import readlink
 except ImportError:
     readlink = False
 
+from six import reraise
+
 from conda_build.os_utils import external
 from .conda_interface import lchmod
 from .conda_interface import walk_prefix
 from .conda_interface import md5_file
 from .conda_interface import PY3
 
-from conda_build import utils
-from conda_build.os_utils.pyldd import is_codefile
+from conda_build import environ, utils
+from conda_build.os_utils.pyldd import is_codefile, get_elf_rpath, set_elf_rpath
+from conda_build.os_utils.pyldd import (ELF_HDR, FAT_MAGIC, MH_MAGIC, MH_CIGAM,
+                                        MH_CIGAM_64)
 
 if sys.platform == 'darwin':
     from conda_build.os_utils import macho
@@ -33,17 +44,59 @@ def is_obj(path):
     return is_codefile(path)
 
 
-def fix_shebang(f, prefix, build_python, osx_is_app=False):
+class FileClass(namedtuple('FileClass', ('is_elf', 'is_macho', 'has_shebang'))):
+    """What the post-build stages need to know about a file, from one look at its head.
+    Symlinks and anything else that is not a regular file have every field False."""
+    __slots__ = ()
+
+    @property
+    def is_obj(self):
+        'Same as is_obj()'
+        return self.is_elf or self.is_macho
+
+
+NOT_A_FILE = FileClass(False, False, False)
+
+
+def classify_file(path):
+    if os.path.islink(path) or not os.path.isfile(path):
+        return NOT_A_FILE
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    magic = struct.unpack('>L', head)[0] if len(head) == 4 else None
+    return FileClass(is_elf=magic == ELF_HDR,
+                     is_macho=magic in (FAT_MAGIC, MH_MAGIC, MH_CIGAM, MH_CIGAM_64),
+                     has_shebang=head[:2] == b'#!')
+
+
+def classify_files(files, prefix):
+    """Returns {f: FileClass} for files (relative to prefix), reading the head of each file
+    once."""
+    return dict((f, classify_file(os.path.join(prefix, f))) for f in files)
+
+
+def fix_shebang(f, prefix, build_python, osx_is_app=False, file_class=None):
+    for message in _fix_shebang(f, prefix, build_python, osx_is_app, file_class):
+        print(message)
+
+
+def _fix_shebang(f, prefix, build_python, osx_is_app=False, file_class=None):
+    """fix_shebang, returning its messages instead of printing them so that files can be
+    processed concurrently."""
     path = os.path.join(prefix, f)
-    if is_obj(path):
-        return
+    if file_class is not None:
+        # the file was already looked at: only python scripts need reading
+        if not file_class.has_shebang:
+            return []
+    elif is_obj(path):
+        return []
     elif os.path.islink(path):
-        return
+        return []
     elif not os.path.isfile(path):
-        return
+        return []
 
     if os.stat(path).st_size == 0:
-        return
+        return []
 
     bytes_ = False
 
@@ -52,7 +105,7 @@ def fix_shebang(f, prefix, build_python, osx_is_app=False):
             data = fi.read(100)
             fi.seek(0)
         except UnicodeDecodeError:  # file is binary
-            return
+            return []
 
         SHEBANG_PAT = re.compile(r'^#!.+$', re.M)
 
@@ -72,7 +125,7 @@ def fix_shebang(f, prefix, build_python, osx_is_app=False):
         python_str = b'python' if bytes_ else 'python'
 
         if not (m and python_str in m.group()):
-            return
+            return []
 
         data = mm[:]
 
@@ -83,14 +136,14 @@ def fix_shebang(f, prefix, build_python, osx_is_app=False):
         py_exec = py_exec.encode()
     new_data = SHEBANG_PAT.sub(py_exec, data, count=1)
     if new_data == data:
-        return
-    print("updating shebang:", f)
+        return []
     with io.open(path, 'w', encoding=locale.getpreferredencoding()) as fo:
         try:
             fo.write(new_data)
         except TypeError:
             fo.write(new_data.decode())
     os.chmod(path, 0o775)
+    return ['updating shebang: %s' % f]
 
 
 def write_pth(egg_path, config):
@@ -189,9 +242,48 @@ def rm_pyc(files, prefix):
             os.unlink(os.path.join(prefix, fn))
 
 
-def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=()):
+# Run by the build python to compile the files (relative to cwd) listed as JSON on stdin.  Prints
+#    a JSON list of the files that failed, so that failures can be reported the same way whatever
+#    the version of the build python.  Must stay compatible with python 2.7.
+_COMPILE_PYC_SCRIPT = """
+import json, py_compile, sys
+failures = []
+for f in json.loads(sys.stdin.read()):
+    try:
+        py_compile.compile(f, doraise=True)
+    except py_compile.PyCompileError as e:
+        failures.append([f, e.exc_type_name, e.msg])
+    except Exception as e:
+        failures.append([f, type(e).__name__, str(e)])
+sys.stdout.write(json.dumps(failures))
+"""
+
+# a batch is only split over several interpreters when each gets at least this many files
+PYC_FILES_PER_WORKER = 100
+
+PycCompileFailure = namedtuple('PycCompileFailure', ('path', 'error', 'message'))
+
+
+def _compile_pyc_batch(files, cwd, python_exe):
+    proc = Popen([python_exe, '-Wi', '-c', _COMPILE_PYC_SCRIPT], cwd=cwd,
+                 stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    out, err = proc.communicate(json.dumps(files).encode('ascii'))
+    try:
+        failures = json.loads(out.decode('utf-8'))
+    except ValueError:
+        message = err.decode('utf-8', 'replace').strip() or 'exit code %d' % proc.returncode
+        return [PycCompileFailure(f, 'InterpreterError', message) for f in files]
+    return [PycCompileFailure(*failure) for failure in failures]
+
+
+def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=(), workers=None):
+    """Compile .py files among files that do not have a .pyc yet.
+
+    The files are compiled by as few as one and at most workers (default: the number of CPUs)
+    invocations of python_exe, each compiling its share of the files in one go.  Returns a list
+    of PycCompileFailure for the files that could not be compiled, which are also logged."""
     if not os.path.isfile(python_exe):
-        return
+        return []
     compile_files = []
     skip_compile_pyc_n = [os.path.normpath(skip) for skip in skip_compile_pyc]
     skipped_files = set()
@@ -217,8 +309,28 @@ def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=()):
             print('compiling .pyc files... failed as no python interpreter was found')
         else:
             print('compiling .pyc files...')
-            for f in compile_files:
-                call([python_exe, '-Wi', '-m', 'py_compile', f], cwd=cwd)
+            return _compile_pyc_files(sorted(compile_files), cwd, python_exe, workers)
+    return []
+
+
+def _compile_pyc_files(files, cwd, python_exe, workers=None):
+    if workers is None:
+        workers = int(environ.get_cpu_count())
+    workers = max(1, min(workers, len(files) // PYC_FILES_PER_WORKER))
+    batches = [files[i::workers] for i in range(workers)]
+    if workers > 1:
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(partial(_compile_pyc_batch, cwd=cwd,
+                                                python_exe=python_exe), batches))
+    else:
+        results = [_compile_pyc_batch(batches[0], cwd, python_exe)]
+    failures = sorted(failure for result in results for failure in result)
+    if failures:
+        log = utils.get_logger(__name__)
+        for failure in failures:
+            log.warn("Could not compile %s (%s): %s", failure.path, failure.error,
+                     failure.message.strip())
+    return failures
 
 
 def post_process(files, prefix, config, preserve_egg_dir=False, noarch=False, skip_compile_pyc=()):
@@ -232,8 +344,10 @@ def post_process(files, prefix, config, preserve_egg_dir=False, noarch=False, sk
     rm_py_along_so(prefix)
 
 
-def find_lib(link, prefix, path=None):
-    files = utils.prefix_files(prefix)
+def find_lib(link, prefix, path=None, files=None):
+    """files: the files in prefix (see utils.prefix_files), if the caller already knows them"""
+    if files is None:
+        files = utils.prefix_files(prefix)
     if link.startswith(prefix):
         link = os.path.normpath(link[len(prefix) + 1:])
         if link not in files:
@@ -271,10 +385,10 @@ def find_lib(link, prefix, path=None):
     print("Don't know how to find %s, skipping" % link)
 
 
-def osx_ch_link(path, link_dict, prefix):
+def osx_ch_link(path, link_dict, prefix, files=None):
     link = link_dict['name']
     print("Fixing linking of %s in %s" % (link, path))
-    link_loc = find_lib(link, prefix, path)
+    link_loc = find_lib(link, prefix, path, files=files)
     if not link_loc:
         return
 
@@ -310,7 +424,7 @@ def osx_ch_link(path, link_dict, prefix):
     return ret
 
 
-def mk_relative_osx(path, prefix, build_prefix=None):
+def mk_relative_osx(path, prefix, build_prefix=None, files=None):
     '''
     if build_prefix is None, the_n this is a standard conda build. The path
     and all dependencies are in the build_prefix.
@@ -324,8 +438,8 @@ def mk_relative_osx(path, prefix, build_prefix=None):
     else:
         prefix = build_prefix
 
-    assert sys.platform == 'darwin' and is_obj(path)
-    s = macho.install_name_change(path, partial(osx_ch_link, prefix=prefix))
+    assert sys.platform == 'darwin'
+    s = macho.install_name_change(path, partial(osx_ch_link, prefix=prefix, files=files))
 
     names = macho.otool(path)
     if names:
@@ -349,16 +463,25 @@ def mk_relative_osx(path, prefix, build_prefix=None):
 
 def mk_relative_linux(f, prefix, rpaths=('lib',)):
     'Respects the original values and converts abs to $ORIGIN-relative'
+    for message in _mk_relative_linux(f, prefix, rpaths):
+        print(message)
+
 
+def _mk_relative_linux(f, prefix, rpaths=('lib',)):
+    """mk_relative_linux, returning its messages instead of printing them so that files can be
+    processed concurrently.  The rpath is read with pyldd and rewritten in place when the new
+    one fits; patchelf is only run when it does not."""
+    messages = []
     elf = os.path.join(prefix, f)
     origin = os.path.dirname(elf)
 
-    patchelf = external.find_executable('patchelf', prefix)
     try:
-        existing = check_output([patchelf, '--print-rpath', elf]).decode('utf-8').splitlines()[0]
-    except:
-        print('patchelf: --print-rpath failed for %s\n' % (elf))
-        return
+        existing = get_elf_rpath(elf)
+    except Exception:
+        existing = None
+    if existing is None:
+        messages.append('rpath: reading the rpath failed for %s\n' % (elf))
+        return messages
     existing = existing.split(os.pathsep)
     new = []
     for old in existing:
@@ -368,7 +491,8 @@ def mk_relative_linux(f, prefix, rpaths=('lib',)):
             # Test if this absolute path is outside of prefix. That is fatal.
             relpath = os.path.relpath(old, prefix)
             if relpath.startswith('..' + os.sep):
-                print('Warning: rpath {0} is outside prefix {1} (removing it)'.format(old, prefix))
+                messages.append('Warning: rpath {0} is outside prefix {1} (removing it)'
+                                .format(old, prefix))
             else:
                 relpath = '$ORIGIN/' + os.path.relpath(old, origin)
                 if relpath not in new:
@@ -388,8 +512,18 @@ def mk_relative_linux(f, prefix, rpaths=('lib',)):
         if rpath not in new:
             new.append(rpath)
     rpath = ':'.join(new)
-    print('patchelf: file: %s\n    setting rpath to: %s' % (elf, rpath))
-    call([patchelf, '--force-rpath', '--set-rpath', rpath, elf])
+    if set_elf_rpath(elf, rpath, force_rpath=True):
+        messages.append('rpath: file: %s\n    set rpath in place to: %s' % (elf, rpath))
+    else:
+        messages.append('patchelf: file: %s\n    setting rpath to: %s' % (elf, rpath))
+        patchelf = external.find_executable('patchelf', prefix)
+        # read patchelf's output, so that it is logged along with this file's messages
+        p = Popen([patchelf, '--force-rpath', '--set-rpath', rpath, elf], stdout=PIPE,
+                  stderr=STDOUT)
+        output = p.communicate()[0].decode('utf-8', 'replace').rstrip()
+        if output:
+            messages.append(output)
+    return messages
 
 
 def assert_relative_osx(path, prefix):
@@ -397,67 +531,170 @@ def assert_relative_osx(path, prefix):
         assert not name.startswith(prefix), path
 
 
-def mk_relative(m, f, prefix):
+def mk_relative(m, f, prefix, file_class=None, files=None):
     assert sys.platform != 'win32'
     path = os.path.join(prefix, f)
-    if not is_obj(path):
+    if not (file_class.is_obj if file_class is not None else is_obj(path)):
         return
 
     if sys.platform.startswith('linux'):
         mk_relative_linux(f, prefix=prefix, rpaths=m.get_value('build/rpaths', ['lib']))
     elif sys.platform == 'darwin':
-        mk_relative_osx(path, prefix=prefix)
+        mk_relative_osx(path, prefix=prefix, files=files)
 
 
-def fix_permissions(files, prefix):
-    print("Fixing permissions")
+def _fix_dir_permissions(prefix):
     for root, dirs, _ in os.walk(prefix):
         for dn in dirs:
             lchmod(os.path.join(root, dn), 0o775)
 
-    for f in files:
-        path = os.path.join(prefix, f)
-        st = os.lstat(path)
-        old_mode = stat.S_IMODE(st.st_mode)
-        new_mode = old_mode
-        # broadcast execute
-        if old_mode & stat.S_IXUSR:
-            new_mode = new_mode | stat.S_IXGRP | stat.S_IXOTH
-        # ensure user and group can write and all can read
-        new_mode = new_mode | stat.S_IWUSR | stat.S_IWGRP | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH  # noqa
-        if old_mode != new_mode:
-            try:
-                lchmod(path, new_mode)
-            except (OSError, utils.PermissionError) as e:
-                log = utils.get_logger(__name__)
-                log.warn(str(e))
 
+def _fix_file_permissions(f, prefix):
+    """Returns a warning if the mode of f could not be fixed, else None"""
+    path = os.path.join(prefix, f)
+    st = os.lstat(path)
+    old_mode = stat.S_IMODE(st.st_mode)
+    new_mode = old_mode
+    # broadcast execute
+    if old_mode & stat.S_IXUSR:
+        new_mode = new_mode | stat.S_IXGRP | stat.S_IXOTH
+    # ensure user and group can write and all can read
+    new_mode = new_mode | stat.S_IWUSR | stat.S_IWGRP | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH  # noqa
+    if old_mode != new_mode:
+        try:
+            lchmod(path, new_mode)
+        except (OSError, utils.PermissionError) as e:
+            return str(e)
+    return None
 
-def post_build(m, files, prefix, build_python, croot):
-    print('number of files:', len(files))
-    fix_permissions(files, prefix)
 
+def fix_permissions(files, prefix):
+    print("Fixing permissions")
+    _fix_dir_permissions(prefix)
     for f in files:
-        make_hardlink_copy(f, prefix)
-
-    if sys.platform == 'win32':
-        return
+        warning = _fix_file_permissions(f, prefix)
+        if warning:
+            utils.get_logger(__name__).warn(warning)
 
-    binary_relocation = m.binary_relocation()
-    if not binary_relocation:
-        print("Skipping binary relocation logic")
-    osx_is_app = bool(m.get_value('build/osx_is_app', False)) and sys.platform == 'darwin'
 
-    check_symlinks(files, prefix, croot)
+# post-build stages, in the order they run on each file
+POST_BUILD_STAGES = ('permissions', 'hardlinks', 'classify', 'symlinks', 'shebang', 'relocation')
 
-    for f in files:
-        if f.startswith('bin/'):
-            fix_shebang(f, prefix=prefix, build_python=build_python, osx_is_app=osx_is_app)
-        if binary_relocation is True or (isinstance(f, list) and f in binary_relocation):
-            mk_relative(m, f, prefix)
 
+@contextmanager
+def _timed(times, stage):
+    start = time.time()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0.0) + time.time() - start
+
+
+def _run_per_file(files, task, threads, stage_times):
+    """Runs task(f, messages) for each of files on a pool of threads.  task returns {stage:
+    seconds}, which is added to stage_times, and appends (emit, text) pairs to messages instead
+    of printing or logging: emit(text) is called for each of them, on this thread and in the
+    order of files, so the log does not depend on how the files were scheduled.  If task fails
+    for any files (SystemExit included), the first of those errors is raised once the messages
+    of every file have been emitted."""
+    def run(f):
+        messages, times, error = [], {}, None
+        try:
+            times = task(f, messages)
+        except BaseException:
+            error = sys.exc_info()
+        return messages, times, error
+
+    first_error = None
+    with ThreadPoolExecutor(max(threads, 1)) as executor:
+        for messages, times, error in executor.map(run, files):
+            for emit, text in messages:
+                emit(text)
+            sys.stdout.flush()
+            for stage, seconds in times.items():
+                stage_times[stage] += seconds
+            first_error = first_error or error
+    if first_error:
+        reraise(*first_error)
+
+
+def post_build(m, files, prefix, build_python, croot, prefix_snapshot=None):
+    """Fixes up the files of a package after its build script has run.  Each file goes through
+    the stages in POST_BUILD_STAGES, and files are processed on a pool of threads (one per CPU).
+    Every file's hardlinks are broken, and every symlink checked, before any file is relocated.
+    prefix_snapshot, a utils.PrefixSnapshot of prefix, is refreshed to list the prefix instead of
+    walking it again."""
+    print('number of files:', len(files))
+    log = utils.get_logger(__name__)
+    threads = int(environ.get_cpu_count())
+    stage_times = defaultdict(float)
+    file_classes = {}
+
+    def prepare(f, messages):
+        times = {}
+        with _timed(times, 'permissions'):
+            warning = _fix_file_permissions(f, prefix)
+        if warning:
+            messages.append((log.warn, warning))
+        with _timed(times, 'hardlinks'):
+            make_hardlink_copy(f, prefix)
+        if sys.platform != 'win32':
+            with _timed(times, 'classify'):
+                file_classes[f] = classify_file(os.path.join(prefix, f))
+        return times
 
-def check_symlinks(files, prefix, croot):
+    print("Fixing permissions")
+    with _timed(stage_times, 'permissions'):
+        _fix_dir_permissions(prefix)
+    _run_per_file(files, prepare, threads, stage_times)
+
+    if sys.platform != 'win32':
+        binary_relocation = m.binary_relocation()
+        if not binary_relocation:
+            print("Skipping binary relocation logic")
+        osx_is_app = bool(m.get_value('build/osx_is_app', False)) and sys.platform == 'darwin'
+
+        with _timed(stage_times, 'symlinks'):
+            check_symlinks(files, prefix, croot, file_classes)
+
+        def relocate(f):
+            return binary_relocation is True or (isinstance(f, list) and f in binary_relocation)
+
+        def finish(f, messages):
+            times = {}
+            if f.startswith('bin/'):
+                with _timed(times, 'shebang'):
+                    messages.extend((print, message) for message in _fix_shebang(
+                        f, prefix, build_python, osx_is_app, file_classes[f]))
+            if (sys.platform.startswith('linux') and relocate(f) and
+                    file_classes[f].is_obj):
+                with _timed(times, 'relocation'):
+                    messages.extend((print, message) for message in _mk_relative_linux(
+                        f, prefix, m.get_value('build/rpaths', ['lib'])))
+            return times
+
+        _run_per_file(files, finish, threads, stage_times)
+
+        if sys.platform == 'darwin':
+            # install_name_tool and otool report as they go, so files are relocated one by one
+            with _timed(stage_times, 'relocation'):
+                # what is in the prefix, to find the libraries that files link to
+                prefix_files = (prefix_snapshot.refresh().files if prefix_snapshot else
+                                utils.prefix_files(prefix))
+                for f in files:
+                    if relocate(f):
+                        mk_relative(m, f, prefix, file_class=file_classes[f],
+                                    files=prefix_files)
+
+    log.info("post-build stage times (summed over %d threads): %s", threads,
+             ', '.join('%s %.2fs' % (stage, stage_times[stage])
+                       for stage in POST_BUILD_STAGES if stage in stage_times))
+
+
+def check_symlinks(files, prefix, croot, file_classes):
+    """file_classes (see classify_files) says which of files are object files.  Links are
+    classified as themselves (NOT_A_FILE), so they stay links; the entry of a link that does get
+    replaced by a copy of its target is updated."""
     if readlink is False:
         return  # Not on Unix system
     msgs = []
@@ -471,9 +708,10 @@ def check_symlinks(files, prefix, croot):
             #    because ld.so follows symlinks in RPATHS
             #    If condition exists, then copy the file rather than symlink it.
             if (not os.path.dirname(link_path) == os.path.dirname(real_link_path) and
-                    is_obj(f)):
+                    file_classes[f].is_obj):
                 os.remove(path)
                 utils.copy_into(real_link_path, path)
+                file_classes[f] = classify_file(path)
             elif real_link_path.startswith(real_build_prefix):
                 # If the path is in the build prefix, this is fine, but
                 # the link needs to be relative
@@ -503,17 +741,18 @@ def make_hardlink_copy(path, prefix):
     if not os.path.isabs(path) and not os.path.exists(path):
         path = os.path.normpath(os.path.join(prefix, path))
     nlinks = os.lstat(path).st_nlink
-    dest = 'tmpfile'
-    if os.path.isabs(path):
-        dest = os.path.join(os.getcwd(), dest)
     if nlinks > 1:
-        # copy file to new name
-        utils.copy_into(path, dest)
-        # remove old file
-        utils.rm_rf(path)
-        # rename copy to original filename
-        utils.copy_into(dest, path)
-        utils.rm_rf(dest)
+        # copy the file to a unique name next to it (files are processed concurrently), then
+        # put the copy in place of the original
+        fd, dest = tempfile.mkstemp(prefix='.hardlink-copy-', dir=os.path.dirname(path) or '.')
+        os.close(fd)
+        try:
+            shutil.copy2(path, dest)
+            utils.rm_rf(path)
+            os.rename(dest, path)
+        finally:
+            if os.path.lexists(dest):
+                os.remove(dest)
 
 
 def get_build_metadata(m):
@@ -26,6 +26,7 @@ from .conda_interface import execute_actions
 from .conda_interface import pkgs_dirs
 
 from conda_build import exceptions, utils, environ
+from conda_build.conda_format import package_extension
 from conda_build.metadata import MetaData
 import conda_build.source as source
 from conda_build.variants import (get_package_variants, dict_of_lists_to_list_of_dicts,
@@ -40,7 +41,8 @@ def bldpkg_path(m):
     Returns path to built package's tarball given its ``Metadata``.
     '''
     output_dir = 'noarch' if m.noarch or m.noarch_python else m.config.host_subdir
-    return os.path.join(os.path.dirname(m.config.bldpkgs_dir), output_dir, '%s.tar.bz2' % m.dist())
+    return os.path.join(os.path.dirname(m.config.bldpkgs_dir), output_dir,
+                        m.dist() + package_extension(m.config))
 
 
 def actions_to_pins(actions):
@@ -377,11 +379,81 @@ def insert_python_version(metadata, env):
                                               else pkg for pkg in reqs]
 
 
+def _render_variant(metadata, variant, recipe_requirements, allow_no_other_outputs=False,
+                    bypass_env_check=False):
+    """Render one variant of metadata.  Returns a (dist, metadata, need_source_download) tuple.
+
+    This is module-level (and takes only picklable arguments) so that distribute_variants can
+    run it in worker processes."""
+    mv = metadata.copy()
+
+    # this determines which variants were used, and thus which ones should be locked for
+    #     future rendering
+    mv.final = False
+    mv.config.variant = {}
+    mv.parse_again(permit_undefined_jinja=True, allow_no_other_outputs=True,
+                   bypass_env_check=True)
+    vars_in_recipe = set(mv.undefined_jinja_vars)
+
+    mv.config.variant = variant
+    conform_dict = {}
+    for key in vars_in_recipe:
+        if PY3 and hasattr(recipe_requirements, 'decode'):
+            recipe_requirements = recipe_requirements.decode()
+        elif not PY3 and hasattr(recipe_requirements, 'encode'):
+            recipe_requirements = recipe_requirements.encode()
+        # We use this variant in the top-level recipe.
+        # constrain the stored variants to only this version in the output
+        #     variant mapping
+        if re.search(r"\s+\{\{\s*%s\s*(?:.*?)?\}\}" % key, recipe_requirements):
+            conform_dict[key] = variant[key]
+
+    compiler_matches = re.findall(r"compiler\([\'\"](.*)[\'\"].*\)",
+                                  recipe_requirements)
+    if compiler_matches:
+        from conda_build.jinja_context import native_compiler
+        for match in compiler_matches:
+            compiler_key = '{}_compiler'.format(match)
+            conform_dict[compiler_key] = variant.get(compiler_key,
+                                                     native_compiler(match, mv.config))
+            conform_dict['target_platform'] = variant['target_platform']
+
+    build_reqs = mv.meta.get('requirements', {}).get('build', [])
+    host_reqs = mv.meta.get('requirements', {}).get('host', [])
+    if 'python' in build_reqs or 'python' in host_reqs:
+        conform_dict['python'] = variant['python']
+
+    mv.config.variants = conform_variants_to_value(mv.config.variants, conform_dict)
+
+    mv.parse_until_resolved(allow_no_other_outputs=allow_no_other_outputs,
+                            bypass_env_check=bypass_env_check)
+    need_source_download = (bool(mv.meta.get('source')) and
+                            not mv.needs_source_for_render and
+                            not os.listdir(mv.config.work_dir))
+    # if python is in the build specs, but doesn't have a specific associated
+    #    version, make sure to add one to newly parsed 'requirements/build'.
+    for env in ('build', 'host'):
+        insert_python_version(mv, env)
+    fm = mv.copy()
+    # HACK: trick conda-build into thinking this is final, and computing a hash based
+    #     on the current meta.yaml.  The accuracy doesn't matter, all that matters is
+    #     our ability to differentiate configurations
+    fm.final = True
+    return fm.dist(), mv, need_source_download
+
+
+def _render_variant_star(args):
+    return _render_variant(*args)
+
+
 def distribute_variants(metadata, variants, permit_unsatisfiable_variants=False,
-                        allow_no_other_outputs=False, bypass_env_check=False):
-    rendered_metadata = {}
+                        allow_no_other_outputs=False, bypass_env_check=False, processes=None):
+    """Render metadata once per variant.
+
+    With processes > 1 (default: config.render_processes), variants are rendered on a pool of
+    that many worker processes.  Results come back in variant order either way."""
+    rendered_metadata = OrderedDict()
     need_reparse_in_env = False
-    need_source_download = True
 
     # don't bother distributing python if it's a noarch package
     if metadata.noarch or metadata.noarch_python:
@@ -391,64 +463,21 @@ def distribute_variants(metadata, variants, permit_unsatisfiable_variants=False,
     # store these for reference later
     metadata.config.variants = variants
 
+    if processes is None:
+        processes = getattr(metadata.config, 'render_processes', 1)
+
     recipe_requirements = metadata.extract_requirements_text()
-    for variant in variants:
-        mv = metadata.copy()
-
-        # this determines which variants were used, and thus which ones should be locked for
-        #     future rendering
-        mv.final = False
-        mv.config.variant = {}
-        mv.parse_again(permit_undefined_jinja=True, allow_no_other_outputs=True,
-                        bypass_env_check=True)
-        vars_in_recipe = set(mv.undefined_jinja_vars)
-
-        mv.config.variant = variant
-        conform_dict = {}
-        for key in vars_in_recipe:
-            if PY3 and hasattr(recipe_requirements, 'decode'):
-                recipe_requirements = recipe_requirements.decode()
-            elif not PY3 and hasattr(recipe_requirements, 'encode'):
-                recipe_requirements = recipe_requirements.encode()
-            # We use this variant in the top-level recipe.
-            # constrain the stored variants to only this version in the output
-            #     variant mapping
-            if re.search(r"\s+\{\{\s*%s\s*(?:.*?)?\}\}" % key, recipe_requirements):
-                conform_dict[key] = variant[key]
-
-        compiler_matches = re.findall(r"compiler\([\'\"](.*)[\'\"].*\)",
-                                        recipe_requirements)
-        if compiler_matches:
-            from conda_build.jinja_context import native_compiler
-            for match in compiler_matches:
-                compiler_key = '{}_compiler'.format(match)
-                conform_dict[compiler_key] = variant.get(compiler_key,
-                                        native_compiler(match, mv.config))
-                conform_dict['target_platform'] = variant['target_platform']
-
-        build_reqs = mv.meta.get('requirements', {}).get('build', [])
-        host_reqs = mv.meta.get('requirements', {}).get('host', [])
-        if 'python' in build_reqs or 'python' in host_reqs:
-            conform_dict['python'] = variant['python']
-
-        mv.config.variants = conform_variants_to_value(mv.config.variants, conform_dict)
-
-        if not need_reparse_in_env:
-            mv.parse_until_resolved(allow_no_other_outputs=allow_no_other_outputs,
-                                    bypass_env_check=bypass_env_check)
-            need_source_download = (bool(mv.meta.get('source')) and
-                                    not mv.needs_source_for_render and
-                                    not os.listdir(mv.config.work_dir))
-            # if python is in the build specs, but doesn't have a specific associated
-            #    version, make sure to add one to newly parsed 'requirements/build'.
-            for env in ('build', 'host'):
-                insert_python_version(mv, env)
-            fm = mv.copy()
-            # HACK: trick conda-build into thinking this is final, and computing a hash based
-            #     on the current meta.yaml.  The accuracy doesn't matter, all that matters is
-            #     our ability to differentiate configurations
-            fm.final = True
-            rendered_metadata[fm.dist()] = (mv, need_source_download, need_reparse_in_env)
+    args = [(metadata, variant, recipe_requirements, allow_no_other_outputs, bypass_env_check)
+            for variant in variants]
+    if processes and processes > 1 and len(variants) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(processes, len(variants))) as executor:
+            results = list(executor.map(_render_variant_star, args))
+    else:
+        results = [_render_variant_star(arg) for arg in args]
+
+    for dist, mv, need_source_download in results:
+        rendered_metadata[dist] = (mv, need_source_download, need_reparse_in_env)
 
     # list of tuples.
     # each tuple item is a tuple of 3 items:
@@ -1,10 +1,14 @@
 from __future__ import absolute_import, division, print_function
 
+import bz2
+from contextlib import closing
 import json
 from os.path import basename
 import re
 import tarfile
 
+from conda_build.conda_format import is_conda_pkg, open_package
+from conda_build.conda_interface import PY3
 from conda_build.utils import codec
 
 
@@ -13,35 +17,86 @@ def dist_fn(fn):
         return fn[:-4]
     elif fn.endswith('.tar.bz2'):
         return fn[:-8]
+    elif fn.endswith('.conda'):
+        return fn[:-6]
     else:
         raise Exception('did not expect filename: %r' % fn)
 
 
+# the info files TarCheck looks at
+CHECKED_INFO_FILES = ('info/files', 'info/index.json', 'info/has_prefix')
+
+
+def read_manifest(path):
+    """Returns the manifest TarCheck validates: a list of (member path, is_dir) tuples, and a dict
+    of the contents of CHECKED_INFO_FILES present in the package.  .tar.bz2 packages are read in
+    one streaming pass."""
+    members = []
+    info_contents = {}
+    if is_conda_pkg(path):
+        with open_package(path) as t:
+            _read_members(t, members, info_contents)
+    elif path.endswith('.bz2') and PY3:
+        # tarfile's own bz2 stream reader stops after the first stream; BZ2File also reads
+        #    the multi-stream packages written with bz2_multi_stream
+        with closing(bz2.BZ2File(path)) as fileobj:
+            with tarfile.open(fileobj=fileobj, mode='r|') as t:
+                _read_members(t, members, info_contents)
+    else:
+        with tarfile.open(path, 'r|*') as t:
+            _read_members(t, members, info_contents)
+    return members, info_contents
+
+
+def _read_members(t, members, info_contents):
+    for m in t:
+        members.append((m.path, m.isdir()))
+        if m.path in CHECKED_INFO_FILES:
+            info_contents[m.path] = t.extractfile(m).read()
+
+
 class TarCheck(object):
-    def __init__(self, path, config):
-        self.t = tarfile.open(path)
-        self.paths = set(m.path for m in self.t.getmembers())
+    """Checks a package against its own metadata.
+
+    manifest is a (members, info_contents) tuple as returned by read_manifest.  bundle_conda
+    passes the one it recorded while writing the package, so a freshly built package is not
+    decompressed again; without it the package is read once with read_manifest."""
+    def __init__(self, path, config, manifest=None):
+        self.members, self.info_contents = manifest or read_manifest(path)
+        self.paths = set(p for p, _ in self.members)
         self.dist = dist_fn(basename(path))
         self.name, self.version, self.build = self.dist.split('::', 1)[-1].rsplit('-', 2)
         self.config = config
+        self._index = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, e_type, e_value, traceback):
-        self.t.close()
+        pass
+
+    def _info_file(self, path):
+        if path not in self.info_contents:
+            raise KeyError("filename %r not found" % path)
+        return self.info_contents[path]
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = json.loads(self._info_file('info/index.json').decode('utf-8'))
+        return self._index
 
     def info_files(self):
         if re.search('pyh[0-9a-f]{%d}_' % self.config.hash_length, self.build):
             return
         lista = [p.strip().decode('utf-8') for p in
-                 self.t.extractfile('info/files').readlines()]
+                 self._info_file('info/files').splitlines()]
         seta = set(lista)
         if len(lista) != len(seta):
             raise Exception('info/files: duplicates')
 
-        listb = [m.path for m in self.t.getmembers()
-                 if not (m.path.startswith('info/') or m.isdir())]
+        listb = [path for path, is_dir in self.members
+                 if not (path.startswith('info/') or is_dir)]
         setb = set(listb)
         if len(listb) != len(setb):
             raise Exception('info_files: duplicate members')
@@ -56,7 +111,7 @@ class TarCheck(object):
         raise Exception('info/files')
 
     def index_json(self):
-        info = json.loads(self.t.extractfile('info/index.json').read().decode('utf-8'))
+        info = self.index
         for varname in 'name', 'version':
             if info[varname] != getattr(self, varname):
                 raise Exception('%s: %r != %r' % (varname, info[varname],
@@ -65,8 +120,8 @@ class TarCheck(object):
 
     def prefix_length(self):
         prefix_length = None
-        if 'info/has_prefix' in self.t.getnames():
-            prefix_files = self.t.extractfile('info/has_prefix').readlines()
+        if 'info/has_prefix' in self.paths:
+            prefix_files = self._info_file('info/has_prefix').splitlines()
             for line in prefix_files:
                 try:
                     prefix, file_type, _ = line.split()
@@ -81,18 +136,17 @@ class TarCheck(object):
         return prefix_length
 
     def correct_subdir(self):
-        info = json.loads(self.t.extractfile('info/index.json').read().decode('utf-8'))
+        info = self.index
         assert info['subdir'] in [self.config.host_subdir, 'noarch'], \
             ("Inconsistent subdir in package - index.json expecting {0},"
              " got {1}".format(self.config.host_subdir, info['subdir']))
 
 
-def check_all(path, config):
-    x = TarCheck(path, config)
+def check_all(path, config, manifest=None):
+    x = TarCheck(path, config, manifest=manifest)
     x.info_files()
     x.index_json()
     x.correct_subdir()
-    x.t.close()
 
 
 def check_prefix_lengths(files, config):
@@ -40,6 +40,7 @@ from .conda_interface import cc_conda_build
 # NOQA because it is not used in this file.
 from conda_build.conda_interface import rm_rf as _rm_rf # NOQA
 from conda_build.os_utils import external
+from conda_build.conda_format import is_conda_pkg, open_package, read_info_file
 
 if PY3:
     import urllib.parse as urlparse
@@ -702,15 +703,103 @@ def print_skip_message(metadata):
           "configuration.".format(metadata.path))
 
 
+class ParallelBZ2Writer(object):
+    """
+    Write-only file object that bz2-compresses what is written to it on a thread pool.
+
+    Input is cut into blocks of block_size bytes; each block is compressed on its own into a
+    complete bz2 stream, and the streams are written to path in input order.  The result is a
+    multi-stream bz2 file, which bunzip2 and Python 3's bz2/tarfile modules read as one.
+    Python 2's bz2/tarfile modules read only the first stream, so its readers silently see a
+    truncated file; packages are only written this way with the bz2_multi_stream opt-in.
+    bz2.compress releases the GIL, so blocks really are compressed in parallel.
+    """
+
+    def __init__(self, path, threads, block_size=8 * 1024 * 1024, compresslevel=9):
+        from concurrent.futures import ThreadPoolExecutor
+        import bz2
+        self._compress = lambda data: bz2.compress(data, compresslevel)
+        self._path = path
+        self._fileobj = open(path, 'wb')
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._threads = threads
+        self._block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._pending = []
+        self._position = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._position += len(data)
+        if self._buffered >= self._block_size:
+            buffered = b''.join(self._buffer)
+            full = len(buffered) - len(buffered) % self._block_size
+            for start in range(0, full, self._block_size):
+                self._submit(buffered[start:start + self._block_size])
+            self._buffer = [buffered[full:]]
+            self._buffered = len(buffered) - full
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(self._compress, block))
+        # bound memory use: keep at most two blocks per thread in flight
+        while len(self._pending) > 2 * self._threads:
+            self._fileobj.write(self._pending.pop(0).result())
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._fileobj.closed:
+            return
+        try:
+            if self._buffered or not self._position:
+                # an empty input still needs one (empty) bz2 stream to be a valid file
+                self._submit(b''.join(self._buffer))
+            self._buffer = []
+            for future in self._pending:
+                self._fileobj.write(future.result())
+            self._pending = []
+        finally:
+            self._executor.shutdown()
+            self._fileobj.close()
+
+    def abort(self):
+        """Stop compressing, and remove the (incomplete) output file"""
+        if self._fileobj.closed:
+            return
+        for future in self._pending:
+            future.cancel()
+        self._pending = []
+        self._buffer = []
+        self._executor.shutdown()
+        self._fileobj.close()
+        rm_rf(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_type, e_value, traceback):
+        if e_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 @memoized
 def package_has_file(package_path, file_path):
     try:
         locks = get_conda_operation_locks()
         with try_acquire_locks(locks, timeout=90):
-            with tarfile.open(package_path) as t:
+            # internal paths are always forward slashed on all platforms
+            file_path = file_path.replace('\\', '/')
+            if is_conda_pkg(package_path) and file_path.startswith('info/'):
+                # only the small info component of a .conda package needs reading
+                return read_info_file(package_path, file_path) or False
+            with open_package(package_path) as t:
                 try:
-                    # internal paths are always forward slashed on all platforms
-                    file_path = file_path.replace('\\', '/')
                     text = t.extractfile(file_path).read()
                     return text
                 except KeyError:
@@ -1108,6 +1197,97 @@ def prefix_files(prefix):
     return res
 
 
+class PrefixSnapshot(object):
+    '''
+    Record of the files in a prefix, for cheaply finding out what a build step added.
+
+    The first scan records (inode, mtime, size) for every file and symlink and a stamp for every
+    directory.  refresh() then stats each known directory and lists again only those whose stamp
+    changed, since adding, removing or renaming an entry always updates the containing
+    directory.  The stamp includes ctime, so tools that restore directory mtimes (tar, cp -a)
+    are still noticed, and directories changed within MTIME_SLACK seconds of the previous scan
+    are always listed again to allow for filesystems with coarse timestamps.
+
+    files is the same set of relative paths that prefix_files() returns.
+    '''
+    MTIME_SLACK = 2
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        # relative dir -> (stamp, {name: (inode, mtime, size)} of non-directories, subdir names)
+        self._dirs = {}
+        self._files = None
+        self._scan_time = None
+        self.refresh()
+
+    @staticmethod
+    def _list_dir(path):
+        entries, subdirs = {}, []
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return entries, subdirs
+        for name in names:
+            try:
+                st = os.lstat(join(path, name))
+            except OSError:
+                # removed since we listed the directory
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append(name)
+            else:
+                # files, and symlinks (including symlinks to directories, which are not followed)
+                entries[name] = (st.st_ino, st.st_mtime, st.st_size)
+        return entries, subdirs
+
+    def refresh(self):
+        '''Bring the snapshot up to date with the prefix.  Returns self.'''
+        scan_time = time.time()
+        seen = set()
+        changed = False
+        pending = ['']
+        while pending:
+            rel = pending.pop()
+            path = join(self.prefix, rel) if rel else self.prefix
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            seen.add(rel)
+            stamp = (st.st_ino, st.st_mtime, st.st_ctime)
+            known = self._dirs.get(rel)
+            if (known is None or known[0] != stamp or self._scan_time is None or
+                    max(st.st_mtime, st.st_ctime) >= self._scan_time - self.MTIME_SLACK):
+                entries, subdirs = self._list_dir(path)
+                if known is None or known[1] != entries or sorted(known[2]) != sorted(subdirs):
+                    changed = True
+                self._dirs[rel] = (stamp, entries, subdirs)
+            else:
+                subdirs = known[2]
+            pending.extend(join(rel, d) if rel else d for d in subdirs)
+        for rel in set(self._dirs) - seen:
+            del self._dirs[rel]
+            changed = True
+        self._scan_time = scan_time
+        if changed:
+            self._files = None
+        return self
+
+    @property
+    def files(self):
+        '''Set of all files (and symlinks) in the prefix, relative to it, as of the last scan.
+        A new set is returned each time, so callers may modify it.'''
+        if self._files is None:
+            self._files = set(join(rel, name) if rel else name
+                              for rel, (_, entries, _) in self._dirs.items()
+                              for name in entries)
+        return set(self._files)
+
+    def new_files(self, initial_files):
+        '''Refresh, then return the files that are not in initial_files.'''
+        return self.refresh().files - set(initial_files)
+
+
 def mmap_mmap(fileno, length, tagname=None, flags=0, prot=mmap_PROT_READ | mmap_PROT_WRITE,
               access=None, offset=0):
     '''
@@ -276,11 +276,13 @@ def dict_of_lists_to_list_of_dicts(dict_or_list_of_dicts, platform=cc_platform):
 def conform_variants_to_value(list_of_dicts, dict_of_values):
     """We want to remove some variability sometimes.  For example, when Python is used by the
     top-level recipe, we do not want a further matrix for the outputs.  This function reduces
-    the variability of the variant set."""
+    the variability of the variant set.  The input dicts are not modified."""
+    conformed = []
     for d in list_of_dicts:
-        for k, v in dict_of_values.items():
-            d[k] = v
-    return list(set([HashableDict(d) for d in list_of_dicts]))
+        d = dict(d)
+        d.update(dict_of_values)
+        conformed.append(HashableDict(d))
+    return list(set(conformed))
 
 
 def get_package_variants(recipedir_or_metadata, config=None):
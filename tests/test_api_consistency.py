@@ -91,8 +91,8 @@ def test_api_installable():
 def test_api_inspect_linkages():
     argspec = getargspec(api.inspect_linkages)
     assert argspec.args == ['packages', 'prefix', 'untracked', 'all_packages',
-                            'show_files', 'groupby', 'sysroot']
-    assert argspec.defaults == (sys.prefix, False, False, False, 'package', '')
+                            'show_files', 'groupby', 'sysroot', 'verify']
+    assert argspec.defaults == (sys.prefix, False, False, False, 'package', '', False)
 
 
 def test_api_inspect_objects():
@@ -117,5 +117,6 @@ def test_api_create_metapackage():
 
 def test_api_update_index():
     argspec = getargspec(api.update_index)
-    assert argspec.args == ['dir_paths', 'config', 'force', 'check_md5', 'remove']
-    assert argspec.defaults == (None, False, False, False)
+    assert argspec.args == ['dir_paths', 'config', 'force', 'check_md5', 'remove', 'threads',
+                            'compact']
+    assert argspec.defaults == (None, False, False, False, None, False)
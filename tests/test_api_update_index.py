@@ -1,10 +1,132 @@
+import bz2
+import gzip
+import json
 import os
 
+import pytest
+
 from conda_build import api
+from conda_build.conda_interface import hashsum_file, md5_file
+from conda_build import index
+from conda_build.index import read_index_and_file_info, update_index_for_packages
+
+from .utils import make_fake_package
 
 
 def test_update_index(testing_workdir, testing_config):
     api.update_index(testing_workdir, testing_config)
-    files = ".index.json", "repodata.json", "repodata.json.bz2"
+    files = (".index.sqlite", "repodata.json", "repodata.json.bz2", "repodata.json.gz",
+             "current_repodata.json")
     for f in files:
         assert os.path.isfile(os.path.join(testing_workdir, f))
+
+
+def test_read_index_and_file_info(testing_workdir):
+    fn = make_fake_package(testing_workdir, files={'lib/payload': os.urandom(100000)})
+    info = read_index_and_file_info(fn)
+    assert info['name'] == 'fake'
+    assert info['size'] == os.path.getsize(fn)
+    assert info['md5'] == md5_file(fn)
+    assert info['sha256'] == hashsum_file(fn, 'sha256')
+
+
+@pytest.mark.parametrize('threads', [None, 2])
+def test_update_index_threads(testing_workdir, testing_config, threads):
+    fns = [make_fake_package(testing_workdir, name='pkg%d' % i) for i in range(4)]
+    api.update_index(testing_workdir, testing_config, threads=threads)
+    repodata = _read_repodata(testing_workdir)
+    assert set(repodata['packages']) == set(os.path.basename(fn) for fn in fns)
+    for fn in fns:
+        assert repodata['packages'][os.path.basename(fn)]['md5'] == md5_file(fn)
+
+
+def _read_repodata(folder, basename='repodata.json'):
+    with open(os.path.join(folder, basename)) as f:
+        return json.load(f)
+
+
+def test_update_index_for_packages(testing_workdir, testing_config, mocker):
+    make_fake_package(testing_workdir, name='old')
+    api.update_index(testing_workdir, testing_config)
+    fn = make_fake_package(testing_workdir, name='new')
+    records = mocker.spy(index.IndexCache, 'records')
+    update_index_for_packages(testing_workdir, os.path.basename(fn))
+    # only the new package's record is read back; the rest comes from the last repodata written
+    assert [call[0][1:] for call in records.call_args_list] == [(['new-1.0-0.tar.bz2'], )]
+    packages = _read_repodata(testing_workdir)['packages']
+    assert set(packages) == {'old-1.0-0.tar.bz2', 'new-1.0-0.tar.bz2'}
+    assert packages['new-1.0-0.tar.bz2']['md5'] == md5_file(fn)
+
+
+def test_update_index_imports_legacy_index(testing_workdir, testing_config):
+    fn = make_fake_package(testing_workdir)
+    legacy = read_index_and_file_info(fn)
+    legacy['summary'] = 'from the legacy index'
+    with open(os.path.join(testing_workdir, '.index.json'), 'w') as f:
+        json.dump({os.path.basename(fn): legacy}, f)
+    api.update_index(testing_workdir, testing_config)
+    assert not os.path.isfile(os.path.join(testing_workdir, '.index.json'))
+    packages = _read_repodata(testing_workdir)['packages']
+    assert packages[os.path.basename(fn)]['summary'] == 'from the legacy index'
+
+
+def test_update_index_compact_and_current_repodata(testing_workdir, testing_config):
+    make_fake_package(testing_workdir, name='pkg', version='1.0')
+    make_fake_package(testing_workdir, name='pkg', version='2.0')
+    make_fake_package(testing_workdir, name='pkg', version='2.0', build='1')
+    api.update_index(testing_workdir, testing_config, compact=True)
+    with open(os.path.join(testing_workdir, 'repodata.json')) as f:
+        text = f.read()
+    assert '\n' not in text.rstrip('\n')
+    repodata = json.loads(text)
+    with open(os.path.join(testing_workdir, 'repodata.json.bz2'), 'rb') as f:
+        assert json.loads(bz2.decompress(f.read()).decode('utf-8')) == repodata
+    with gzip.open(os.path.join(testing_workdir, 'repodata.json.gz')) as f:
+        assert json.loads(f.read().decode('utf-8')) == repodata
+    current = _read_repodata(testing_workdir, 'current_repodata.json')
+    assert set(current['packages']) == {'pkg-2.0-0.tar.bz2', 'pkg-2.0-1.tar.bz2'}
+
+
+def test_deferred_index_updates(testing_workdir, testing_config):
+    make_fake_package(testing_workdir, name='old')
+    api.update_index(testing_workdir, testing_config)
+    with index.deferred_index_updates():
+        for name in ('new1', 'new2'):
+            fn = make_fake_package(testing_workdir, name=name)
+            index.add_packages_to_index(testing_workdir, os.path.basename(fn))
+        assert set(_read_repodata(testing_workdir)['packages']) == {'old-1.0-0.tar.bz2'}
+        assert index.pending_index_updates[testing_workdir] == {'new1-1.0-0.tar.bz2',
+                                                                'new2-1.0-0.tar.bz2'}
+    assert not index.pending_index_updates
+    assert set(_read_repodata(testing_workdir)['packages']) == {'old-1.0-0.tar.bz2',
+                                                                'new1-1.0-0.tar.bz2',
+                                                                'new2-1.0-0.tar.bz2'}
+
+
+def test_deferred_index_updates_applied_only_when_needed(testing_workdir, mocker, monkeypatch):
+    for name in ('cached_index', 'cached_local_index', 'local_index_fingerprint',
+                 'local_index_timestamp', 'local_subdir', 'cached_channels',
+                 'cached_index_hash'):
+        monkeypatch.setattr(index, name, getattr(index, name))
+    subdir_path = os.path.join(testing_workdir, 'linux-64')
+    os.makedirs(subdir_path)
+    api.update_index(subdir_path)
+    mocker.patch.object(index, 'get_index', return_value={})
+    flush = mocker.spy(index, 'flush_index_updates')
+    with index.deferred_index_updates():
+        fn = make_fake_package(subdir_path, name='new', subdir='linux-64')
+        index.add_packages_to_index(subdir_path, os.path.basename(fn))
+        index.get_build_index('linux-64', subdir_path, package_names=['python'])
+        assert not flush.called
+        index.get_build_index('linux-64', subdir_path, package_names=['new'])
+        assert flush.call_count == 1
+        assert not index.pending_index_updates
+
+
+def test_deferred_index_updates_keeps_the_original_error(testing_workdir, mocker):
+    mocker.patch.object(index, 'update_index_for_packages', side_effect=IOError('locked'))
+    with pytest.raises(ValueError):
+        with index.deferred_index_updates():
+            index.add_packages_to_index(testing_workdir, 'pkg-1.0-0.tar.bz2')
+            raise ValueError('build failed')
+    index.pending_index_updates.clear()
@@ -42,6 +42,29 @@ def test_find_prefix_files(testing_workdir):
     assert len(list(build.have_prefix_files(files, testing_workdir))) == len(files)
 
 
+@pytest.mark.parametrize('threads', [None, 4])
+def test_find_prefix_files_across_chunks(testing_workdir, mocker, threads):
+    # a tiny chunk size makes every needle straddle a chunk boundary
+    mocker.patch.object(build, 'PREFIX_SCAN_CHUNK_SIZE', 5)
+    prefix_bytes = testing_workdir.encode('utf-8')
+    with open('binary', 'wb') as f:
+        f.write(b'abc' * 10 + prefix_bytes + b'\x00' * 3)
+    with open('empty', 'wb') as f:
+        pass
+    with open('none.txt', 'w') as f:
+        f.write('nothing to see here\n')
+    found = list(build.have_prefix_files(['binary', 'empty', 'none.txt'], testing_workdir,
+                                         threads=threads))
+    assert found == [(testing_workdir, 'binary', 'binary')]
+
+
+def test_scan_for_needles_sharing_a_prefix(testing_workdir):
+    with open('binary', 'wb') as f:
+        f.write(b'abc/opt/prefix_placehold\x00abc')
+    needles = {b'/opt/prefix', b'/opt/prefix_placehold', b'\x00'}
+    assert build._scan_for_needles('binary', needles) == needles
+
+
 def test_build_preserves_PATH(testing_workdir, testing_config):
     m = api.render(os.path.join(metadata_dir, 'source_git'), config=testing_config)[0][0]
     ref_path = os.environ['PATH']
@@ -80,11 +103,14 @@ def test_get_short_path(testing_metadata):
     assert build.get_short_path(meta, "Scripts/test") == "python-scripts/test"
 
 
-def test_has_prefix():
-    files_with_prefix = [("prefix/path", "text", "short/path/1"),
-                         ("prefix/path", "text", "short/path/2")]
-    assert build.has_prefix("short/path/1", files_with_prefix) == ("prefix/path", "text")
-    assert build.has_prefix("short/path/nope", files_with_prefix) == (None, None)
+def test_build_info_files_json_first_prefix_entry_wins(testing_workdir, testing_metadata):
+    open("short", "a").close()
+    files_with_prefix = [("prefix/path", "text", "short"),
+                         ("other/path", "binary", "short")]
+    files_json = build.build_info_files_json_v1(testing_metadata, testing_workdir, ["short"],
+                                                files_with_prefix, threads=1)
+    assert files_json[0]["prefix_placeholder"] == "prefix/path"
+    assert files_json[0]["file_mode"] == "text"
 
 
 def test_is_no_link():
@@ -93,23 +119,6 @@ def test_is_no_link():
     assert build.is_no_link(no_link, "path/nope") is None
 
 
-@pytest.mark.skipif(on_win and sys.version[:3] == "2.7",
-                    reason="os.link is not available so can't setup test")
-def test_sorted_inode_first_path(testing_workdir):
-    path_one = os.path.join(testing_workdir, "one")
-    path_two = os.path.join(testing_workdir, "two")
-    path_one_hardlink = os.path.join(testing_workdir, "one_hl")
-    open(path_one, "a").close()
-    open(path_two, "a").close()
-
-    os.link(path_one, path_one_hardlink)
-
-    files = ["one", "two", "one_hl"]
-    assert build.get_inode_paths(files, "one", testing_workdir) == ["one", "one_hl"]
-    assert build.get_inode_paths(files, "one_hl", testing_workdir) == ["one", "one_hl"]
-    assert build.get_inode_paths(files, "two", testing_workdir) == ["two"]
-
-
 def test_create_info_files_json(testing_workdir, testing_metadata):
     info_dir = os.path.join(testing_workdir, "info")
     os.mkdir(info_dir)
@@ -142,6 +151,22 @@ def test_create_info_files_json(testing_workdir, testing_metadata):
         assert output == expected_output
 
 
+@pytest.mark.skipif(on_win, reason="symlinks need extra privileges on Windows")
+@pytest.mark.parametrize('threads', [1, 4])
+def test_build_info_files_json_symlink_and_hashes(testing_workdir, testing_metadata, threads):
+    with open("data", "w") as f:
+        f.write("abc")
+    os.symlink("data", "link")
+    files_json = build.build_info_files_json_v1(testing_metadata, testing_workdir,
+                                                ["link", "data"], [], threads=threads)
+    abc_sha256 = "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+    assert files_json == [
+        {"_path": "data", "path_type": build.PathType.hardlink, "sha256": abc_sha256,
+         "size_in_bytes": 3},
+        {"_path": "link", "path_type": build.PathType.softlink, "sha256": abc_sha256,
+         "size_in_bytes": 3}]
+
+
 @pytest.mark.skipif(on_win and sys.version[:3] == "2.7",
                     reason="os.link is not available so can't setup test")
 def test_create_info_files_json_no_inodes(testing_workdir, testing_metadata):
@@ -179,3 +204,42 @@ def test_create_info_files_json_no_inodes(testing_workdir, testing_metadata):
     with open(files_json_path, "r") as files_json:
         output = json.load(files_json)
         assert output == expected_output
+
+
+def test_tarcheck_uses_bundling_manifest(testing_workdir, testing_config, mocker):
+    from conda_build import tarcheck
+    read_manifest = mocker.spy(tarcheck, 'read_manifest')
+    index = {'name': 'pkg', 'version': '1.0', 'build_number': 0,
+             'subdir': testing_config.host_subdir}
+    manifest = ([('info/files', False), ('info/index.json', False), ('lib/a', False)],
+                {'info/files': b'lib/a\n', 'info/index.json': json.dumps(index).encode()})
+    # the package itself is never opened
+    tarcheck.check_all(os.path.join(testing_workdir, 'pkg-1.0-0.tar.bz2'), testing_config,
+                       manifest=manifest)
+    assert not read_manifest.called
+
+
+@pytest.mark.skipif(sys.version_info[0] == 2,
+                    reason="Python 2's bz2 module cannot read multi-stream files")
+def test_tarcheck_reads_multi_stream_package(testing_workdir, testing_config):
+    import tarfile
+    from conda_build import tarcheck, utils
+    index = {'name': 'pkg', 'version': '1.0', 'build_number': 0,
+             'subdir': testing_config.host_subdir}
+    contents = {'info/files': b'lib/a\n', 'info/index.json': json.dumps(index).encode(),
+                'lib/a': os.urandom(30000) * 2}
+    for path, data in contents.items():
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+    fn = os.path.join(testing_workdir, 'pkg-1.0-0.tar.bz2')
+    # small blocks, so that the package is made of several bz2 streams
+    with utils.ParallelBZ2Writer(fn, threads=2, block_size=20000) as compressed:
+        with tarfile.open(fileobj=compressed, mode='w') as t:
+            for path in sorted(contents):
+                t.add(path)
+    members, info_contents = tarcheck.read_manifest(fn)
+    assert [path for path, _ in members] == sorted(contents)
+    assert info_contents['info/files'] == b'lib/a\n'
+    tarcheck.check_all(fn, testing_config)
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from conda_build import api, conda_format, tarcheck, utils
+
+zstandard = pytest.importorskip('zstandard')
+
+
+def _make_conda_pkg(folder, subdir, name='fake', version='1.0', build='0'):
+    prefix = os.path.join(folder, 'prefix')
+    index = {'name': name, 'version': version, 'build': build, 'build_number': 0,
+             'depends': [], 'subdir': subdir}
+    contents = {'info/index.json': json.dumps(index),
+                'info/files': 'lib/payload\n',
+                'lib/payload': 'payload data\n'}
+    for path, data in contents.items():
+        path = os.path.join(prefix, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+    fn = os.path.join(folder, subdir, '{}-{}-{}.conda'.format(name, version, build))
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    return conda_format.create_conda_pkg(fn, prefix, sorted(contents))
+
+
+def test_conda_pkg_roundtrip(testing_workdir, testing_config):
+    fn = _make_conda_pkg(testing_workdir, testing_config.host_subdir)
+    assert json.loads(conda_format.read_info_file(fn, 'info/index.json').decode())['name'] == 'fake'
+    assert conda_format.read_info_file(fn, 'info/missing') is None
+    with conda_format.open_package(fn) as t:
+        assert t.getnames() == ['info/files', 'info/index.json', 'lib/payload']
+        assert t.extractfile('lib/payload').read() == b'payload data\n'
+    assert utils.package_has_file(fn, 'lib/payload') == b'payload data\n'
+    assert utils.package_has_file(fn, 'info/missing') is False
+    tarcheck.check_all(fn, testing_config)
+
+
+def test_update_index_lists_conda_pkgs_separately(testing_workdir, testing_config):
+    _make_conda_pkg(testing_workdir, 'noarch')
+    api.update_index(os.path.join(testing_workdir, 'noarch'), config=testing_config)
+    with open(os.path.join(testing_workdir, 'noarch', 'repodata.json')) as f:
+        repodata = json.load(f)
+    assert repodata['packages'] == {}
+    assert list(repodata['packages.conda']) == ['fake-1.0-0.conda']
@@ -68,3 +68,71 @@ def test_ensure_valid_spec():
     assert environ._ensure_valid_spec('python 2.7.12 0') == 'python 2.7.12 0'
     assert environ._ensure_valid_spec('python >=2.7,<2.8') == 'python >=2.7,<2.8'
     assert environ._ensure_valid_spec('numpy x.x') == 'numpy x.x'
+
+
+def test_solve_cache_roundtrip_and_eviction(testing_workdir):
+    cache = environ.SolveCache(os.path.join(testing_workdir, 'solves.sqlite'), max_entries=2)
+    dists = ['python-3.6.0-0', 'defaults::zlib-1.2.11-0']
+    cache.put('a', dists)
+    assert cache.get('a') == dists
+    cache.put('b', dists)
+    cache.get('a')
+    # 'b' is now the least recently used entry
+    cache.put('c', dists)
+    assert cache.get('b') is None
+    assert cache.get('a') == dists
+    assert cache.get('c') == dists
+
+
+def test_cached_solve_replans_against_current_state(testing_workdir, mocker):
+    cache = environ.SolveCache(os.path.join(testing_workdir, 'solves.sqlite'))
+    mocker.patch.object(environ, 'solve_cache', cache)
+    mocker.patch.object(environ, 'get_build_index', return_value=({}, 0))
+    mocker.patch.object(environ, 'get_build_index_hash', return_value='index-hash')
+    plans = [{'PREFIX': '/prefix', 'LINK': ['python-3.6.0-0'], 'FETCH': ['python-3.6.0-0']},
+             {'PREFIX': '/prefix', 'LINK': ['python-3.6.0-0']}]
+    install_actions = mocker.patch.object(environ, 'install_actions', side_effect=plans)
+
+    environ.cached_actions.clear()
+    assert environ.get_install_actions('/prefix', ('python', ), 'host',
+                                       bldpkgs_dirs=(testing_workdir, ))['FETCH']
+    # a new process: only the persisted solve is there.  Only the linked packages are taken from
+    #    it; the rest of the plan (nothing to fetch this time) comes from conda again.
+    environ.cached_actions.clear()
+    actions = environ.get_install_actions('/prefix', ('python', ), 'host',
+                                          bldpkgs_dirs=(testing_workdir, ))
+    assert 'FETCH' not in actions
+    assert install_actions.call_args[0][2] == ['defaults::python 3.6.0 0']
+
+
+def test_cached_solve_skipped_without_dist_fields(testing_workdir, mocker):
+    cache = environ.SolveCache(os.path.join(testing_workdir, 'solves.sqlite'))
+    cache.put('key', ['python-3.6.0-0'])
+    mocker.patch.object(environ, 'solve_cache', cache)
+    mocker.patch.object(environ, '_solve_cache_key', return_value='key')
+    mocker.patch.object(environ, 'get_build_index', return_value=({}, 0))
+    # conda < 4.3 only has a placeholder Dist class
+    mocker.patch.object(environ, 'Dist', type('Dist', (object, ), {}))
+    install_actions = mocker.patch.object(environ, 'install_actions',
+                                          return_value={'PREFIX': '/prefix', 'LINK': []})
+
+    environ.cached_actions.clear()
+    environ.get_install_actions('/prefix', ('python', ), 'host',
+                                bldpkgs_dirs=(testing_workdir, ))
+    assert install_actions.call_args[0][2] == ('python', )
+
+
+def test_pinned_specs_need_channel_names(mocker):
+    class FakeDist(object):
+        def __init__(self, dist_str):
+            self.channel, dist_name = dist_str.rsplit('::', 1)
+            self.name, self.version, self.build_string = dist_name.rsplit('-', 2)
+
+        def to_matchspec(self):
+            pass
+    mocker.patch.object(environ, 'Dist', FakeDist)
+    assert environ._pinned_specs(['conda-forge::zlib-1.2.11-0']) == [
+        'conda-forge::zlib 1.2.11 0']
+    # a URL is not a channel name that a match spec can hold
+    assert environ._pinned_specs(['conda-forge::zlib-1.2.11-0',
+                                  'file:///tmp/conda-bld::pkg-1.0-0']) is None
@@ -0,0 +1,53 @@
+import os
+
+from conda_build import index
+from conda_build.conda_interface import url_path
+
+from .utils import make_fake_package
+
+
+def test_get_build_index_merges_local_changes(testing_workdir, mocker, monkeypatch):
+    from conda_build import environ
+    # don't leave this test's fake index behind for later tests
+    for name in ('cached_index', 'cached_local_index', 'local_index_fingerprint',
+                 'local_index_timestamp', 'local_subdir', 'cached_channels',
+                 'cached_index_hash'):
+        monkeypatch.setattr(index, name, getattr(index, name))
+    # the index hash is only computed for the solve cache
+    mocker.patch.object(environ, 'solve_cache', True)
+    subdir_path = os.path.join(testing_workdir, 'linux-64')
+    os.makedirs(subdir_path)
+    make_fake_package(subdir_path, name='first', subdir='linux-64')
+    local_url = url_path(testing_workdir)
+
+    def fake_get_index(channel_urls, **kwargs):
+        # one record per local package, plus a record for each remote channel
+        records = {url: {'md5': url, 'url': url + '/linux-64/remote-1.0-0.tar.bz2'}
+                   for url in channel_urls if url != local_url}
+        if local_url in channel_urls:
+            records.update({fn: {'md5': fn, 'url': local_url + '/linux-64/' + fn}
+                            for fn in os.listdir(subdir_path) if fn.endswith('.tar.bz2')})
+        return records
+
+    get_index = mocker.patch.object(index, 'get_index', side_effect=fake_get_index)
+    cached_index, _ = index.get_build_index('linux-64', subdir_path, channel_urls=['remote'],
+                                            clear_cache=True)
+    assert set(cached_index) == {'remote', 'first-1.0-0.tar.bz2'}
+    # the local channel's records are picked out of the full index, not fetched again
+    assert get_index.call_count == 1
+    assert set(index.cached_local_index) == {'first-1.0-0.tar.bz2'}
+    calls = get_index.call_count
+    index_hash = index.get_build_index_hash()
+
+    # nothing changed: no index is read at all
+    index.get_build_index('linux-64', subdir_path, channel_urls=['remote'])
+    assert get_index.call_count == calls
+
+    # the local channel changed: only the local channel is re-read and merged in
+    fn = make_fake_package(subdir_path, name='second', subdir='linux-64')
+    index.update_index_for_packages(subdir_path, os.path.basename(fn))
+    cached_index, _ = index.get_build_index('linux-64', subdir_path, channel_urls=['remote'])
+    assert get_index.call_count == calls + 1
+    assert get_index.call_args[1]['channel_urls'] == [local_url]
+    assert set(cached_index) == {'remote', 'first-1.0-0.tar.bz2', 'second-1.0-0.tar.bz2'}
+    assert index.get_build_index_hash() != index_hash
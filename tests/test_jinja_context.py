@@ -128,3 +128,35 @@ def test_load_setup_py_data_from_setup_cfg(testing_config, tmpdir):
     assert setuptools_data['name'] == 'name_from_setup_py'
     assert setuptools_data['version'] == 'version_from_setup_cfg'
     assert setuptools_data['extras_require'] == {'extra': ['extra_package']}
+
+
+def test_template_code_cache_skips_recompile(testing_workdir, mocker):
+    import os
+    import jinja2
+    with open('meta.yaml', 'w') as f:
+        f.write('name: {{ name }}\n')
+    bytecode_dir = os.path.join(testing_workdir, 'bytecode')
+    cache = jinja_context.TemplateCodeCache(bytecode_dir)
+    compile_spy = mocker.spy(jinja2.Environment, 'compile')
+
+    def render(name):
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(testing_workdir),
+                                 bytecode_cache=cache)
+        return env.get_template('meta.yaml').render(name=name)
+
+    assert render('a') == 'name: a'
+    assert render('b') == 'name: b'
+    assert compile_spy.call_count == 1
+    assert os.listdir(bytecode_dir)
+
+    # a fresh process (empty memory cache) reads the compiled code back from disk
+    cache = jinja_context.TemplateCodeCache(bytecode_dir)
+    assert render('c') == 'name: c'
+    assert compile_spy.call_count == 1
+
+    # editing the recipe compiles it again
+    with open('meta.yaml', 'w') as f:
+        f.write('version: {{ name }}\n')
+    os.utime('meta.yaml', (0, 0))
+    assert render('d') == 'version: d'
+    assert compile_spy.call_count == 2
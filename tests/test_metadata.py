@@ -5,7 +5,7 @@ import sys
 import pytest
 
 from conda_build.metadata import select_lines, MetaData
-from conda_build import api, conda_interface, render
+from conda_build import api, conda_interface, render, metadata, variants
 from .utils import thisdir, metadata_dir
 
 
@@ -70,6 +70,38 @@ test {{ JINJA_VAR[:2] }}
 """
 
 
+def test_select_lines_unknown_selector_is_false(capsys):
+    lines = """
+keep  # [not foo]
+drop  # [foo or (abc and linux)]
+keep  # [abc and os.path.isabs("/")]
+"""
+    for _ in range(2):
+        assert select_lines(lines, {'abc': True, 'os': os}) == "\nkeep\nkeep\n"
+    out = capsys.readouterr()[0]
+    assert "unknown selector 'foo'" in out
+    assert "unknown selector 'linux'" in out
+    assert "'path'" not in out
+
+
+def test_ns_cfg_is_cached_per_variant(testing_config, mocker):
+    metadata.clear_ns_cfg_cache()
+    default_variants = mocker.spy(variants, 'get_default_variants')
+    testing_config.variant['python'] = '2.7'
+    assert metadata.ns_cfg(testing_config)['py'] == 27
+    assert metadata.ns_cfg(testing_config)['py27']
+    assert default_variants.call_count == 1
+
+    testing_config.variant['python'] = '3.6'
+    ns = metadata.ns_cfg(testing_config)
+    assert ns['py'] == 36 and ns['py3k']
+    assert default_variants.call_count == 2
+
+    # callers get their own copy
+    ns['py'] = 0
+    assert metadata.ns_cfg(testing_config)['py'] == 36
+
+
 def test_disallow_leading_period_in_version(testing_metadata):
     testing_metadata.meta['package']['version'] = '.ste.ve'
     testing_metadata.final = True
@@ -245,3 +277,30 @@ def test_config_member_decoupling(testing_metadata):
     b = testing_metadata.copy()
     b.config.some_member = '123'
     assert b.config.some_member != testing_metadata.config.some_member
+
+
+def test_meta_sections_copied_on_access(testing_metadata):
+    testing_metadata.meta['requirements'] = {'build': ['python']}
+    testing_metadata.meta['about'] = {'summary': 'original'}
+    b = testing_metadata.copy()
+    b.meta['requirements']['build'].append('numpy')
+    assert testing_metadata.meta['requirements'] == {'build': ['python']}
+    testing_metadata.get_section('about')['summary'] = 'changed'
+    assert b.get_value('about/summary') == 'original'
+    assert isinstance(b.meta, metadata.SharedSectionsDict)
+
+
+def test_meta_sections_handed_out_before_copy_are_isolated(testing_metadata):
+    testing_metadata.meta['build'] = {'number': 0}
+    build = testing_metadata.meta['build']
+    b = testing_metadata.copy()
+    build['number'] = 5
+    assert b.meta['build'] == {'number': 0}
+    # the original keeps the section it handed out instead of copying it again
+    assert testing_metadata.meta['build'] is build
+
+
+def test_pkg_fn_follows_package_format(testing_metadata):
+    assert testing_metadata.pkg_fn() == testing_metadata.dist() + '.tar.bz2'
+    testing_metadata.config.package_format = 'conda'
+    assert testing_metadata.pkg_fn() == testing_metadata.dist() + '.conda'
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+from conda_build.os_utils import ldd, pyldd
+from conda_build.utils import on_win
+
+
+def test_get_linkages_shares_one_parse_cache(testing_workdir, mocker):
+    cache_dir = os.path.join(testing_workdir, 'cache')
+    mocker.patch.object(ldd, 'linkage_cache_dir', return_value=cache_dir)
+    lib = os.path.join(testing_workdir, 'libfoo.so')
+
+    def inspect_file_linkages(path, sysroot, verify, memo=None):
+        if path == lib:
+            return [('libbar.so', 'not found')]
+        return [('libfoo.so', lib)]
+    inspect = mocker.patch.object(ldd, '_inspect_file_linkages',
+                                  side_effect=inspect_file_linkages)
+
+    expected = {'prog': [('libfoo.so', lib)], 'libfoo.so': [('libbar.so', 'not found')]}
+    assert ldd.get_linkages(['prog', 'libfoo.so'], testing_workdir, '', threads=2) == expected
+    memos = [call[1]['memo'] for call in inspect.call_args_list]
+    assert memos[0] is memos[1]
+    assert isinstance(memos[0].parse_cache, pyldd.codefile_parse_cache)
+    assert memos[0].parse_cache.cache_dir == cache_dir
+
+    ldd.get_linkages(['prog'], testing_workdir, '', threads=1, use_cache=False)
+    assert inspect.call_args[1]['memo'].parse_cache is None
+    # the cache is opt-in
+    mocker.patch.object(ldd, 'linkage_cache_dir', return_value=None)
+    ldd.get_linkages(['libfoo.so'], testing_workdir, '', threads=1)
+    assert inspect.call_args[1]['memo'].parse_cache is None
+
+
+@pytest.mark.skipif(on_win, reason="pyldd does not read PE files")
+def test_get_linkages_of_python(capsys):
+    prefix, exe = os.path.split(sys.executable)
+    pyldd_linkages = set((os.path.basename(lp), lp)
+                         for lp in pyldd.inspect_linkages(sys.executable, sysroot=''))
+
+    linkages = ldd.get_linkages([exe], prefix, '', verify=False, use_cache=False)
+    assert list(linkages) == [exe]
+    assert set(linkages[exe]) == pyldd_linkages
+
+    # ldd/otool gets the final say; whatever it finds is reported in the same shape
+    verified = ldd.get_linkages([exe], prefix, '', verify=True, use_cache=False)
+    assert list(verified) == [exe]
+    for name, path in verified[exe]:
+        assert name == os.path.basename(path) or path == 'not found'
+    if set(verified[exe]) != pyldd_linkages:
+        assert 'pyldd disagrees with ldd/otool' in capsys.readouterr().out
@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+
+import pytest
+
+from conda_build.os_utils import pyldd
+
+
+@pytest.mark.skipif(not sys.platform.startswith(('linux', 'darwin')),
+                    reason="pyldd reads ELF and Mach-O files")
+def test_linkage_graph_parses_each_file_once(mocker):
+    exe = os.path.realpath(sys.executable)
+    memo = pyldd.codefile_memo()
+    codefile = mocker.spy(pyldd, 'codefile')
+    graph = pyldd.linkage_graph([exe], memo=memo)
+    assert exe in graph
+    # every other node is a library that some node links to
+    resolved = set(path for links in graph.values() for _, path in links)
+    assert set(graph) - {exe} <= resolved
+    # symlinks to the same library share one parse
+    parsed = len(set(os.path.realpath(path) for path in graph))
+    assert codefile.call_count == parsed
+
+    assert pyldd.linkage_graph([exe, exe], memo=memo) == graph
+    assert pyldd.inspect_linkages(exe, memo=memo) == resolved
+    assert codefile.call_count == parsed
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="needs an ELF python")
+def test_elffile_mmap_and_read_parsers_agree():
+    exe = os.path.realpath(sys.executable)
+    with open(exe, 'rb') as f:
+        mapped = pyldd.elffile(f)
+        # a file object without a fileno cannot be mmap'ed
+        buf = io.BytesIO(f.read())
+    buf.name = exe
+    read = pyldd.elffile(buf)
+    for attr in ('dt_needed', 'dt_rpath', 'dt_runpath', 'rpath_entries', 'program_interpreter'):
+        assert getattr(mapped, attr) == getattr(read, attr)
+    assert mapped.program_interpreter
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="needs an ELF python")
+def test_elffile_find_section_and_offset():
+    with open(os.path.realpath(sys.executable), 'rb') as f:
+        elf = pyldd.elffile(f)
+    # .tbss is left out: it overlaps the sections after it but takes no address space
+    mapped = [es for es in elf.elfsections
+              if es.sh_flags & pyldd.SHF_ALLOC and es.sh_size and
+              not (es.sh_type == pyldd.SHT_NOBITS and es.sh_flags & pyldd.SHF_TLS)]
+    assert mapped
+    for es in mapped:
+        assert elf.find_section_and_offset(es.sh_addr) == (es, 0)
+        assert elf.find_section_and_offset(es.sh_addr + es.sh_size - 1) == (es, es.sh_size - 1)
+    # non-allocated sections (symbol tables, debug info) all have address 0
+    assert elf.find_section_and_offset(max(es.sh_addr + es.sh_size for es in mapped)) == \
+        (None, None)
+
+
+@pytest.mark.skipif(not sys.platform.startswith(('linux', 'darwin')),
+                    reason="pyldd reads ELF and Mach-O files")
+def test_codefile_parse_cache_is_resolved_on_every_run(testing_workdir, mocker):
+    cache = pyldd.codefile_parse_cache(os.path.join(testing_workdir, 'cache'))
+    for folder in ('bin', 'lib', 'lib2'):
+        os.makedirs(os.path.join(testing_workdir, folder))
+    prog = os.path.join(testing_workdir, 'bin', 'prog')
+    with open(prog, 'w') as f:
+        f.write('not really a program')
+    with open(os.path.join(testing_workdir, 'lib', 'libfoo.so'), 'w') as f:
+        f.write('not really a library')
+    parsed = pyldd.codefile_linkages([('libfoo.so', '$RPATH/libfoo.so')],
+                                     ['$SELFDIR/../lib2', '$SELFDIR/../lib'], [])
+    codefile = mocker.patch.object(pyldd, 'codefile', return_value=parsed)
+
+    def resolved():
+        # a new memo for each call, like separate runs
+        return pyldd._inspect_linkages_this(prog, memo=pyldd.codefile_memo(cache))[1]
+
+    bindir = os.path.dirname(prog)
+    assert resolved() == [os.path.join(bindir, '../lib', 'libfoo.so')]
+    assert codefile.call_count == 1
+    # a library installed later, earlier on the rpath, is found even though the parse is cached
+    with open(os.path.join(testing_workdir, 'lib2', 'libfoo.so'), 'w') as f:
+        f.write('not really a library either')
+    assert resolved() == [os.path.join(bindir, '../lib2', 'libfoo.so')]
+    assert codefile.call_count == 1
+    # new contents need a new parse
+    with open(prog, 'w') as f:
+        f.write('a new build of the program')
+    resolved()
+    assert codefile.call_count == 2
+
+
+def test_rpath_rewritable_in_place_respects_shared_strings():
+    elf = pyldd.elffile.__new__(pyldd.elffile)
+    elf.dynstr = b'\0libfoo.so\0/old/lib\0'
+    elf.rpath_entries = [pyldd.elfrpath(pyldd.DT_RPATH, 0, 11, 0, '/old/lib')]
+    elf.dynstr_refs = [1, 11]
+    assert elf.rpath_rewritable_in_place('/new/lib')
+    assert not elf.rpath_rewritable_in_place('/longer/lib')
+    # linkers merge 'lib' into the tail of '/old/lib'
+    elf.dynstr_refs = [1, 11, 16]
+    assert not elf.rpath_rewritable_in_place('/new/lib')
+    # a string that starts before the rpath and runs on into it
+    elf.dynstr = b'\0libfoo.so/old/lib\0'
+    elf.rpath_entries = [pyldd.elfrpath(pyldd.DT_RPATH, 0, 10, 0, '/old/lib')]
+    elf.dynstr_refs = [1, 10]
+    assert not elf.rpath_rewritable_in_place('/new/lib')
+    # something we cannot read refers to the string table
+    elf.dynstr_refs = None
+    assert not elf.rpath_rewritable_in_place('/new/lib')
@@ -1,26 +1,33 @@
 import os
 import shutil
 import sys
+import time
 
 import pytest
 
 from conda_build import post
-from conda_build.utils import on_win
+from conda_build.os_utils import pyldd
+from conda_build.os_utils.external import find_executable
+from conda_build.utils import check_call_env, on_win
 
 from .utils import add_mangling
 
 
-def test_compile_missing_pyc(testing_workdir):
+@pytest.mark.parametrize('workers', [1, 2])
+def test_compile_missing_pyc(testing_workdir, mocker, workers):
     good_files = ['f1.py', 'f3.py']
     bad_file = 'f2_bad.py'
     tmp = os.path.join(testing_workdir, 'tmp')
     shutil.copytree(os.path.join(os.path.dirname(__file__), 'test-recipes',
                                  'metadata', '_compile-test'), tmp)
-    post.compile_missing_pyc(os.listdir(tmp), cwd=tmp,
-                                python_exe=sys.executable)
+    # split even this small batch over several interpreters
+    mocker.patch.object(post, 'PYC_FILES_PER_WORKER', 1)
+    failures = post.compile_missing_pyc(os.listdir(tmp), cwd=tmp,
+                                        python_exe=sys.executable, workers=workers)
     for f in good_files:
         assert os.path.isfile(os.path.join(tmp, add_mangling(f)))
     assert not os.path.isfile(os.path.join(tmp, add_mangling(bad_file)))
+    assert [(failure.path, failure.error) for failure in failures] == [(bad_file, 'SyntaxError')]
 
 
 @pytest.mark.skipif(on_win, reason="no linking on win")
@@ -39,6 +46,50 @@ def test_hardlinks_to_copies(testing_workdir):
     assert os.lstat('test2').st_nlink == 1
 
 
+@pytest.mark.skipif(on_win, reason="no linking on win")
+def test_post_build_output_in_file_order(testing_metadata, testing_workdir, mocker, capsys):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    os.makedirs(os.path.join(prefix, 'bin'))
+    files = ['bin/tool%d' % i for i in range(20)]
+    for f in files:
+        with open(os.path.join(prefix, f), 'w') as fh:
+            fh.write('#!/bin/sh\n')
+    os.link(os.path.join(prefix, files[0]), os.path.join(prefix, 'bin', 'extra'))
+
+    def fix_shebang(f, prefix, build_python, osx_is_app=False, file_class=None):
+        # make later files finish first
+        time.sleep(0.001 * (len(files) - files.index(f)))
+        return ['shebang: ' + f]
+    mocker.patch.object(post, '_fix_shebang', side_effect=fix_shebang)
+    mocker.patch.object(post.environ, 'get_cpu_count', return_value='4')
+    mocker.patch.object(testing_metadata, 'binary_relocation', return_value=False)
+
+    post.post_build(testing_metadata, files, prefix, sys.executable, testing_workdir)
+    out = capsys.readouterr()[0]
+    assert [line for line in out.splitlines() if line.startswith('shebang:')] == [
+        'shebang: ' + f for f in files]
+    assert os.lstat(os.path.join(prefix, files[0])).st_nlink == 1
+    assert sorted(os.listdir(os.path.join(prefix, 'bin'))) == sorted(
+        [os.path.basename(f) for f in files] + ['extra'])
+
+
+def test_run_per_file_emits_messages_before_raising(capsys):
+    def task(f, messages):
+        messages.append((print, 'working on ' + f))
+        if f == 'b':
+            raise SystemExit('failed on b')
+        messages.append((post.utils.get_logger(__name__).warn, 'warning for ' + f))
+        return {'stage': 1.0}
+
+    stage_times = post.defaultdict(float)
+    with pytest.raises(SystemExit):
+        post._run_per_file(['a', 'b', 'c'], task, 2, stage_times)
+    out = capsys.readouterr()[0]
+    # b's own output, and that of the files after it, are not lost
+    assert out.splitlines() == ['working on a', 'working on b', 'working on c']
+    assert stage_times['stage'] == 2.0
+
+
 def test_postbuild_files_raise(testing_metadata, testing_workdir):
     fn = 'buildstr', 'buildnum', 'version'
     for f in fn:
@@ -48,3 +99,103 @@ def test_postbuild_files_raise(testing_metadata, testing_workdir):
         with pytest.raises(ValueError) as exc:
             post.get_build_metadata(testing_metadata)
         assert f in str(exc)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF rpaths are linux only")
+def test_mk_relative_linux_rewrites_rpath_in_place(testing_workdir, mocker):
+    elf = os.path.join(testing_workdir, 'bin', 'python')
+    os.makedirs(os.path.dirname(elf))
+    shutil.copy2(os.path.realpath(sys.executable), elf)
+    if len(pyldd.get_elf_rpath(elf)) < len('$ORIGIN/../lib'):
+        pytest.skip("the test python's rpath is too short to be rewritten in place")
+    popen = mocker.patch.object(post, 'Popen')
+    post.mk_relative_linux('bin/python', testing_workdir, rpaths=['lib'])
+    assert not popen.called
+    assert pyldd.get_elf_rpath(elf) == '$ORIGIN/../lib'
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF rpaths are linux only")
+def test_mk_relative_linux_skips_elf_without_dynamic_section(testing_workdir, mocker):
+    cc = find_executable('cc')
+    if not cc:
+        pytest.skip("needs a C compiler to build an object file")
+    with open('foo.c', 'w') as f:
+        f.write('int foo(void) { return 0; }\n')
+    check_call_env([cc, '-c', 'foo.c', '-o', 'foo.o'])
+    assert pyldd.get_elf_rpath('foo.o') is None
+    popen = mocker.patch.object(post, 'Popen')
+    post.mk_relative_linux('foo.o', testing_workdir, rpaths=['lib'])
+    assert not popen.called
+
+
+def test_classify_files(testing_workdir):
+    with open('script', 'w') as f:
+        f.write('#!/usr/bin/env python\nprint("hi")\n')
+    with open('libfoo.so', 'wb') as f:
+        f.write(b'\x7fELF' + b'\0' * 60)
+    open('empty', 'w').close()
+    files = ['script', 'libfoo.so', 'empty']
+    if not on_win:
+        os.symlink('libfoo.so', 'libfoo.so.1')
+        files.append('libfoo.so.1')
+    classes = post.classify_files(files, testing_workdir)
+    assert classes['script'] == post.FileClass(is_elf=False, is_macho=False, has_shebang=True)
+    assert classes['libfoo.so'].is_elf and classes['libfoo.so'].is_obj
+    assert not classes['empty'].is_obj
+    # symlinks are skipped, like is_obj does
+    assert classes.get('libfoo.so.1', post.NOT_A_FILE) == post.NOT_A_FILE
+    for f in files:
+        assert classes[f].is_obj == post.is_obj(os.path.join(testing_workdir, f))
+
+
+@pytest.mark.skipif(on_win, reason="no linking on win")
+def test_check_symlinks_keeps_links_to_objects_in_other_dirs(testing_workdir):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    for folder in ('bin', 'lib'):
+        os.makedirs(os.path.join(prefix, folder))
+    with open(os.path.join(prefix, 'lib', 'libfoo.so'), 'wb') as f:
+        f.write(b'\x7fELF' + b'\0' * 60)
+    os.symlink('../lib/libfoo.so', os.path.join(prefix, 'bin', 'libfoo.so'))
+    files = ['bin/libfoo.so', 'lib/libfoo.so']
+    classes = post.classify_files(files, prefix)
+    post.check_symlinks(files, prefix, os.path.join(testing_workdir, 'croot'), classes)
+    # the link is classified as itself, not as an object file, so it stays a link
+    assert os.path.islink(os.path.join(prefix, 'bin', 'libfoo.so'))
+    assert os.path.realpath(os.path.join(prefix, 'bin', 'libfoo.so')) == \
+        os.path.realpath(os.path.join(prefix, 'lib', 'libfoo.so'))
+    assert classes['bin/libfoo.so'] == post.NOT_A_FILE
+
+    # a link the table says is an object file is replaced by a copy, which is reclassified
+    classes['bin/libfoo.so'] = post.FileClass(is_elf=True, is_macho=False, has_shebang=False)
+    post.check_symlinks(['bin/libfoo.so'], prefix, os.path.join(testing_workdir, 'croot'),
+                        classes)
+    assert not os.path.islink(os.path.join(prefix, 'bin', 'libfoo.so'))
+    assert classes['bin/libfoo.so'] == post.classify_file(os.path.join(prefix, 'bin',
+                                                                       'libfoo.so'))
+
+
+@pytest.mark.skipif(on_win, reason="no linking on win")
+def test_check_symlinks_keeps_soname_chains_in_one_dir(testing_workdir):
+    lib = os.path.join(testing_workdir, 'prefix', 'lib')
+    os.makedirs(lib)
+    with open(os.path.join(lib, 'libz.so.1.2.13'), 'wb') as f:
+        f.write(b'\x7fELF' + b'\0' * 60)
+    os.symlink('libz.so.1.2.13', os.path.join(lib, 'libz.so.1'))
+    os.symlink('libz.so.1', os.path.join(lib, 'libz.so'))
+    files = ['lib/libz.so', 'lib/libz.so.1', 'lib/libz.so.1.2.13']
+    prefix = os.path.dirname(lib)
+    classes = post.classify_files(files, prefix)
+    post.check_symlinks(files, prefix, os.path.join(testing_workdir, 'croot'), classes)
+    for link in ('libz.so', 'libz.so.1'):
+        assert os.path.islink(os.path.join(lib, link))
+        assert os.path.realpath(os.path.join(lib, link)) == \
+            os.path.realpath(os.path.join(lib, 'libz.so.1.2.13'))
+
+
+def test_find_lib_uses_known_prefix_files(testing_workdir, mocker):
+    prefix_files = mocker.patch.object(post.utils, 'prefix_files')
+    files = {'lib/libfoo.dylib', 'bin/tool'}
+    assert post.find_lib('libfoo.dylib', testing_workdir, files=files) == 'lib/libfoo.dylib'
+    assert post.find_lib(os.path.join(testing_workdir, 'lib', 'libfoo.dylib'), testing_workdir,
+                         files=files) == 'lib/libfoo.dylib'
+    assert not prefix_files.called
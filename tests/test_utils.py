@@ -254,3 +254,54 @@ root:
     assert 'test message' in out
     # make sure that it is not in stderr - this is testing override of defaults.
     assert 'test message' not in err
+
+
+@pytest.mark.skipif(sys.version_info[0] == 2,
+                    reason="Python 2's bz2 module cannot read multi-stream files")
+def test_parallel_bz2_writer_roundtrip(testing_workdir):
+    import tarfile
+    contents = {'info/index.json': b'{}', 'lib/data': os.urandom(50000) * 4}
+    for path, data in contents.items():
+        makefile(path)
+        with open(path, 'wb') as f:
+            f.write(data)
+    with utils.ParallelBZ2Writer('out.tar.bz2', threads=4, block_size=20000) as writer:
+        with tarfile.open(fileobj=writer, mode='w') as t:
+            for path in sorted(contents):
+                t.add(path)
+    with tarfile.open('out.tar.bz2') as t:
+        assert t.getnames() == ['info/index.json', 'lib/data']
+        for path, data in contents.items():
+            assert t.extractfile(path).read() == data
+
+
+def test_parallel_bz2_writer_removes_output_on_error(testing_workdir):
+    with pytest.raises(RuntimeError):
+        with utils.ParallelBZ2Writer('out.tar.bz2', threads=2, block_size=100) as writer:
+            writer.write(b'x' * 1000)
+            raise RuntimeError('adding a file failed')
+    assert not os.path.exists('out.tar.bz2')
+
+
+def test_prefix_snapshot_matches_prefix_files(testing_workdir):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    for path in ('bin/tool', 'lib/libfoo.so', 'lib/python/site.py', 'share/doc/README'):
+        makefile(os.path.join(prefix, path))
+    if not utils.on_win:
+        os.symlink('python', os.path.join(prefix, 'lib', 'python-link'))
+    snapshot = utils.PrefixSnapshot(prefix)
+    initial_files = snapshot.files
+    assert initial_files == utils.prefix_files(prefix)
+
+    makefile(os.path.join(prefix, 'lib', 'python', 'new.py'))
+    makefile(os.path.join(prefix, 'include', 'sub', 'foo.h'))
+    os.remove(os.path.join(prefix, 'share', 'doc', 'README'))
+    # like tar and cp -a, put the directory's old mtime back after adding to it
+    lib_stat = os.stat(os.path.join(prefix, 'lib'))
+    makefile(os.path.join(prefix, 'lib', 'libbar.so'))
+    os.utime(os.path.join(prefix, 'lib'), (lib_stat.st_atime, lib_stat.st_mtime))
+
+    new_files = snapshot.new_files(initial_files)
+    assert snapshot.files == utils.prefix_files(prefix)
+    assert new_files == set(os.path.join(*f.split('/')) for f in (
+        'lib/python/new.py', 'include/sub/foo.h', 'lib/libbar.so'))
@@ -98,6 +98,15 @@ def test_variant_with_numpy_pinned_has_matrix():
     assert len(metadata) == 4
 
 
+def test_parallel_variant_rendering_matches_serial():
+    recipe = os.path.join(recipe_dir, '04_numpy_matrix_pinned')
+    serial = api.render(recipe, finalize=False)
+    parallel = api.render(recipe, finalize=False, render_processes=2)
+    assert [m.dist() for m, _, _ in parallel] == [m.dist() for m, _, _ in serial]
+    assert ([m.config.variant for m, _, _ in parallel] ==
+            [m.config.variant for m, _, _ in serial])
+
+
 def test_pinning_in_build_requirements():
     recipe = os.path.join(recipe_dir, '05_compatible')
     metadata = api.render(recipe)[0][0]
@@ -163,3 +172,10 @@ def test_variants_in_output_names():
     recipe = os.path.join(recipe_dir, '11_variant_output_names')
     outputs = api.get_output_file_paths(recipe)
     assert len(outputs) == 4
+
+
+def test_conform_variants_to_value_leaves_input_alone():
+    original = [{'python': '2.7', 'numpy': '1.11'}, {'python': '3.5', 'numpy': '1.11'}]
+    conformed = variants.conform_variants_to_value(original, {'python': '3.6'})
+    assert conformed == [{'python': '3.6', 'numpy': '1.11'}]
+    assert original[0]['python'] == '2.7'
@@ -1,7 +1,10 @@
 import contextlib
+import io
+import json
 import os
 import sys
 import shlex
+import tarfile
 
 
 import pytest
@@ -106,6 +109,23 @@ def assert_package_consistency(package_path):
     assert len(errors) == 0, '\n'.join(errors)
 
 
+def make_fake_package(folder, name='fake', version='1.0', build='0', subdir='noarch',
+                      files=None):
+    """Write a minimal .tar.bz2 package containing info/index.json (and optionally other
+    files, given as a dict of archive path to bytes).  Returns the path to the tarball."""
+    index = {'name': name, 'version': version, 'build': build, 'build_number': 0,
+             'depends': [], 'subdir': subdir}
+    members = [('info/index.json', json.dumps(index).encode('utf-8'))]
+    members.extend(sorted((files or {}).items()))
+    fn = os.path.join(folder, '{}-{}-{}.tar.bz2'.format(name, version, build))
+    with tarfile.open(fn, 'w:bz2') as t:
+        for path, data in members:
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+    return fn
+
+
 @contextlib.contextmanager
 def put_bad_conda_on_path(testing_workdir):
     path_backup = os.environ['PATH']